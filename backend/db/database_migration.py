@@ -1,11 +1,35 @@
 """
-Database migration script to add category column to ingredients table
-and update existing ingredients with categories
+Database migration scripts for bringing existing databases up to date
+with the current models (fresh databases are created by db.database)
 """
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 from db.base import engine, SessionLocal
 
 
+def add_column_if_missing(table: str, column: str, definition: str):
+    """
+    Add a column to an existing table, skipping it if it is already there
+
+    Args:
+        table: Table name
+        column: Column name
+        definition: Column type and constraints, e.g. "INTEGER NOT NULL DEFAULT 1"
+    """
+    print(f"Adding {column} column to {table} table...")
+    with engine.connect() as connection:
+        try:
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+            ))
+            connection.commit()
+            print(f"Column {table}.{column} added successfully!")
+        except Exception as e:
+            if "Duplicate column name" in str(e) or "already exists" in str(e):
+                print(f"Column {table}.{column} already exists, skipping...")
+            else:
+                raise e
+
+
 def migrate_ingredient_categories():
     """
     Add category column to ingredients table and categorize existing ingredients
@@ -29,164 +53,14 @@ def migrate_ingredient_categories():
                 else:
                     raise e
 
-        # Update existing ingredients with appropriate categories using raw SQL
+        # Update existing ingredients with categories derived from their names
         print("Categorizing existing ingredients...")
 
-        # Define ingredient mappings (name pattern -> category)
-        ingredient_categories = {
-            # Vegetables
-            "onion": "vegetables",
-            "garlic": "vegetables",
-            "tomato": "vegetables",
-            "carrot": "vegetables",
-            "potato": "vegetables",
-            "bell pepper": "vegetables",
-            "pepper": "vegetables",
-            "mushroom": "vegetables",
-            "spinach": "vegetables",
-            "broccoli": "vegetables",
-            "zucchini": "vegetables",
-            "cucumber": "vegetables",
-            "lettuce": "vegetables",
-
-            # Fruits
-            "apple": "fruits",
-            "lemon": "fruits",
-            "orange": "fruits",
-            "banana": "fruits",
-            "lime": "fruits",
-            "berry": "fruits",
-            "grape": "fruits",
-
-            # Meat & Poultry
-            "chicken": "meat_poultry",
-            "beef": "meat_poultry",
-            "pork": "meat_poultry",
-            "turkey": "meat_poultry",
-            "lamb": "meat_poultry",
-            "duck": "meat_poultry",
-            "meat": "meat_poultry",
-
-            # Seafood
-            "salmon": "seafood",
-            "tuna": "seafood",
-            "shrimp": "seafood",
-            "cod": "seafood",
-            "fish": "seafood",
-            "crab": "seafood",
-            "lobster": "seafood",
-
-            # Dairy & Eggs
-            "milk": "dairy",
-            "butter": "dairy",
-            "cheese": "dairy",
-            "cream": "dairy",
-            "yogurt": "dairy",
-            "egg": "dairy",
-            "mozzarella": "dairy",
-            "parmesan": "dairy",
-            "cheddar": "dairy",
-
-            # Grains & Cereals
-            "pasta": "grains_cereals",
-            "spaghetti": "grains_cereals",
-            "rice": "grains_cereals",
-            "flour": "grains_cereals",
-            "bread": "grains_cereals",
-            "oats": "grains_cereals",
-            "quinoa": "grains_cereals",
-            "barley": "grains_cereals",
-            "wheat": "grains_cereals",
-
-            # Legumes & Nuts
-            "bean": "legumes",
-            "lentil": "legumes",
-            "chickpea": "legumes",
-            "almond": "legumes",
-            "walnut": "legumes",
-            "peanut": "legumes",
-            "cashew": "legumes",
-            "pistachio": "legumes",
-
-            # Herbs & Spices
-            "basil": "herbs_spices",
-            "oregano": "herbs_spices",
-            "thyme": "herbs_spices",
-            "rosemary": "herbs_spices",
-            "parsley": "herbs_spices",
-            "salt": "herbs_spices",
-            "pepper": "herbs_spices",
-            "paprika": "herbs_spices",
-            "cumin": "herbs_spices",
-            "cinnamon": "herbs_spices",
-            "ginger": "herbs_spices",
-            "turmeric": "herbs_spices",
-
-            # Oils & Fats
-            "oil": "oils_fats",
-            "olive oil": "oils_fats",
-            "coconut oil": "oils_fats",
-            "vegetable oil": "oils_fats",
-            "canola oil": "oils_fats",
-            "avocado oil": "oils_fats",
-
-            # Condiments & Sauces
-            "vinegar": "condiments",
-            "soy sauce": "condiments",
-            "honey": "condiments",
-            "mustard": "condiments",
-            "ketchup": "condiments",
-            "mayonnaise": "condiments",
-            "sauce": "condiments",
-
-            # Beverages
-            "water": "beverages",
-            "wine": "beverages",
-            "stock": "beverages",
-            "broth": "beverages",
-            "juice": "beverages",
-            "beer": "beverages",
-
-            # Other/Baking
-            "sugar": "other",
-            "brown sugar": "other",
-            "baking powder": "other",
-            "baking soda": "other",
-            "vanilla": "other",
-            "cocoa": "other",
-            "chocolate": "other",
-            "yeast": "other",
-        }
-
-        with engine.connect() as connection:
-            # Get all ingredients
-            result = connection.execute(
-                text("SELECT id, name FROM ingredients"))
-            ingredients = result.fetchall()
-
-            updated_count = 0
-            for ingredient in ingredients:
-                ingredient_id = ingredient[0]
-                ingredient_name = ingredient[1].lower()
-
-                # Find matching category
-                matched_category = "other"  # default
-                for name_pattern, category in ingredient_categories.items():
-                    if name_pattern in ingredient_name:
-                        matched_category = category
-                        break
-
-                # Update the ingredient with the category
-                connection.execute(text(
-                    "UPDATE ingredients SET category = :category WHERE id = :id"
-                ), {"category": matched_category, "id": ingredient_id})
-
-                updated_count += 1
-                print(
-                    f"  Categorized '{ingredient[1]}' as '{matched_category}'")
-
-            connection.commit()
-            print(f"Successfully categorized {updated_count} ingredients")
+        # Longest matching name pattern wins ("bell pepper" over "pepper")
+        from db.entries.Ingredient import normalize_name
+        from services.categorizer import recategorize_ingredients
+        scanned, changed = recategorize_ingredients(engine)
+        print(f"Categorized {scanned} ingredients, {changed} changed category")
 
         # Add sample ingredients with categories if database has few ingredients
         with engine.connect() as connection:
@@ -255,14 +129,16 @@ def migrate_ingredient_categories():
                 added_count = 0
                 for name, unit, category in sample_ingredients:
                     # Check if ingredient already exists
+                    normalized_name = normalize_name(name)
                     result = connection.execute(text(
-                        "SELECT COUNT(*) FROM ingredients WHERE LOWER(name) = LOWER(:name)"
-                    ), {"name": name})
+                        "SELECT COUNT(*) FROM ingredients WHERE normalized_name = :normalized_name"
+                    ), {"normalized_name": normalized_name})
 
                     if result.scalar() == 0:
                         connection.execute(text(
-                            "INSERT INTO ingredients (name, unit, category, created_at, updated_at) VALUES (:name, :unit, :category, NOW(), NOW())"
-                        ), {"name": name, "unit": unit, "category": category})
+                            "INSERT INTO ingredients (name, normalized_name, unit, category, created_at, updated_at) VALUES (:name, :normalized_name, :unit, :category, NOW(), NOW())"
+                        ), {"name": name, "normalized_name": normalized_name,
+                            "unit": unit, "category": category})
                         added_count += 1
                         print(
                             f"  Added sample ingredient: {name} ({category})")
@@ -277,5 +153,291 @@ def migrate_ingredient_categories():
         raise
 
 
+def create_index_if_missing(table: str, name: str, columns: str, unique: bool = False):
+    """
+    Create an index on an existing table, skipping it if it is already there
+
+    Args:
+        table: Table name
+        name: Index name
+        columns: Comma separated column list
+        unique: Create a UNIQUE index
+    """
+    print(f"Creating index {name} on {table}...")
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    with engine.connect() as connection:
+        try:
+            connection.execute(text(f"CREATE {kind} {name} ON {table} ({columns})"))
+            connection.commit()
+            print(f"Index {name} created successfully!")
+        except Exception as e:
+            if "Duplicate key name" in str(e) or "already exists" in str(e):
+                print(f"Index {name} already exists, skipping...")
+            else:
+                raise e
+
+
+def migrate_recipe_version():
+    """
+    Add the optimistic locking version column to recipes
+    """
+    add_column_if_missing("recipes", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+def migrate_idempotency_keys():
+    """
+    Create the idempotency_keys table used to deduplicate retried POSTs
+    """
+    from db.entries.IdempotencyKey import IdempotencyKey
+
+    print("Creating idempotency_keys table...")
+    IdempotencyKey.__table__.create(engine, checkfirst=True)
+    # Claim lease, for tables created before it existed
+    add_column_if_missing("idempotency_keys", "claim_token", "VARCHAR(32) NULL")
+    add_column_if_missing(
+        "idempotency_keys", "claimed_at", "DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP")
+
+
+# (table, column, referenced table, ON DELETE action)
+CASCADING_FOREIGN_KEYS = [
+    ("steps", "recipe_id", "recipes", "CASCADE"),
+    ("recipe_ingredients", "recipe_id", "recipes", "CASCADE"),
+    ("recipe_ingredients", "step_id", "steps", "SET NULL"),
+]
+
+
+def migrate_cascading_foreign_keys():
+    """
+    Recreate recipe child foreign keys with ON DELETE rules so the database,
+    not the ORM, removes steps and ingredients of deleted recipes
+    """
+    print("Updating recipe foreign keys with ON DELETE rules...")
+    inspector = inspect(engine)
+
+    with engine.connect() as connection:
+        for table, column, referenced, on_delete in CASCADING_FOREIGN_KEYS:
+            foreign_keys = [
+                fk for fk in inspector.get_foreign_keys(table)
+                if fk["constrained_columns"] == [column]
+            ]
+            if any((fk["options"].get("ondelete") or "").upper() == on_delete
+                   for fk in foreign_keys):
+                print(f"  {table}.{column} already uses ON DELETE {on_delete}, skipping...")
+                continue
+
+            for fk in foreign_keys:
+                connection.execute(text(
+                    f"ALTER TABLE {table} DROP FOREIGN KEY {fk['name']}"
+                ))
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT fk_{table}_{column} "
+                f"FOREIGN KEY ({column}) REFERENCES {referenced} (id) ON DELETE {on_delete}"
+            ))
+            print(f"  {table}.{column} now uses ON DELETE {on_delete}")
+
+        connection.commit()
+
+
+def migrate_soft_delete():
+    """
+    Add deleted_at tombstone columns to recipes and users
+    """
+    for table in ("recipes", "users"):
+        add_column_if_missing(table, "deleted_at", "DATETIME NULL")
+        create_index_if_missing(table, f"ix_{table}_deleted_at", "deleted_at")
+
+
+def migrate_cache_versions():
+    """
+    Create the cache_versions table that keeps worker caches coherent
+    """
+    from db.entries.CacheVersion import CacheVersion
+
+    print("Creating cache_versions table...")
+    CacheVersion.__table__.create(engine, checkfirst=True)
+
+
+def migrate_ingredient_normalized_names():
+    """
+    Add the normalized_name column to ingredients, merge ingredients whose
+    names only differ in case, accents or spacing, and enforce uniqueness.
+
+    The oldest ingredient of each duplicate group survives; recipe ingredients
+    pointing at the others are moved to it before they are deleted.
+    """
+    from db.entries.Ingredient import normalize_name
+    from services.cache import bump_cache_version
+    from services.ingredient_catalog import INGREDIENT_CATALOG
+
+    add_column_if_missing("ingredients", "normalized_name", "VARCHAR(255) NULL")
+
+    print("Backfilling normalized ingredient names...")
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT id, name FROM ingredients ORDER BY id"
+        )).fetchall()
+
+        survivors = {}
+        duplicates = []
+        for ingredient_id, name in rows:
+            normalized = normalize_name(name)
+            if normalized in survivors:
+                duplicates.append({"duplicate": ingredient_id, "survivor": survivors[normalized]})
+            else:
+                survivors[normalized] = ingredient_id
+
+        if duplicates:
+            connection.execute(text(
+                "UPDATE recipe_ingredients SET ingredient_id = :survivor "
+                "WHERE ingredient_id = :duplicate"
+            ), duplicates)
+            connection.execute(text(
+                "DELETE FROM ingredients WHERE id = :duplicate"
+            ), duplicates)
+            for merge in duplicates:
+                print(f"  Merged ingredient {merge['duplicate']} into {merge['survivor']}")
+
+        if survivors:
+            connection.execute(text(
+                "UPDATE ingredients SET normalized_name = :normalized WHERE id = :id"
+            ), [{"normalized": normalized, "id": ingredient_id}
+                for normalized, ingredient_id in survivors.items()])
+
+        connection.execute(text(
+            "ALTER TABLE ingredients MODIFY normalized_name VARCHAR(255) NOT NULL"
+        ))
+        connection.commit()
+        print(f"Normalized {len(survivors)} ingredients, merged {len(duplicates)} duplicates")
+
+    create_index_if_missing(
+        "ingredients", "uq_ingredients_normalized_name", "normalized_name", unique=True)
+
+    # Running workers still hold the pre-merge catalog
+    session = SessionLocal()
+    try:
+        bump_cache_version(session, INGREDIENT_CATALOG)
+        session.commit()
+    finally:
+        session.close()
+
+
+def migrate_ingredient_usage():
+    """
+    Create the ingredient_usage counters table and fill it from existing recipes
+    """
+    from db.entries.IngredientUsage import IngredientUsage
+    from services.ingredient_usage import reconcile_ingredient_usage
+
+    print("Creating ingredient_usage table...")
+    IngredientUsage.__table__.create(engine, checkfirst=True)
+    print(f"Counted usage of {reconcile_ingredient_usage()} ingredients")
+
+
+def migrate_ingredient_conversion_data():
+    """
+    Add density and piece weight columns used for unit conversion
+    """
+    add_column_if_missing("ingredients", "density", "FLOAT NULL")
+    add_column_if_missing("ingredients", "piece_weight", "FLOAT NULL")
+
+
+def migrate_login_throttle_buckets():
+    """
+    Create the login_throttle_buckets table used by the shared login throttle
+    """
+    from db.entries.LoginThrottleBucket import LoginThrottleBucket
+
+    print("Creating login_throttle_buckets table...")
+    LoginThrottleBucket.__table__.create(engine, checkfirst=True)
+
+
+def migrate_refresh_tokens():
+    """
+    Create the refresh_tokens table used by the refresh token grant
+    """
+    from db.entries.RefreshToken import RefreshToken
+
+    print("Creating refresh_tokens table...")
+    RefreshToken.__table__.create(engine, checkfirst=True)
+
+
+def migrate_user_token_version():
+    """
+    Add the token version that access tokens are checked against
+    """
+    add_column_if_missing("users", "token_version", "INT NOT NULL DEFAULT 0")
+    create_index_if_missing("users", "ix_users_token_version", "token_version")
+
+    # Workers periodically load the users whose version changed within the
+    # access token lifetime
+    add_column_if_missing("users", "token_version_changed_at", "DATETIME NULL")
+    create_index_if_missing(
+        "users", "ix_users_token_version_changed_at", "token_version_changed_at")
+    # The time of earlier bumps is unknown; count them as recent for one
+    # token lifetime
+    with engine.connect() as connection:
+        connection.execute(text(
+            "UPDATE users SET token_version_changed_at = UTC_TIMESTAMP() "
+            "WHERE token_version > 0 AND token_version_changed_at IS NULL"
+        ))
+        connection.commit()
+
+
+def migrate_user_stats():
+    """
+    Create the user_stats table and fill it from existing recipes
+    """
+    from db.entries.UserStats import UserStats
+    from services.user_stats import refresh_user_stats
+
+    print("Creating user_stats table...")
+    UserStats.__table__.create(engine, checkfirst=True)
+    print(f"Computed statistics of {refresh_user_stats()} users")
+
+
+def migrate_user_normalized_usernames():
+    """
+    Add the normalized_username column that username lookup and prefix search
+    go through, fill it and index it
+    """
+    from db.entries.User import normalize_username
+
+    add_column_if_missing("users", "normalized_username", "VARCHAR(255) NULL")
+
+    print("Backfilling normalized usernames...")
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT id, username FROM users ORDER BY id"
+        )).fetchall()
+        if rows:
+            connection.execute(text(
+                "UPDATE users SET normalized_username = :normalized WHERE id = :id"
+            ), [{"normalized": normalize_username(username), "id": user_id}
+                for user_id, username in rows])
+        connection.execute(text(
+            "ALTER TABLE users MODIFY normalized_username VARCHAR(255) NOT NULL"
+        ))
+        connection.commit()
+        print(f"Normalized {len(rows)} usernames")
+
+    create_index_if_missing(
+        "users", "ix_users_normalized_username", "normalized_username, id")
+
+
 if __name__ == "__main__":
+    # The sample ingredients need normalized_name, and changing the catalog
+    # bumps its cache version
+    migrate_cache_versions()
+    migrate_ingredient_normalized_names()
     migrate_ingredient_categories()
+    migrate_recipe_version()
+    migrate_idempotency_keys()
+    migrate_cascading_foreign_keys()
+    migrate_soft_delete()
+    migrate_ingredient_usage()
+    migrate_ingredient_conversion_data()
+    migrate_login_throttle_buckets()
+    migrate_refresh_tokens()
+    migrate_user_token_version()
+    migrate_user_stats()
+    migrate_user_normalized_usernames()
@@ -0,0 +1,15 @@
+from db.base import Base
+from sqlalchemy import Column, Integer, String
+
+
+class CacheVersion(Base):
+    """
+    Version counters for data cached in memory by every worker.
+
+    Writers bump a counter in the same transaction as the data change; workers
+    compare it with the version of their local copy to know when to reload.
+    """
+    __tablename__ = "cache_versions"
+
+    name = Column(String(63), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,22 @@
+from db.base import Base
+from db.entries.TimestampMixin import TimestampMixin, get_utc_now
+from sqlalchemy import Column, DateTime, Integer, String, Text, ForeignKey, UniqueConstraint
+
+
+class IdempotencyKey(Base, TimestampMixin):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String(255), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    # Identifies the request currently holding the key and when it took it;
+    # a claim older than the lease may be taken over by a retry
+    claim_token = Column(String(32), nullable=True)
+    claimed_at = Column(DateTime, nullable=False, default=get_utc_now)
+    # Both stay NULL while the original request is still in flight
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
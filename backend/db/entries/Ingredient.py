@@ -1,14 +1,61 @@
 from db.base import Base
 from db.entries.TimestampMixin import TimestampMixin
-from sqlalchemy import Column, Integer, String
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, Index
+from sqlalchemy.orm import relationship, validates
+import unicodedata
+
+# Valid ingredient categories
+VALID_CATEGORIES = {
+    "vegetables", "fruits", "meat_poultry", "seafood", "dairy",
+    "grains_cereals", "legumes", "herbs_spices", "oils_fats",
+    "condiments", "beverages", "other"
+}
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize an ingredient name for matching: accents stripped,
+    case-folded and whitespace collapsed ("  Crème  Fraîche" -> "creme fraiche")
+    """
+    if name.isascii():
+        # Nothing to decompose and casefold() equals lower() for ASCII
+        return " ".join(name.lower().split())
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
 
 class Ingredient(Base, TimestampMixin):
     __tablename__ = "ingredients"
+    __table_args__ = (
+        # Duplicate names are rejected by the database, not by a scan per write
+        Index("uq_ingredients_normalized_name", "normalized_name", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
+    normalized_name = Column(String(255), nullable=False)
     unit = Column(String(255), nullable=False)
-    category = Column(String(63), nullable=False, default="other") 
+    category = Column(String(63), nullable=False, default="other")
+    # Grams per millilitre, for volume <-> mass conversion
+    density = Column(Float, nullable=True)
+    # Grams per one `unit` when unit is counted (piece, clove, slice, ...)
+    piece_weight = Column(Float, nullable=True)
     
-    recipe_ingredients = relationship("RecipeIngredient", back_populates="ingredient")
\ No newline at end of file
+    recipe_ingredients = relationship("RecipeIngredient", back_populates="ingredient")
+    usage = relationship("IngredientUsage", back_populates="ingredient",
+                         uselist=False, passive_deletes=True)
+
+    @property
+    def recipe_count(self) -> int:
+        return self.usage.recipe_count if self.usage else 0
+
+    @property
+    def public_recipe_count(self) -> int:
+        return self.usage.public_recipe_count if self.usage else 0
+
+    @validates("name")
+    def _sync_normalized_name(self, key, name):
+        """Keep normalized_name in step with every name assignment"""
+        self.normalized_name = normalize_name(name)
+        return name
\ No newline at end of file
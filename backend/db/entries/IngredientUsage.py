@@ -0,0 +1,19 @@
+from db.base import Base
+from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy.orm import relationship
+
+
+class IngredientUsage(Base):
+    """
+    Number of live recipes using each ingredient.
+
+    Kept in step incrementally by the recipe write paths and corrected by a
+    periodic reconcile job; tombstoned recipes are not counted.
+    """
+    __tablename__ = "ingredient_usage"
+
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id", ondelete="CASCADE"), primary_key=True)
+    recipe_count = Column(Integer, nullable=False, default=0)
+    public_recipe_count = Column(Integer, nullable=False, default=0)
+
+    ingredient = relationship("Ingredient", back_populates="usage")
@@ -0,0 +1,17 @@
+from db.base import Base
+from sqlalchemy import Column, Float, String
+
+
+class LoginThrottleBucket(Base):
+    """
+    Token bucket of the login throttle, shared by all workers.
+
+    Only used with LOGIN_THROTTLE_BACKEND=database; the default in-memory
+    backend keeps its buckets per worker.
+    """
+    __tablename__ = "login_throttle_buckets"
+
+    key = Column(String(255), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    # Unix time of the last take, from which the refill is computed
+    refilled_at = Column(Float, nullable=False)
@@ -1,10 +1,11 @@
 from db.base import Base
 from db.entries.TimestampMixin import TimestampMixin
+from db.entries.SoftDeleteMixin import SoftDeleteMixin
 from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
 from sqlalchemy.orm import relationship
 
 
-class Recipe(Base, TimestampMixin):
+class Recipe(Base, TimestampMixin, SoftDeleteMixin):
     __tablename__ = "recipes"
 
     id = Column(Integer, primary_key=True)
@@ -14,11 +15,20 @@ class Recipe(Base, TimestampMixin):
     preparation_time = Column(Integer, nullable=False)
     cooking_time = Column(Integer, nullable=False)
     servings = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
 
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
     user = relationship("User", back_populates="recipes")
+    # Child rows are removed by ON DELETE CASCADE in the database, so deleting
+    # a recipe never has to load its steps and ingredients first
     steps = relationship("Step", back_populates="recipe",
-                         cascade="all, delete-orphan")
+                         cascade="all, delete-orphan",
+                         passive_deletes=True)
     recipe_ingredients = relationship(
-        "RecipeIngredient", back_populates="recipe", cascade="all, delete-orphan")
+        "RecipeIngredient", back_populates="recipe", cascade="all, delete-orphan",
+        passive_deletes=True)
+
+    # Every UPDATE is guarded by "WHERE version = <loaded version>" and bumps it,
+    # so concurrent edits raise StaleDataError instead of overwriting each other
+    __mapper_args__ = {"version_id_col": version}
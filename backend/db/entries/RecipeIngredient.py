@@ -7,10 +7,10 @@ class RecipeIngredient(Base, TimestampMixin):
     __tablename__ = "recipe_ingredients"
 
     id = Column(Integer, primary_key=True)
-    recipe_id = Column(Integer, ForeignKey("recipes.id"), nullable=False)
+    recipe_id = Column(Integer, ForeignKey("recipes.id", ondelete="CASCADE"), nullable=False)
     ingredient_id = Column(Integer, ForeignKey("ingredients.id"), nullable=False)
     quantity = Column(Float, nullable=False)
-    step_id = Column(Integer, ForeignKey("steps.id"), nullable=True)
+    step_id = Column(Integer, ForeignKey("steps.id", ondelete="SET NULL"), nullable=True)
 
     recipe = relationship("Recipe", back_populates="recipe_ingredients")
     ingredient = relationship("Ingredient", back_populates="recipe_ingredients")
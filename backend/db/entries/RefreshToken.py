@@ -0,0 +1,21 @@
+from db.base import Base
+from db.entries.TimestampMixin import TimestampMixin
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+
+
+class RefreshToken(Base, TimestampMixin):
+    """
+    Issued refresh token, stored as the SHA-256 of its value.
+
+    Every refresh revokes the presented token and issues a new one in the same
+    family; presenting a revoked token again revokes the whole family.
+    """
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    token_hash = Column(String(64), unique=True, nullable=False)
+    # Shared by all tokens descending from one login
+    family_id = Column(String(32), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, nullable=True)
@@ -0,0 +1,18 @@
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy import Column, DateTime
+
+
+class SoftDeleteMixin:
+    """
+    Tombstone column for rows that are deleted lazily.
+
+    Rows with deleted_at set are hidden from every read path immediately and
+    physically removed later by the background purger (services.purge).
+    """
+    @declared_attr
+    def deleted_at(cls):
+        return Column(DateTime, nullable=True, index=True)
+
+    @property
+    def is_deleted(self):
+        return self.deleted_at is not None
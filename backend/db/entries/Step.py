@@ -7,7 +7,7 @@ class Step(Base, TimestampMixin):
     __tablename__ = "steps"
 
     id = Column(Integer, primary_key=True)
-    recipe_id = Column(Integer, ForeignKey("recipes.id"), nullable=False)
+    recipe_id = Column(Integer, ForeignKey("recipes.id", ondelete="CASCADE"), nullable=False)
     order_number = Column(Integer, nullable=False)
     action_type = Column(String(63), nullable=False)
     temperature = Column(Integer, nullable=False)
@@ -16,4 +16,5 @@ class Step(Base, TimestampMixin):
     description = Column(String(512), nullable=True)
 
     recipe = relationship("Recipe", back_populates="steps")
-    recipe_ingredients = relationship("RecipeIngredient", back_populates="step")
\ No newline at end of file
+    recipe_ingredients = relationship("RecipeIngredient", back_populates="step",
+                                      passive_deletes=True)
\ No newline at end of file
@@ -1,24 +1,48 @@
-from sqlalchemy import Column, Integer, String
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, DateTime, Index, Integer, String
+from sqlalchemy.orm import relationship, validates
 from db.base import Base
 from db.entries.TimestampMixin import TimestampMixin
-from passlib.context import CryptContext
+from db.entries.SoftDeleteMixin import SoftDeleteMixin
+from db.entries.Ingredient import normalize_name
+from services.password_hashing import pwd_context
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+def normalize_username(username: str) -> str:
+    """
+    Normalize a username for lookup and prefix search: accents stripped and
+    case-folded ("José" -> "jose")
+    """
+    return normalize_name(username)
 
-class User(Base, TimestampMixin):
+
+class User(Base, TimestampMixin, SoftDeleteMixin):
     __tablename__ = "users"
+    __table_args__ = (
+        # Prefix search walks this index in (name, id) order, which is also
+        # the order of its keyset pagination
+        Index("ix_users_normalized_username", "normalized_username", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     username = Column(String(255), unique=True, nullable=False)
+    normalized_username = Column(String(255), nullable=False)
     email = Column(String(255), unique=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
+    # Bumped to revoke every access token issued so far
+    token_version = Column(Integer, nullable=False, default=0, index=True)
+    # When token_version was last bumped; workers only load recent bumps
+    token_version_changed_at = Column(DateTime, nullable=True, index=True)
 
     recipes = relationship("Recipe", back_populates="user",
                            cascade="all, delete-orphan",
                            lazy="selectin")
 
+    @validates("username")
+    def _sync_normalized_username(self, key, username):
+        """Keep normalized_username in step with every username assignment"""
+        self.normalized_username = normalize_username(username)
+        return username
+
     @property
     def password(self):
         """
@@ -36,7 +60,7 @@ class User(Base, TimestampMixin):
     @staticmethod
     def _get_password_hash(password):
         """
-        Hash a password using bcrypt
+        Hash a password with the configured scheme (blocks the calling thread)
         """
         return pwd_context.hash(password)
 
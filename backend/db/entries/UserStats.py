@@ -0,0 +1,22 @@
+from db.base import Base
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Text
+
+
+class UserStats(Base):
+    """
+    Profile statistics of a user over their live recipes.
+
+    The counters are kept in step by the recipe write paths; the top
+    ingredients are a rollup recomputed by a periodic job, which also corrects
+    any drift of the counters.
+    """
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    recipe_count = Column(Integer, nullable=False, default=0)
+    public_recipe_count = Column(Integer, nullable=False, default=0)
+    total_preparation_time = Column(Integer, nullable=False, default=0)
+    total_cooking_time = Column(Integer, nullable=False, default=0)
+    # JSON list of {"ingredient_id", "name", "recipe_count"}, most used first
+    top_ingredients = Column(Text, nullable=True)
+    top_ingredients_updated_at = Column(DateTime, nullable=True)
@@ -3,6 +3,12 @@ from db.entries.Recipe import Recipe
 from db.entries.Step import Step
 from db.entries.Ingredient import Ingredient
 from db.entries.RecipeIngredient import RecipeIngredient
+from db.entries.IdempotencyKey import IdempotencyKey
+from db.entries.CacheVersion import CacheVersion
+from db.entries.IngredientUsage import IngredientUsage
+from db.entries.LoginThrottleBucket import LoginThrottleBucket
+from db.entries.RefreshToken import RefreshToken
+from db.entries.UserStats import UserStats
 
 def init_models():
     """Initialize all models to avoid circular import issues"""
@@ -1,18 +1,78 @@
 from routers.auth_router import router as auth_router
+from routers.auth_router import is_admin_token, require_admin
 from routers.user_router import router as user_router
 from routers.recipe_router import router as recipe_router
 from routers.ingridient_router import router as ingridient_router
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Query, Response
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import os
 import uvicorn
 
+from db.base import engine
 from db.setup_models import init_models
+from services.background import register_job, start_background_jobs, stop_background_jobs
+from services.idempotency import purge_expired_idempotency_keys
+from services.ingredient_usage import USAGE_RECONCILE_INTERVAL_SECONDS, reconcile_ingredient_usage
+from services.instrumentation import (
+    MetricsMiddleware,
+    instrument_cache,
+    instrument_engine,
+    instrument_login_throttle,
+    instrument_password_hasher,
+)
+from services.login_throttle import LOGIN_THROTTLE_PURGE_INTERVAL_SECONDS, login_throttle
+from services.metrics import CONTENT_TYPE, METRICS_FLUSH_SECONDS, registry
+from services.password_hashing import password_hasher
+from services.profiling import ProfilingMiddleware, profile_path
+from services.principals import TOKEN_VERSION_REFRESH_SECONDS, token_versions
+from services.purge import PURGE_INTERVAL_SECONDS, purge_deleted_records
+from services.recipe_export import export_cache
+from services.recipe_scaling import scale_cache
+from services.refresh_tokens import REFRESH_TOKEN_PURGE_INTERVAL_SECONDS, purge_expired_refresh_tokens
+from services.slow_queries import (
+    SLOW_QUERY_MAX_FINGERPRINTS,
+    SLOW_QUERY_REPORT_INTERVAL_SECONDS,
+    SLOW_QUERY_TOP_N,
+    slow_query_log,
+)
+from services.user_stats import USER_STATS_REFRESH_INTERVAL_SECONDS, refresh_user_stats
 init_models()
 
+register_job("purge-deleted", PURGE_INTERVAL_SECONDS, purge_deleted_records)
+register_job("purge-idempotency-keys", 3600, purge_expired_idempotency_keys)
+register_job("reconcile-ingredient-usage", USAGE_RECONCILE_INTERVAL_SECONDS, reconcile_ingredient_usage)
+register_job("purge-login-throttle", LOGIN_THROTTLE_PURGE_INTERVAL_SECONDS, login_throttle.purge_idle_buckets)
+register_job("purge-refresh-tokens", REFRESH_TOKEN_PURGE_INTERVAL_SECONDS, purge_expired_refresh_tokens)
+register_job("reload-token-versions", TOKEN_VERSION_REFRESH_SECONDS, token_versions.reload)
+register_job("refresh-user-stats", USER_STATS_REFRESH_INTERVAL_SECONDS, refresh_user_stats)
+register_job("flush-metrics", METRICS_FLUSH_SECONDS, registry.flush)
+register_job("report-slow-queries", SLOW_QUERY_REPORT_INTERVAL_SECONDS, slow_query_log.print_report)
+
+instrument_engine(engine)
+instrument_cache("recipe_scaling", scale_cache)
+instrument_cache("recipe_export", export_cache)
+instrument_password_hasher(password_hasher)
+instrument_login_throttle(login_throttle)
+slow_query_log.install(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Run background jobs for the lifetime of the application
+    """
+    start_background_jobs()
+    yield
+    stop_background_jobs()
+
+
 app = FastAPI(
     title="Recipe App API",
     description="API for managing recipes and users",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -22,6 +82,9 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware, is_admin_token=is_admin_token)
+# Outermost, so the time spent in CORS handling and profiling is measured too
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(user_router)
@@ -46,5 +109,34 @@ def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Metrics of all workers in the Prometheus text format
+    """
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/debug/slow-queries", include_in_schema=False, dependencies=[Depends(require_admin)])
+def slow_queries(limit: int = Query(SLOW_QUERY_TOP_N, ge=1, le=SLOW_QUERY_MAX_FINGERPRINTS)):
+    """
+    Slowest query fingerprints of this worker by total time, with sampled plans
+    """
+    return {"fingerprints": slow_query_log.top(limit)}
+
+
+@app.get("/debug/profiles/{profile_id}", include_in_schema=False,
+         dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str):
+    """
+    Profile named by an X-Profile-Id response header, in speedscope format
+    """
+    path = profile_path(profile_id)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json",
+                        filename=os.path.basename(path))
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
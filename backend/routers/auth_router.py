@@ -2,25 +2,40 @@ from datetime import datetime, timedelta
 from typing import Annotated, Optional
 from dotenv import load_dotenv
 import os
+import secrets
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
 from db.base import get_db
+from db.entries.TimestampMixin import get_utc_now
 from db.entries.User import User
+from services.login_throttle import login_throttle
+from services.password_hashing import PasswordHasherBusy, password_hasher
+from services.principals import ACCESS_TOKEN_EXPIRE_MINUTES, Principal, token_versions
+from services.refresh_tokens import (
+    InvalidRefreshToken,
+    issue_refresh_token,
+    revoke_refresh_token,
+    revoke_user_refresh_tokens,
+    rotate_refresh_token,
+)
 
 from schemes.TokenData import TokenData
 from schemes.UserLogin import UserLogin
 from schemes.UserPublic import UserPublic
 from schemes.LoginResponse import LoginResponse
+from schemes.RefreshTokenRequest import RefreshTokenRequest
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Shared secret of operator-only endpoints; they are disabled while unset
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
 
 router = APIRouter(
     prefix="/auth",
@@ -31,15 +46,64 @@ router = APIRouter(
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
-def authenticate_user_by_email(db: Session, email: str, password: str):
+async def authenticate_user_by_email(db: Session, email: str, password: str):
     """
     Authenticate a user by email and password
+
+    The password is verified on the hashing pool, so the event loop keeps
+    serving other requests meanwhile. A hash made under an outdated policy
+    (scheme or cost) is replaced by a current one on success.
     """
-    user = db.query(User).filter(User.email == email).first()
+    user = db.query(User).filter(
+        User.email == email, User.deleted_at.is_(None)).first()
     if not user:
         return False
-    if not user.verify_password(password):
+    valid, new_hash = await password_hasher.verify_async(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        try:
+            user.hashed_password = new_hash
+            db.commit()
+        except Exception as e:
+            # The old hash still works; try again at the next login
+            db.rollback()
+            print(f"Error rehashing password of user {user.id}: {str(e)}")
+    return user
+
+
+async def login_user(request: Request, db: Session, email: str, password: str) -> User:
+    """
+    Admit a login attempt through the throttle and authenticate it
+
+    Args:
+        request: Incoming request, for the client address
+        db: Database session
+        email: Login email
+        password: Plain password
+
+    Returns:
+        Authenticated user
+
+    Raises:
+        HTTPException: 429 if throttled or the hashing pool is saturated,
+            401 if the credentials are wrong
+    """
+    # The database backend runs two transactions per attempt; keep them off
+    # the event loop, which a burst of attempts would otherwise stall
+    await run_in_threadpool(
+        login_throttle.check, request.client.host if request.client else None, email)
+    try:
+        user = await authenticate_user_by_email(db, email, password)
+    except PasswordHasherBusy:
+        raise login_throttle.overloaded()
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 
@@ -54,34 +118,127 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)],
-    db: Annotated[Session, Depends(get_db)]
-):
+def login_response(user: User, refresh_token: str) -> dict:
     """
-    Get the current user from JWT token
+    Build the token response of a login or refresh
+
+    Args:
+        user: Authenticated user
+        refresh_token: Refresh token to hand to the client
+
+    Returns:
+        Access token, refresh token and the user, serialized so the session
+        can be committed afterwards without reloading the user
     """
-    credentials_exception = HTTPException(
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.username, "uid": user.id, "ver": user.token_version},
+        expires_delta=access_token_expires
+    )
+
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "user": UserPublic.model_validate(user)
+    }
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+
+def decode_access_token(token: str) -> TokenData:
+    """
+    Verify an access token and read its claims
+
+    Raises:
+        HTTPException: If the token is invalid or expired
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
+            raise credentials_exception()
+        return TokenData(
+            username=username,
+            user_id=payload.get("uid"),
+            token_version=payload.get("ver", 0)
+        )
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
+
 
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
+def load_token_user(token_data: TokenData, db: Session) -> User:
+    """
+    Load the live user a token was issued to
+
+    Raises:
+        HTTPException: If the user is gone or the token was revoked
+    """
+    query = db.query(User).filter(User.deleted_at.is_(None))
+    if token_data.user_id is not None:
+        user = query.filter(User.id == token_data.user_id).first()
+    else:
+        # Tokens issued before the id claim existed
+        user = query.filter(User.username == token_data.username).first()
+    if user is None or token_data.token_version < user.token_version:
+        raise credentials_exception()
     return user
 
 
+async def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: Annotated[Session, Depends(get_db)]
+):
+    """
+    Get the current user from JWT token
+    """
+    return load_token_user(decode_access_token(token), db)
+
+
+async def get_current_principal(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: Annotated[Session, Depends(get_db)]
+) -> Principal:
+    """
+    Get the caller's identity from the JWT claims without loading the user
+
+    For routes that only need the caller's id or username. Revocation is
+    checked against the in-memory token version table; tokens without an id
+    claim fall back to a user lookup.
+    """
+    token_data = decode_access_token(token)
+    if token_data.user_id is None:
+        user = load_token_user(token_data, db)
+        return Principal(user.id, user.username, user.token_version)
+    if not token_versions.is_current(token_data.user_id, token_data.token_version):
+        raise credentials_exception()
+    return Principal(token_data.user_id, token_data.username, token_data.token_version)
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """Whether token is the configured admin token"""
+    if not ADMIN_API_TOKEN or not token:
+        return False
+    return secrets.compare_digest(token.encode(), ADMIN_API_TOKEN.encode())
+
+
+async def require_admin(x_admin_token: Annotated[Optional[str], Header()] = None):
+    """
+    Allow a request only with the admin token in the X-Admin-Token header
+    """
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin token required"
+        )
+
+
 async def get_current_active_user(
     current_user: Annotated[User, Depends(get_current_user)]
 ):
@@ -93,71 +250,93 @@ async def get_current_active_user(
 
 @router.post("/login", response_model=LoginResponse)
 async def login_for_access_token(
+    request: Request,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: Annotated[Session, Depends(get_db)]
 ):
     """
     Authenticate user and return JWT token using form data
 
-    Note: The OAuth2 password flow expects a username field, but we'll check
-    if it looks like an email and authenticate accordingly
+    Note: The OAuth2 password flow expects a username field; it carries the
+    user's email
     """
-    if "@" in form_data.username:
-        user = authenticate_user_by_email(
-            db, form_data.username, form_data.password)
-    else:
-        email_user = db.query(User).filter(
-            User.email == form_data.username).first()
-        if email_user and email_user.verify_password(form_data.password):
-            user = email_user
-        else:
-            user = None
-
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
-
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": user
-    }
+    user = await login_user(request, db, form_data.username, form_data.password)
+    response = login_response(user, issue_refresh_token(db, user.id))
+    db.commit()
+    return response
 
 
 @router.post("/login/json", response_model=LoginResponse)
 async def login_json(
+    request: Request,
     user_data: UserLogin,
     db: Annotated[Session, Depends(get_db)]
 ):
     """
     Login with JSON request body using email and password
     """
-    user = authenticate_user_by_email(db, user_data.email, user_data.password)
-    if not user:
+    user = await login_user(request, db, user_data.email, user_data.password)
+    response = login_response(user, issue_refresh_token(db, user.id))
+    db.commit()
+    return response
+
+
+@router.post("/refresh", response_model=LoginResponse)
+async def refresh_access_token(
+    request_data: RefreshTokenRequest,
+    db: Annotated[Session, Depends(get_db)]
+):
+    """
+    Exchange a refresh token for a new access token and refresh token
+
+    The presented refresh token is used up; reusing it later revokes every
+    token issued since the login it came from. No password is verified.
+    """
+    try:
+        user, refresh_token = rotate_refresh_token(db, request_data.refresh_token)
+    except InvalidRefreshToken:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
+            detail="Invalid or expired refresh token",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    response = login_response(user, refresh_token)
+    db.commit()
+    return response
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
 
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": user
-    }
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    request_data: RefreshTokenRequest,
+    db: Annotated[Session, Depends(get_db)]
+):
+    """
+    Revoke a refresh token and every token rotated from the same login
+
+    Unknown tokens are ignored, so logging out twice is harmless.
+    """
+    revoke_refresh_token(db, request_data.refresh_token)
+
+
+@router.post("/logout/all", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_everywhere(
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Annotated[Session, Depends(get_db)]
+):
+    """
+    Revoke every access and refresh token of the authenticated user
+
+    Other workers stop accepting the access tokens once they reload their
+    token version table.
+    """
+    user_id, new_version = current_user.id, current_user.token_version + 1
+    db.query(User).filter(User.id == user_id).update({
+        User.token_version: User.token_version + 1,
+        User.token_version_changed_at: get_utc_now()
+    }, synchronize_session=False)
+    revoke_user_refresh_tokens(db, user_id)
+    db.commit()
+    token_versions.record_version(user_id, new_version)
 
 
 @router.get("/me", response_model=UserPublic)
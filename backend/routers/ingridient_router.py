@@ -1,12 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from pydantic import BaseModel, Field
 
 from db.base import get_db
-from db.entries.Ingredient import Ingredient
-from db.entries.User import User
-from routers.auth_router import get_current_user
+from db.entries.Ingredient import Ingredient, VALID_CATEGORIES
+from db.entries.RecipeIngredient import RecipeIngredient
+from routers.auth_router import get_current_principal
+from services.cache import bump_cache_version
+from services.categorizer import ingredient_categorizer
+from services.principals import Principal
+from services.units import UnitError
+from services.ingredient_catalog import (
+    INGREDIENT_CATALOG,
+    INGREDIENT_SORTS,
+    encode_json,
+    ingredient_catalog,
+    json_bytes_response,
+)
+from services.ingredient_import import (
+    BULK_MAX_ROWS,
+    parse_json_rows,
+    parse_ndjson_rows,
+    upsert_ingredients,
+)
 
 router = APIRouter(
     prefix="/ingredients",
@@ -23,16 +43,27 @@ class IngredientBase(BaseModel):
     unit: str = Field(..., min_length=1, max_length=255, example="g")
     category: str = Field(default="other", max_length=63,
                           example="herbs_spices")
+    density: Optional[float] = Field(
+        None, gt=0, example=0.92, description="Grams per millilitre")
+    piece_weight: Optional[float] = Field(
+        None, gt=0, example=5, description="Grams per one unit, for counted units")
 
 
 class IngredientCreate(IngredientBase):
     """Schema for creating an ingredient"""
-    pass
+    category: Optional[str] = Field(
+        None,
+        max_length=63,
+        example="herbs_spices",
+        description="Derived from the name when omitted"
+    )
 
 
 class IngredientResponse(IngredientBase):
     """Schema for returning an ingredient"""
     id: int
+    recipe_count: int = 0
+    public_recipe_count: int = 0
 
     class Config:
         from_attributes = True
@@ -43,14 +74,18 @@ class IngredientUpdate(BaseModel):
     name: Optional[str] = Field(None, min_length=1, max_length=255)
     unit: Optional[str] = Field(None, min_length=1, max_length=255)
     category: Optional[str] = Field(None, max_length=63)
+    density: Optional[float] = Field(None, gt=0)
+    piece_weight: Optional[float] = Field(None, gt=0)
 
 
-# Valid ingredient categories
-VALID_CATEGORIES = {
-    "vegetables", "fruits", "meat_poultry", "seafood", "dairy",
-    "grains_cereals", "legumes", "herbs_spices", "oils_fats",
-    "condiments", "beverages", "other"
-}
+class UnitConversionResponse(BaseModel):
+    """Schema for a converted ingredient quantity"""
+    ingredient_id: int
+    quantity: float
+    from_unit: str
+    to_unit: str
+    factor: float
+    result: float
 
 
 def validate_category(category: str) -> str:
@@ -63,11 +98,34 @@ def validate_category(category: str) -> str:
     return category
 
 
+def validate_sort(sort: str) -> str:
+    """Validate ingredient list ordering"""
+    if sort not in INGREDIENT_SORTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid sort. Must be one of: {', '.join(INGREDIENT_SORTS)}"
+        )
+    return sort
+
+
+def commit_ingredient(db: Session, name: str):
+    """Commit an ingredient write, turning a duplicate name into a 409"""
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Ingredient '{name}' already exists"
+        )
+
+
 @router.get("/", response_model=List[IngredientResponse])
 def get_all_ingredients(
     skip: int = 0,
     limit: int = 1000,
     category: Optional[str] = None,
+    sort: str = "id",
     db: Session = Depends(get_db)
 ):
     """
@@ -77,19 +135,18 @@ def get_all_ingredients(
         skip: Number of records to skip
         limit: Maximum number of records to return
         category: Filter by category (optional)
+        sort: "id" (default) or "popular" for the most used ingredients first
         db: Database session
 
     Returns:
         List of ingredients
     """
-    query = db.query(Ingredient)
-
     if category:
         validate_category(category)
-        query = query.filter(Ingredient.category == category)
+    validate_sort(sort)
 
-    ingredients = query.offset(skip).limit(limit).all()
-    return ingredients
+    snapshot = ingredient_catalog.snapshot(db)
+    return json_bytes_response(snapshot.page_json(skip, limit, category, sort))
 
 
 @router.get("/categories", response_model=List[str])
@@ -104,41 +161,50 @@ def get_ingredient_categories():
 
 
 @router.get("/by-category", response_model=dict)
-def get_ingredients_by_category(db: Session = Depends(get_db)):
+def get_ingredients_by_category(sort: str = "id", db: Session = Depends(get_db)):
     """
     Get all ingredients grouped by category
 
     Args:
+        sort: "id" (default) or "popular" for the most used ingredients first
         db: Database session
 
     Returns:
         Dictionary with categories as keys and ingredient lists as values
     """
-    ingredients = db.query(Ingredient).all()
-
-    # Group ingredients by category
-    categorized = {}
-    for category in VALID_CATEGORIES:
-        categorized[category] = []
-
-    for ingredient in ingredients:
-        category = ingredient.category or "other"
-        if category in categorized:
-            categorized[category].append({
-                "id": ingredient.id,
-                "name": ingredient.name,
-                "unit": ingredient.unit,
-                "category": ingredient.category
-            })
-        else:
-            categorized["other"].append({
-                "id": ingredient.id,
-                "name": ingredient.name,
-                "unit": ingredient.unit,
-                "category": ingredient.category
-            })
-
-    return categorized
+    validate_sort(sort)
+
+    # Grouped once per catalog version and kept encoded in the snapshot
+    return json_bytes_response(ingredient_catalog.snapshot(db).grouped(sort))
+
+
+@router.get("/autocomplete", response_model=List[IngredientResponse])
+def autocomplete_ingredients(
+    q: str = Query(..., min_length=1, max_length=255),
+    category: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    """
+    Suggest ingredients whose name, or any word in it, starts with q
+
+    Matching ignores case and accents, so "oil" finds "Olive Oil". Results are
+    ranked by how many recipes use the ingredient and served from an in-memory
+    prefix index of the catalog.
+
+    Args:
+        q: Prefix typed by the user
+        category: Filter by category (optional)
+        limit: Maximum number of suggestions
+        db: Database session
+
+    Returns:
+        List of matching ingredients, most used first
+    """
+    if category:
+        validate_category(category)
+
+    return ingredient_catalog.snapshot(db).autocomplete.search(q, category, limit)
 
 
 @router.get("/{ingredient_id}", response_model=IngredientResponse)
@@ -156,8 +222,7 @@ def get_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
     Raises:
         HTTPException: If ingredient not found
     """
-    ingredient = db.query(Ingredient).filter(
-        Ingredient.id == ingredient_id).first()
+    ingredient = ingredient_catalog.snapshot(db).by_id.get(ingredient_id)
     if not ingredient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -166,10 +231,66 @@ def get_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
     return ingredient
 
 
+@router.get("/{ingredient_id}/convert", response_model=UnitConversionResponse)
+def convert_ingredient_quantity(
+    ingredient_id: int,
+    to_unit: str = Query(..., min_length=1, max_length=31, example="g"),
+    quantity: float = Query(1.0, ge=0),
+    from_unit: Optional[str] = Query(None, min_length=1, max_length=31, example="tbsp"),
+    db: Session = Depends(get_db)
+):
+    """
+    Convert a quantity of an ingredient between units
+
+    Units within mass or volume always convert; volume <-> mass needs the
+    ingredient's density and its counted unit <-> mass its piece weight.
+
+    Args:
+        ingredient_id: Ingredient ID
+        to_unit: Target unit, e.g. "g", "cup" or "piece"
+        quantity: Quantity to convert
+        from_unit: Source unit, the ingredient's own unit if omitted
+        db: Database session
+
+    Returns:
+        Converted quantity with the canonical unit names and factor used
+
+    Raises:
+        HTTPException: If ingredient not found, a unit is unknown or the
+            conversion is impossible for this ingredient
+    """
+    snapshot = ingredient_catalog.snapshot(db)
+    converter = snapshot.converters.get(ingredient_id)
+    if converter is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ingredient not found"
+        )
+
+    try:
+        source = converter.resolve(from_unit)
+        target = converter.resolve(to_unit)
+        factor = converter.factor(source.name, target.name)
+    except UnitError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return {
+        "ingredient_id": ingredient_id,
+        "quantity": quantity,
+        "from_unit": source.name,
+        "to_unit": target.name,
+        "factor": factor,
+        "result": quantity * factor
+    }
+
+
 @router.post("/", response_model=IngredientResponse, status_code=status.HTTP_201_CREATED)
 def create_ingredient(
     ingredient_data: IngredientCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -186,39 +307,111 @@ def create_ingredient(
     Raises:
         HTTPException: If ingredient with same name already exists or invalid category
     """
-    # Validate category
-    validate_category(ingredient_data.category)
-
-    # Check if ingredient with same name already exists
-    existing_ingredient = db.query(Ingredient).filter(
-        Ingredient.name.ilike(ingredient_data.name.strip())
-    ).first()
+    # Validate category, or derive it from the name when none was given
+    category = ingredient_data.category or ingredient_categorizer.categorize(ingredient_data.name)
+    validate_category(category)
 
-    if existing_ingredient:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Ingredient '{ingredient_data.name}' already exists"
-        )
-
-    # Create new ingredient
+    # Create new ingredient; the unique index on normalized_name rejects
+    # duplicates, including ones created concurrently
     db_ingredient = Ingredient(
         name=ingredient_data.name.strip(),
         unit=ingredient_data.unit.strip(),
-        category=ingredient_data.category
+        category=category,
+        density=ingredient_data.density,
+        piece_weight=ingredient_data.piece_weight
     )
 
     db.add(db_ingredient)
-    db.commit()
+    bump_cache_version(db, INGREDIENT_CATALOG)
+    commit_ingredient(db, ingredient_data.name)
     db.refresh(db_ingredient)
+    ingredient_catalog.reload(db)
 
     return db_ingredient
 
 
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+async def read_bulk_rows(request: Request) -> list:
+    """Read a JSON array body, or an NDJSON body line by line as it streams in"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in NDJSON_MEDIA_TYPES:
+        try:
+            return parse_json_rows(await request.body())
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid JSON payload: {e}"
+            )
+
+    rows = []
+    pending = b""
+    async for chunk in request.stream():
+        *lines, pending = (pending + chunk).split(b"\n")
+        rows.extend(parse_ndjson_rows(lines))
+        if len(rows) > BULK_MAX_ROWS:
+            break
+    rows.extend(parse_ndjson_rows([pending]))
+    return rows
+
+
+@router.post("/bulk")
+async def bulk_upsert_ingredients(
+    request: Request,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    Create or update many ingredients at once (requires authentication)
+
+    Accepts a JSON array or an NDJSON stream (Content-Type: application/x-ndjson)
+    of {"name", "unit", "category"} objects. Rows are matched on their
+    normalized name: new names are created, existing ones updated in place.
+    Rows without a category are categorized by name.
+
+    Args:
+        request: Request carrying the rows
+        current_user: Currently authenticated user
+        db: Database session
+
+    Returns:
+        Totals per status and, for every input row, its ingredient id and status
+        (created, updated, unchanged, duplicate or invalid)
+
+    Raises:
+        HTTPException: If the payload is malformed or has too many rows
+    """
+    rows = await read_bulk_rows(request)
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BULK_MAX_ROWS} ingredients can be imported at once"
+        )
+
+    try:
+        result = await run_in_threadpool(upsert_ingredients, db, rows)
+    except Exception as e:
+        db.rollback()
+        print(f"Error importing ingredients: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error importing ingredients: {str(e)}"
+        )
+    finally:
+        # Chunks committed before a failure are visible too
+        await run_in_threadpool(ingredient_catalog.reload, db)
+
+    return json_bytes_response(encode_json(result))
+
+
 @router.put("/{ingredient_id}", response_model=IngredientResponse)
 def update_ingredient(
     ingredient_id: int,
     ingredient_data: IngredientUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -234,7 +427,7 @@ def update_ingredient(
         Updated ingredient
 
     Raises:
-        HTTPException: If ingredient not found or invalid category
+        HTTPException: If ingredient not found, name already taken or invalid category
     """
     # Get existing ingredient
     ingredient = db.query(Ingredient).filter(
@@ -252,18 +445,6 @@ def update_ingredient(
         validate_category(update_data['category'])
 
     if 'name' in update_data:
-        # Check if new name conflicts with existing ingredient
-        existing = db.query(Ingredient).filter(
-            Ingredient.name.ilike(update_data['name'].strip()),
-            Ingredient.id != ingredient_id
-        ).first()
-
-        if existing:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Ingredient '{update_data['name']}' already exists"
-            )
-
         update_data['name'] = update_data['name'].strip()
 
     if 'unit' in update_data:
@@ -273,8 +454,10 @@ def update_ingredient(
     for field, value in update_data.items():
         setattr(ingredient, field, value)
 
-    db.commit()
+    bump_cache_version(db, INGREDIENT_CATALOG)
+    commit_ingredient(db, update_data.get('name', ingredient.name))
     db.refresh(ingredient)
+    ingredient_catalog.reload(db)
 
     return ingredient
 
@@ -282,7 +465,7 @@ def update_ingredient(
 @router.delete("/{ingredient_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_ingredient(
     ingredient_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -306,15 +489,20 @@ def delete_ingredient(
             detail="Ingredient not found"
         )
 
-    # Check if ingredient is used in any recipes
-    if ingredient.recipe_ingredients:
+    # Check if ingredient is used in any recipes. The usage counters skip
+    # deleted recipes that still wait for the purge, so ask the index instead
+    in_use = db.query(exists().where(
+        RecipeIngredient.ingredient_id == ingredient_id)).scalar()
+    if in_use:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot delete ingredient that is used in recipes"
         )
 
     db.delete(ingredient)
+    bump_cache_version(db, INGREDIENT_CATALOG)
     db.commit()
+    ingredient_catalog.reload(db)
 
 
 @router.get("/search/{search_term}", response_model=List[IngredientResponse])
@@ -322,6 +510,7 @@ def search_ingredients(
     search_term: str,
     category: Optional[str] = None,
     limit: int = 50,
+    fuzzy: bool = False,
     db: Session = Depends(get_db)
 ):
     """
@@ -331,21 +520,29 @@ def search_ingredients(
         search_term: Term to search for in ingredient names
         category: Filter by category (optional)
         limit: Maximum number of results
+        fuzzy: Tolerate typos ("mozarella", "chiken") using a trigram index
         db: Database session
 
     Returns:
         List of matching ingredients
     """
-    query = db.query(Ingredient).filter(
-        Ingredient.name.ilike(f"%{search_term}%")
-    )
-
     if category:
         validate_category(category)
-        query = query.filter(Ingredient.category == category)
 
-    ingredients = query.limit(limit).all()
-    return ingredients
+    if fuzzy:
+        return ingredient_catalog.fuzzy_search(db, search_term, category, limit)
+
+    snapshot = ingredient_catalog.snapshot(db)
+    candidates = snapshot.by_category.get(category, ()) if category else snapshot.ingredients
+    term = search_term.casefold()
+
+    matches = []
+    for ingredient in candidates:
+        if term in ingredient.name.casefold():
+            matches.append(ingredient)
+            if len(matches) >= limit:
+                break
+    return matches
 
 # Add this updated endpoint to your recipe_router.py
 
@@ -369,21 +566,9 @@ async def get_available_ingredients(
     Returns:
         List of ingredients with id, name, unit, and category
     """
-    query = db.query(Ingredient)
-
     # Apply category filter if provided
-    if category and category != "all":
-        query = query.filter(Ingredient.category == category)
-
-    ingredients = query.offset(skip).limit(limit).all()
-
-    return [
-        {
-            "id": ingredient.id,
-            "name": ingredient.name,
-            "unit": ingredient.unit,
-            # Fallback to 'other' if category is None
-            "category": getattr(ingredient, 'category', 'other')
-        }
-        for ingredient in ingredients
-    ]
+    if category == "all":
+        category = None
+
+    snapshot = ingredient_catalog.snapshot(db)
+    return json_bytes_response(snapshot.page_json(skip, limit, category))
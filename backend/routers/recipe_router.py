@@ -1,10 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy.orm.exc import StaleDataError
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field
-from fastapi.responses import JSONResponse
-import json
-from datetime import datetime
 
 from db.base import get_db
 from db.entries.Recipe import Recipe
@@ -12,7 +11,22 @@ from db.entries.User import User
 from db.entries.Step import Step
 from db.entries.RecipeIngredient import RecipeIngredient
 from db.entries.Ingredient import Ingredient
-from routers.auth_router import get_current_user
+from db.entries.TimestampMixin import get_utc_now
+from routers.auth_router import get_current_principal
+from services.idempotency import IdempotencyClaim, run_idempotent
+from services.principals import Principal
+from services.ingredient_catalog import ingredient_catalog, json_bytes_response
+from services.recipe_counters import NO_COUNTERS, record_counter_change, recipe_counters
+from services.shopping_list import build_shopping_list, recipe_scales
+from services.recipe_scaling import (
+    SCALE_BATCH_MAX, SCALE_MAX_SERVINGS, scale_recipe, scale_recipe_many
+)
+from services.recipe_export import (
+    etag_matches,
+    export_etag,
+    render_recipe_export,
+    validate_export_format,
+)
 
 router = APIRouter(
     prefix="/recipes",
@@ -42,6 +56,7 @@ class RecipeResponse(RecipeBase):
     """Schema for returning a recipe"""
     id: int
     user_id: int
+    version: int
 
     class Config:
         from_attributes = True
@@ -139,7 +154,12 @@ class CompleteRecipeCreate(BaseModel):
 
 class RecipeUpdate(RecipeBase):
     """Schema for updating a recipe"""
-    pass
+    version: Optional[int] = Field(
+        None,
+        ge=1,
+        example=3,
+        description="Version the client last read; stale versions are rejected with 409"
+    )
 
 
 class CompleteRecipeUpdate(BaseModel):
@@ -149,6 +169,85 @@ class CompleteRecipeUpdate(BaseModel):
     ingredients: List[IngredientCreate]
 
 
+class RecipeBulkDelete(BaseModel):
+    """Schema for deleting several recipes at once"""
+    recipe_ids: List[int] = Field(..., min_length=1, max_length=1000, example=[1, 2, 3])
+
+
+class RecipeBulkDeleteResponse(BaseModel):
+    """Schema for the outcome of a bulk delete"""
+    deleted: List[int]
+    not_found: List[int]
+    forbidden: List[int]
+
+
+class ShoppingListRecipe(BaseModel):
+    """One recipe to shop for"""
+    recipe_id: int
+    servings: Optional[int] = Field(
+        None, gt=0, le=1000, example=4,
+        description="Servings to cook, the recipe's own servings if omitted")
+
+
+class ShoppingListRequest(BaseModel):
+    """Schema for building a shopping list"""
+    recipes: List[ShoppingListRecipe] = Field(..., min_length=1, max_length=100)
+
+
+class ShoppingListItem(BaseModel):
+    """Schema for one line of a shopping list"""
+    ingredient_id: int
+    name: str
+    quantity: float
+    unit: Optional[str]
+    recipe_ids: List[int]
+
+
+class ShoppingListResponse(BaseModel):
+    """Schema for a shopping list grouped by ingredient category"""
+    recipe_ids: List[int]
+    categories: Dict[str, List[ShoppingListItem]]
+
+
+class ScaledIngredient(BaseModel):
+    """Schema for an ingredient of a scaled recipe"""
+    ingredient_id: int
+    name: str
+    quantity: float
+    unit: str
+    original_quantity: float
+    step_id: Optional[int]
+
+
+class ScaledStep(BaseModel):
+    """Schema for a step of a scaled recipe"""
+    id: int
+    order_number: int
+    action_type: str
+    temperature: int
+    speed: int
+    duration: int
+    original_duration: int
+    description: Optional[str]
+
+
+class ScaledRecipeResponse(BaseModel):
+    """Schema for a recipe scaled to a number of servings"""
+    recipe_id: int
+    title: str
+    original_servings: int
+    servings: int
+    scale: float
+    ingredients: List[ScaledIngredient]
+    steps: List[ScaledStep]
+
+
+class ScaledRecipeBatchResponse(BaseModel):
+    """Schema for a recipe scaled to several numbers of servings"""
+    recipe_id: int
+    results: List[ScaledRecipeResponse]
+
+
 # ========== Helper Functions ==========
 
 def get_recipe_or_404(recipe_id: int, db: Session):
@@ -165,7 +264,8 @@ def get_recipe_or_404(recipe_id: int, db: Session):
     Raises:
         HTTPException: If recipe not found
     """
-    recipe = db.query(Recipe).filter(Recipe.id == recipe_id).first()
+    recipe = db.query(Recipe).filter(
+        Recipe.id == recipe_id, Recipe.deleted_at.is_(None)).first()
     if recipe is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -188,7 +288,8 @@ def get_user_or_404(user_id: int, db: Session):
     Raises:
         HTTPException: If user not found
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User).filter(
+        User.id == user_id, User.deleted_at.is_(None)).first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -197,6 +298,50 @@ def get_user_or_404(user_id: int, db: Session):
     return user
 
 
+def recipe_response_body(recipe: Recipe) -> dict:
+    """
+    Serialize a recipe the way RecipeResponse does, as plain JSON data
+
+    Args:
+        recipe: Recipe object
+
+    Returns:
+        JSON-compatible dict
+    """
+    return RecipeResponse.model_validate(recipe).model_dump(mode="json")
+
+
+def recipe_download_response(
+    recipe: Recipe,
+    db: Session,
+    export_format: str,
+    if_none_match: Optional[str],
+    exported_by: Optional[str] = None
+):
+    """
+    Serve a recipe export, answering 304 when the client already has it
+
+    Args:
+        recipe: Recipe to export (access must already be checked)
+        db: Database session
+        export_format: Export format name
+        if_none_match: Value of the If-None-Match request header
+        exported_by: Username recorded in the export, if any
+
+    Returns:
+        Download response or an empty 304 response
+    """
+    # Ingredient names and units come from the catalog, so its version is part
+    # of the export identity
+    catalog_version = ingredient_catalog.snapshot(db).version
+    etag = export_etag(recipe, export_format, exported_by, catalog_version)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    return render_recipe_export(
+        recipe, db, export_format, exported_by, catalog_version).to_response()
+
+
 # ========== Recipe Routes ==========
 
 @router.get("/", response_model=List[RecipeResponse])
@@ -217,7 +362,8 @@ def get_recipes(
         List of recipes
     """
     recipes = db.query(Recipe).filter(
-        Recipe.is_public == True
+        Recipe.is_public == True,
+        Recipe.deleted_at.is_(None)
     ).offset(skip).limit(limit).all()
 
     return recipes
@@ -268,7 +414,8 @@ async def get_user_recipes(
 
     # Get user's recipes
     recipes = db.query(Recipe).filter(
-        Recipe.user_id == user_id
+        Recipe.user_id == user_id,
+        Recipe.deleted_at.is_(None)
     ).offset(skip).limit(limit).all()
 
     return recipes
@@ -276,7 +423,7 @@ async def get_user_recipes(
 
 @router.get("/current/", response_model=List[RecipeResponse])
 async def get_current_user_recipes(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db),
     skip: int = 0,
     limit: int = 100
@@ -294,7 +441,8 @@ async def get_current_user_recipes(
         List of user's recipes
     """
     recipes = db.query(Recipe).filter(
-        Recipe.user_id == current_user.id
+        Recipe.user_id == current_user.id,
+        Recipe.deleted_at.is_(None)
     ).offset(skip).limit(limit).all()
 
     return recipes
@@ -371,10 +519,77 @@ def get_recipe_steps(recipe_id: int, db: Session = Depends(get_db)):
     return steps
 
 
+@router.get("/{recipe_id}/scaled", response_model=ScaledRecipeResponse)
+def get_scaled_recipe(
+    recipe_id: int,
+    servings: int = Query(..., gt=0, le=SCALE_MAX_SERVINGS),
+    scale_steps: bool = Query(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Get a recipe with its ingredient quantities scaled to a number of servings
+
+    Quantities are rounded to what can be measured in their unit (whole grams,
+    quarter teaspoons, half cloves, ...).
+
+    Args:
+        recipe_id: Recipe ID
+        servings: Servings to scale to
+        scale_steps: Also adjust step durations to the new quantities
+        db: Database session
+
+    Returns:
+        Scaled ingredients and steps
+
+    Raises:
+        HTTPException: If recipe not found
+    """
+    recipe = get_recipe_or_404(recipe_id, db)
+    catalog_version = ingredient_catalog.snapshot(db).version
+    return scale_recipe(recipe, db, servings, scale_steps, catalog_version)
+
+
+@router.get("/{recipe_id}/scaled/batch", response_model=ScaledRecipeBatchResponse)
+def get_scaled_recipe_batch(
+    recipe_id: int,
+    servings: List[int] = Query(..., min_length=1, max_length=SCALE_BATCH_MAX),
+    scale_steps: bool = Query(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Get a recipe scaled to several numbers of servings at once
+
+    Args:
+        recipe_id: Recipe ID
+        servings: Servings to scale to, repeated (?servings=2&servings=4)
+        scale_steps: Also adjust step durations to the new quantities
+        db: Database session
+
+    Returns:
+        One scaled recipe per servings value, in request order
+
+    Raises:
+        HTTPException: If recipe not found or a servings value is out of range
+    """
+    invalid = [value for value in servings if not 0 < value <= SCALE_MAX_SERVINGS]
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Servings must be between 1 and {SCALE_MAX_SERVINGS}: {invalid}"
+        )
+
+    recipe = get_recipe_or_404(recipe_id, db)
+    catalog_version = ingredient_catalog.snapshot(db).version
+    return {
+        "recipe_id": recipe.id,
+        "results": scale_recipe_many(recipe, db, servings, scale_steps, catalog_version)
+    }
+
+
 @router.post("/", response_model=RecipeResponse, status_code=status.HTTP_201_CREATED)
 async def create_recipe(
     recipe_data: RecipeCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -394,32 +609,36 @@ async def create_recipe(
         user_id=current_user.id
     )
 
-    # Add and commit to get recipe ID
+    # Add and flush to get recipe ID
     db.add(db_recipe)
+    db.flush()
+    record_counter_change(db, [db_recipe.id], before=NO_COUNTERS)
     db.commit()
     db.refresh(db_recipe)
 
     return db_recipe
 
 
-# Replace the create_complete_recipe function in recipe_router.py
-
-@router.post("/complete", response_model=RecipeResponse, status_code=status.HTTP_201_CREATED)
-async def create_complete_recipe(
+def create_complete_recipe_for_user(
     recipe_data: CompleteRecipeCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user_id: int,
+    db: Session,
+    idempotency_claim: Optional[IdempotencyClaim] = None
 ):
     """
-    Create a complete recipe with steps and ingredients
+    Create a recipe with its steps and ingredients in one transaction
 
     Args:
         recipe_data: Complete recipe data with steps and ingredients
-        current_user: Currently authenticated user
+        user_id: Owner of the new recipe
         db: Database session
+        idempotency_claim: Claim whose response is stored with the recipe
 
     Returns:
         Created recipe
+
+    Raises:
+        HTTPException: If the recipe could not be created
     """
     try:
         # Log incoming data for debugging
@@ -428,7 +647,7 @@ async def create_complete_recipe(
         # 1. Create recipe
         db_recipe = Recipe(
             **recipe_data.recipe.dict(),
-            user_id=current_user.id
+            user_id=user_id
         )
 
         db.add(db_recipe)
@@ -475,12 +694,20 @@ async def create_complete_recipe(
             )
             db.add(db_ingredient)
 
+        record_counter_change(db, [db_recipe.id], before=NO_COUNTERS)
+
+        if idempotency_claim is not None:
+            idempotency_claim.record_response(db, recipe_response_body(db_recipe))
+
         # Commit all changes
         db.commit()
         db.refresh(db_recipe)
 
         return db_recipe
 
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         print(f"Error creating recipe: {str(e)}")
@@ -492,6 +719,39 @@ async def create_complete_recipe(
         )
 
 
+@router.post("/complete", response_model=RecipeResponse, status_code=status.HTTP_201_CREATED)
+async def create_complete_recipe(
+    recipe_data: CompleteRecipeCreate,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    Create a complete recipe with steps and ingredients
+
+    Retries carrying the same Idempotency-Key header return the recipe created
+    by the first request instead of creating a duplicate.
+
+    Args:
+        recipe_data: Complete recipe data with steps and ingredients
+        idempotency_key: Client-generated key identifying this creation
+        current_user: Currently authenticated user
+        db: Database session
+
+    Returns:
+        Created recipe
+    """
+    return await run_idempotent(
+        idempotency_key,
+        current_user.id,
+        scope="POST /recipes/complete",
+        payload=recipe_data.model_dump(mode="json"),
+        handler=lambda claim: recipe_response_body(
+            create_complete_recipe_for_user(recipe_data, current_user.id, db, claim)),
+        status_code=status.HTTP_201_CREATED
+    )
+
+
 @router.get("/ingredients/list", response_model=List[dict])
 async def get_available_ingredients(
     db: Session = Depends(get_db),
@@ -509,16 +769,8 @@ async def get_available_ingredients(
     Returns:
         List of ingredients
     """
-    ingredients = db.query(Ingredient).offset(skip).limit(limit).all()
-
-    return [
-        {
-            "id": ingredient.id,
-            "name": ingredient.name,
-            "unit": ingredient.unit
-        }
-        for ingredient in ingredients
-    ]
+    snapshot = ingredient_catalog.snapshot(db)
+    return json_bytes_response(snapshot.page_json(skip, limit))
 
 
 def check_recipe_ownership(recipe_id: int, user_id: int, db: Session):
@@ -536,7 +788,8 @@ def check_recipe_ownership(recipe_id: int, user_id: int, db: Session):
     Raises:
         HTTPException: If recipe not found or user does not own it
     """
-    recipe = db.query(Recipe).filter(Recipe.id == recipe_id).first()
+    recipe = db.query(Recipe).filter(
+        Recipe.id == recipe_id, Recipe.deleted_at.is_(None)).first()
 
     if not recipe:
         raise HTTPException(
@@ -553,11 +806,38 @@ def check_recipe_ownership(recipe_id: int, user_id: int, db: Session):
     return recipe
 
 
+def check_recipe_version(recipe: Recipe, expected_version: Optional[int]):
+    """
+    Reject an update that was prepared against an older version of the recipe
+
+    Args:
+        recipe: Recipe being updated
+        expected_version: Version sent by the client (None skips the check)
+
+    Raises:
+        HTTPException: If the recipe was modified since the client read it
+    """
+    if expected_version is not None and expected_version != recipe.version:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Recipe was modified by someone else (current version {recipe.version}). "
+                   "Reload it and apply your changes again."
+        )
+
+
+def recipe_conflict_exception():
+    """Build the 409 raised when a concurrent edit wins the race at commit time"""
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Recipe was modified by someone else. Reload it and apply your changes again."
+    )
+
+
 @router.put("/{recipe_id}", response_model=RecipeResponse)
 async def update_recipe(
     recipe_id: int,
     recipe_data: RecipeUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -574,12 +854,27 @@ async def update_recipe(
     """
     # Check ownership
     db_recipe = check_recipe_ownership(recipe_id, current_user.id, db)
+    check_recipe_version(db_recipe, recipe_data.version)
+
+    # Only visibility and time changes move the counters
+    counters_changed = (
+        recipe_data.is_public != db_recipe.is_public
+        or recipe_data.preparation_time != db_recipe.preparation_time
+        or recipe_data.cooking_time != db_recipe.cooking_time
+    )
+    counters_before = recipe_counters(db, [recipe_id]) if counters_changed else NO_COUNTERS
 
     # Update recipe fields
-    for key, value in recipe_data.dict().items():
+    for key, value in recipe_data.dict(exclude={"version"}).items():
         setattr(db_recipe, key, value)
 
-    db.commit()
+    try:
+        if counters_changed:
+            record_counter_change(db, [recipe_id], before=counters_before)
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise recipe_conflict_exception()
     db.refresh(db_recipe)
 
     return db_recipe
@@ -589,7 +884,7 @@ async def update_recipe(
 async def update_complete_recipe(
     recipe_id: int,
     recipe_data: CompleteRecipeUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -607,11 +902,18 @@ async def update_complete_recipe(
     try:
         # Check ownership
         db_recipe = check_recipe_ownership(recipe_id, current_user.id, db)
+        check_recipe_version(db_recipe, recipe_data.recipe.version)
+        counters_before = recipe_counters(db, [recipe_id])
 
         # 1. Update recipe fields
-        for key, value in recipe_data.recipe.dict().items():
+        for key, value in recipe_data.recipe.dict(exclude={"version"}).items():
             setattr(db_recipe, key, value)
 
+        # Steps and ingredients are replaced below, so touch the recipe even
+        # when its own fields are unchanged; this bumps the version that
+        # exports are cached by
+        db_recipe.updated_at = get_utc_now()
+
         # 2. Delete existing recipe ingredients first (to resolve the foreign key constraint)
         db.query(RecipeIngredient).filter(
             RecipeIngredient.recipe_id == recipe_id).delete()
@@ -675,12 +977,21 @@ async def update_complete_recipe(
             )
             db.add(db_ingredient)
 
+        record_counter_change(db, [recipe_id], before=counters_before)
+
         # Commit all changes
         db.commit()
         db.refresh(db_recipe)
 
         return db_recipe
 
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        db.rollback()
+        raise
+    except StaleDataError:
+        db.rollback()
+        raise recipe_conflict_exception()
     except Exception as e:
         db.rollback()
         print(f"Error updating recipe: {str(e)}")
@@ -695,7 +1006,7 @@ async def update_complete_recipe(
 @router.get("/{recipe_id}/edit", response_model=CompleteRecipeUpdate)
 async def get_recipe_for_edit(
     recipe_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -736,25 +1047,20 @@ async def get_recipe_for_edit(
         "ingredients": ingredients
     }
 
-# Add this to your recipe_router.py
-
-
-@router.post("/{recipe_id}/copy", response_model=RecipeResponse, status_code=status.HTTP_201_CREATED)
-async def copy_recipe(
+def copy_recipe_for_user(
     recipe_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal,
+    db: Session,
+    idempotency_claim: Optional[IdempotencyClaim] = None
 ):
     """
-    Copy a recipe to the current user's account
-
-    Creates a new recipe with all steps and ingredients, but with the current user as owner.
-    The original recipe must be public or owned by the current user.
+    Copy a recipe with its steps and ingredients to another user's account
 
     Args:
         recipe_id: ID of the recipe to copy
-        current_user: Currently authenticated user
+        current_user: User who becomes the owner of the copy
         db: Database session
+        idempotency_claim: Claim whose response is stored with the copy
 
     Returns:
         The newly created recipe copy
@@ -765,7 +1071,7 @@ async def copy_recipe(
     try:
         # Get the original recipe
         original_recipe = db.query(Recipe).filter(
-            Recipe.id == recipe_id).first()
+            Recipe.id == recipe_id, Recipe.deleted_at.is_(None)).first()
 
         if not original_recipe:
             raise HTTPException(
@@ -847,6 +1153,11 @@ async def copy_recipe(
             )
             db.add(new_ingredient)
 
+        record_counter_change(db, [new_recipe.id], before=NO_COUNTERS)
+
+        if idempotency_claim is not None:
+            idempotency_claim.record_response(db, recipe_response_body(new_recipe))
+
         # Commit all changes
         db.commit()
         db.refresh(new_recipe)
@@ -867,19 +1178,55 @@ async def copy_recipe(
             detail=f"Error copying recipe: {str(e)}"
         )
 
-    # Add this to your recipe_router.py
+
+@router.post("/{recipe_id}/copy", response_model=RecipeResponse, status_code=status.HTTP_201_CREATED)
+async def copy_recipe(
+    recipe_id: int,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    Copy a recipe to the current user's account
+
+    Creates a new recipe with all steps and ingredients, but with the current user as owner.
+    The original recipe must be public or owned by the current user.
+    Retries carrying the same Idempotency-Key header return the first copy.
+
+    Args:
+        recipe_id: ID of the recipe to copy
+        idempotency_key: Client-generated key identifying this copy
+        current_user: Currently authenticated user
+        db: Database session
+
+    Returns:
+        The newly created recipe copy
+
+    Raises:
+        HTTPException: If recipe not found, not public, or user tries to copy their own recipe
+    """
+    return await run_idempotent(
+        idempotency_key,
+        current_user.id,
+        scope=f"POST /recipes/{recipe_id}/copy",
+        payload=None,
+        handler=lambda claim: recipe_response_body(
+            copy_recipe_for_user(recipe_id, current_user, db, claim)),
+        status_code=status.HTTP_201_CREATED
+    )
 
 
 @router.delete("/{recipe_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_recipe(
     recipe_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     Delete a recipe and all its associated data
 
-    Deletes the recipe along with all steps and ingredients.
+    Deletes the recipe along with all steps and ingredients. The recipe is
+    hidden immediately and physically removed by the background purger.
     Only the recipe owner can delete their recipe.
 
     Args:
@@ -894,11 +1241,21 @@ async def delete_recipe(
         HTTPException: If recipe not found or user is not the owner
     """
     try:
-        # Check ownership (this will raise 404 if recipe not found, 403 if not owner)
-        recipe = check_recipe_ownership(recipe_id, current_user.id, db)
-
-        # Delete the recipe (cascade will handle steps and ingredients)
-        db.delete(recipe)
+        # Single UPDATE setting the tombstone; the recipe disappears from
+        # every read path now and the purger removes it with its steps and
+        # ingredients in the background
+        counters_before = recipe_counters(db, [recipe_id])
+        deleted = db.query(Recipe).filter(
+            Recipe.id == recipe_id,
+            Recipe.user_id == current_user.id,
+            Recipe.deleted_at.is_(None)
+        ).update({Recipe.deleted_at: get_utc_now()}, synchronize_session=False)
+
+        if not deleted:
+            # Raises 404 if recipe not found, 403 if not owner
+            check_recipe_ownership(recipe_id, current_user.id, db)
+
+        record_counter_change(db, [recipe_id], before=counters_before)
         db.commit()
 
         return  # 204 No Content response
@@ -918,9 +1275,122 @@ async def delete_recipe(
         )
 
 
-@router.get("/{recipe_id}/download", response_class=JSONResponse)
+@router.post("/bulk-delete", response_model=RecipeBulkDeleteResponse)
+async def bulk_delete_recipes(
+    delete_data: RecipeBulkDelete,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    Delete several recipes of the current user at once
+
+    Ownership of all requested recipes is resolved with one query and the
+    owned ones are tombstoned with one UPDATE; the background purger removes
+    them with their steps and ingredients. Recipes that are missing or owned
+    by someone else are skipped and reported.
+
+    Args:
+        delete_data: IDs of the recipes to delete
+        current_user: Currently authenticated user
+        db: Database session
+
+    Returns:
+        IDs grouped into deleted, not_found and forbidden
+    """
+    recipe_ids = list(dict.fromkeys(delete_data.recipe_ids))
+
+    try:
+        owners = dict(db.query(Recipe.id, Recipe.user_id).filter(
+            Recipe.id.in_(recipe_ids),
+            Recipe.deleted_at.is_(None)
+        ).all())
+
+        owned = [rid for rid in recipe_ids if owners.get(rid) == current_user.id]
+        if owned:
+            counters_before = recipe_counters(db, owned)
+            db.query(Recipe).filter(
+                Recipe.id.in_(owned),
+                Recipe.user_id == current_user.id
+            ).update({Recipe.deleted_at: get_utc_now()}, synchronize_session=False)
+            record_counter_change(db, owned, before=counters_before)
+        db.commit()
+
+        return {
+            "deleted": owned,
+            "not_found": [rid for rid in recipe_ids if rid not in owners],
+            "forbidden": [rid for rid in recipe_ids
+                          if rid in owners and owners[rid] != current_user.id]
+        }
+
+    except Exception as e:
+        db.rollback()
+        print(f"Error deleting recipes: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error deleting recipes: {str(e)}"
+        )
+
+
+@router.post("/shopping-list", response_model=ShoppingListResponse)
+async def create_shopping_list(
+    request_data: ShoppingListRequest,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """
+    Combine the ingredients of several recipes into one shopping list
+
+    Quantities are scaled from each recipe's servings to the requested ones,
+    converted to the base unit of their dimension (g, ml or the counted unit)
+    and summed per ingredient.
+
+    Args:
+        request_data: Recipes with the servings to cook
+        current_user: Currently authenticated user
+        db: Database session
+
+    Returns:
+        Items grouped by ingredient category
+
+    Raises:
+        HTTPException: If a recipe does not exist or is private to another user
+    """
+    recipe_ids = list(dict.fromkeys(item.recipe_id for item in request_data.recipes))
+    recipes = db.query(Recipe.id, Recipe.servings, Recipe.user_id, Recipe.is_public).filter(
+        Recipe.id.in_(recipe_ids),
+        Recipe.deleted_at.is_(None)
+    ).all()
+
+    found = {recipe.id: recipe for recipe in recipes}
+    missing = [rid for rid in recipe_ids if rid not in found]
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Recipes not found: {missing}"
+        )
+    forbidden = [rid for rid in recipe_ids
+                 if not found[rid].is_public and found[rid].user_id != current_user.id]
+    if forbidden:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Recipes are private: {forbidden}"
+        )
+
+    scales = recipe_scales(
+        recipes, ((item.recipe_id, item.servings) for item in request_data.recipes))
+    return {
+        "recipe_ids": recipe_ids,
+        "categories": build_shopping_list(db, scales)
+    }
+
+
+@router.get("/{recipe_id}/download")
 async def download_recipe_json(
     recipe_id: int,
+    export_format: str = Query("json", alias="format"),
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """
@@ -931,10 +1401,13 @@ async def download_recipe_json(
 
     Args:
         recipe_id: Recipe ID to download
+        export_format: Export format (json, compact or markdown)
+        if_none_match: ETag of a previously downloaded export
         db: Database session
 
     Returns:
-        JSONResponse with recipe data and appropriate headers for download
+        Response with recipe data and appropriate headers for download,
+        or 304 Not Modified if the client copy is current
 
     Raises:
         HTTPException: If recipe not found or not accessible
@@ -953,79 +1426,8 @@ async def download_recipe_json(
                 detail="This recipe is private and cannot be downloaded"
             )
 
-        # Get recipe steps
-        steps = db.query(Step).filter(
-            Step.recipe_id == recipe_id
-        ).order_by(Step.order_number).all()
-
-        # Get recipe ingredients with ingredient details
-        recipe_ingredients = db.query(
-            RecipeIngredient.quantity,
-            RecipeIngredient.step_id,
-            Ingredient.id,
-            Ingredient.name,
-            Ingredient.unit
-        ).join(
-            Ingredient, RecipeIngredient.ingredient_id == Ingredient.id
-        ).filter(
-            RecipeIngredient.recipe_id == recipe_id
-        ).all()
-
-        # Format the complete recipe data
-        recipe_data = {
-            "recipe": {
-                "id": recipe.id,
-                "title": recipe.title,
-                "description": recipe.description,
-                "is_public": recipe.is_public,
-                "preparation_time": recipe.preparation_time,
-                "cooking_time": recipe.cooking_time,
-                "servings": recipe.servings,
-                "created_at": recipe.created_at.isoformat() if recipe.created_at else None,
-                "updated_at": recipe.updated_at.isoformat() if recipe.updated_at else None
-            },
-            "steps": [
-                {
-                    "order_number": step.order_number,
-                    "action_type": step.action_type,
-                    "temperature": step.temperature,
-                    "speed": step.speed,
-                    "duration": step.duration,
-                    "description": step.description
-                }
-                for step in steps
-            ],
-            "ingredients": [
-                {
-                    "name": ingredient.name,
-                    "quantity": ingredient.quantity,
-                    "unit": ingredient.unit,
-                    "step_id": ingredient.step_id
-                }
-                for ingredient in recipe_ingredients
-            ],
-            "export_info": {
-                "exported_at": datetime.utcnow().isoformat(),
-                "format_version": "1.0",
-                "source": "DreamFoodX Recipe App"
-            }
-        }
-
-        # Create filename
-        safe_title = "".join(
-            c for c in recipe.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        safe_title = safe_title.replace(' ', '_')
-        filename = f"dreamfoodx_recipe_{safe_title}_{recipe.id}.json"
-
-        # Return JSON response with download headers
-        return JSONResponse(
-            content=recipe_data,
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Type": "application/json",
-                "Cache-Control": "no-cache"
-            }
-        )
+        return recipe_download_response(
+            recipe, db, validate_export_format(export_format), if_none_match)
 
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -1043,7 +1445,9 @@ async def download_recipe_json(
 @router.get("/{recipe_id}/download/authenticated")
 async def download_recipe_json_authenticated(
     recipe_id: int,
-    current_user: User = Depends(get_current_user),
+    export_format: str = Query("json", alias="format"),
+    if_none_match: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -1054,11 +1458,14 @@ async def download_recipe_json_authenticated(
 
     Args:
         recipe_id: Recipe ID to download
+        export_format: Export format (json, compact or markdown)
+        if_none_match: ETag of a previously downloaded export
         current_user: Currently authenticated user
         db: Database session
 
     Returns:
-        JSONResponse with recipe data and download headers
+        Response with recipe data and download headers,
+        or 304 Not Modified if the client copy is current
     """
     try:
         # Get the recipe
@@ -1071,80 +1478,9 @@ async def download_recipe_json_authenticated(
                 detail="You don't have permission to download this recipe"
             )
 
-        # Get recipe steps
-        steps = db.query(Step).filter(
-            Step.recipe_id == recipe_id
-        ).order_by(Step.order_number).all()
-
-        # Get recipe ingredients with ingredient details
-        recipe_ingredients = db.query(
-            RecipeIngredient.quantity,
-            RecipeIngredient.step_id,
-            Ingredient.id,
-            Ingredient.name,
-            Ingredient.unit
-        ).join(
-            Ingredient, RecipeIngredient.ingredient_id == Ingredient.id
-        ).filter(
-            RecipeIngredient.recipe_id == recipe_id
-        ).all()
-
-        # Format the complete recipe data
-        recipe_data = {
-            "recipe": {
-                "id": recipe.id,
-                "title": recipe.title,
-                "description": recipe.description,
-                "is_public": recipe.is_public,
-                "preparation_time": recipe.preparation_time,
-                "cooking_time": recipe.cooking_time,
-                "servings": recipe.servings,
-                "created_at": recipe.created_at.isoformat() if recipe.created_at else None,
-                "updated_at": recipe.updated_at.isoformat() if recipe.updated_at else None
-            },
-            "steps": [
-                {
-                    "order_number": step.order_number,
-                    "action_type": step.action_type,
-                    "temperature": step.temperature,
-                    "speed": step.speed,
-                    "duration": step.duration,
-                    "description": step.description
-                }
-                for step in steps
-            ],
-            "ingredients": [
-                {
-                    "name": ingredient.name,
-                    "quantity": ingredient.quantity,
-                    "unit": ingredient.unit,
-                    "step_id": ingredient.step_id
-                }
-                for ingredient in recipe_ingredients
-            ],
-            "export_info": {
-                "exported_at": datetime.utcnow().isoformat(),
-                "exported_by": current_user.username,
-                "format_version": "1.0",
-                "source": "DreamFoodX Recipe App"
-            }
-        }
-
-        # Create filename
-        safe_title = "".join(
-            c for c in recipe.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        safe_title = safe_title.replace(' ', '_')
-        filename = f"dreamfoodx_recipe_{safe_title}_{recipe.id}.json"
-
-        # Return JSON response with download headers
-        return JSONResponse(
-            content=recipe_data,
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Type": "application/json",
-                "Cache-Control": "no-cache"
-            }
-        )
+        return recipe_download_response(
+            recipe, db, validate_export_format(export_format), if_none_match,
+            exported_by=current_user.username)
 
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -1,11 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from typing import List, Annotated
+from datetime import datetime
+import json
+from typing import List, Annotated, Optional
 from pydantic import BaseModel, EmailStr, Field, SecretStr
 
 from db.base import get_db
 from db.entries.User import User
+from db.entries.Recipe import Recipe
+from db.entries.TimestampMixin import get_utc_now
+from routers.auth_router import get_current_principal, require_admin
+from services.password_hashing import password_hasher
+from services.principals import Principal, token_versions
+from services.recipe_counters import recipe_counters, record_counter_change
+from services.user_provisioning import (
+    USER_BATCH_MAX_ROWS,
+    ProvisionRow,
+    conflicting_user_field,
+    provision_users,
+)
+from services.user_search import (
+    USER_SEARCH_DEFAULT_LIMIT,
+    USER_SEARCH_MAX_LIMIT,
+    InvalidCursor,
+    find_user_by_username,
+    search_users,
+)
+from services.user_stats import load_user_stats
 
 router = APIRouter(
     prefix="/users",
@@ -38,6 +61,58 @@ class UserResponse(UserBase):
         from_attributes = True
 
 
+class UserBatchCreate(BaseModel):
+    """Schema for provisioning many users at once"""
+    users: List[UserCreate] = Field(..., min_length=1, max_length=USER_BATCH_MAX_ROWS)
+
+
+class UserBatchResult(BaseModel):
+    """Outcome of one user of a batch"""
+    row: int
+    id: Optional[int] = None
+    status: str
+    field: Optional[str] = None
+
+
+class UserBatchResponse(BaseModel):
+    """Schema for the outcome of a user batch"""
+    created: int
+    conflict: int
+    duplicate: int
+    results: List[UserBatchResult]
+
+
+class UserSearchResponse(BaseModel):
+    """Schema for one page of user search results"""
+    users: List[UserResponse]
+    next_cursor: Optional[str] = None
+
+
+class TopIngredient(BaseModel):
+    """One of the ingredients a user cooks with most"""
+    ingredient_id: int
+    name: str
+    recipe_count: int
+
+
+class UserStatsResponse(BaseModel):
+    """Schema for the profile statistics of a user"""
+    user_id: int
+    recipe_count: int = 0
+    public_recipe_count: int = 0
+    total_preparation_time: int = 0
+    total_cooking_time: int = 0
+    top_ingredients: List[TopIngredient] = []
+    top_ingredients_updated_at: Optional[datetime] = None
+
+
+# field -> message of a signup conflict
+CONFLICT_MESSAGES = {
+    "username": "Username already registered",
+    "email": "Email already registered",
+}
+
+
 @router.post("/", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 def create_user(user: UserCreate, db: Annotated[Session, Depends(get_db)]):
     """
@@ -53,38 +128,71 @@ def create_user(user: UserCreate, db: Annotated[Session, Depends(get_db)]):
     Raises:
         HTTPException: If username or email already exists
     """
-    try:
-        existing_username = db.query(User).filter(
-            User.username == user.username).first()
-        if existing_username:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Username already registered"
-            )
-
-        existing_email = db.query(User).filter(
-            User.email == user.email).first()
-        if existing_email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
-
-        db_user = User(
-            username=user.username,
-            email=user.email
-        )
-        db_user.password = user.password
+    # Hashed on the bounded hashing pool; this thread only waits
+    db_user = User(
+        username=user.username,
+        email=user.email,
+        hashed_password=password_hasher.hash(user.password)
+    )
 
+    # The unique indexes detect taken usernames and emails. The response is
+    # serialized before the commit expires the new row, so the INSERT is the
+    # only statement
+    try:
         db.add(db_user)
+        db.flush()
+        response = UserResponse.model_validate(db_user)
         db.commit()
-        db.refresh(db_user)
-        return db_user
-    except IntegrityError:
+    except IntegrityError as e:
         db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Error creating user. Username or email may already be in use."
+            detail=CONFLICT_MESSAGES.get(
+                conflicting_user_field(e),
+                "Error creating user. Username or email may already be in use.")
+        )
+    return response
+
+
+@router.post("/batch", response_model=UserBatchResponse, dependencies=[Depends(require_admin)])
+async def create_users_batch(
+    batch: UserBatchCreate,
+    db: Annotated[Session, Depends(get_db)]
+):
+    """
+    Provision many users at once, e.g. when onboarding an organization
+    (requires the admin token)
+
+    Passwords are hashed in parallel on the hashing pool, then the accounts
+    are inserted in chunks. Taken usernames or emails do not fail the batch;
+    they are reported per row.
+
+    Args:
+        batch: Users to create
+        db: Database session
+
+    Returns:
+        Totals per status and, for every user, its id and status (created,
+        conflict with an existing user or duplicate of an earlier row) plus
+        the field at fault
+    """
+    hashes = await password_hasher.hash_many_async([user.password for user in batch.users])
+    rows = [
+        ProvisionRow(row=index, username=user.username, email=user.email,
+                     hashed_password=hashed)
+        for index, (user, hashed) in enumerate(zip(batch.users, hashes))
+    ]
+
+    try:
+        return await run_in_threadpool(provision_users, db, rows)
+    except Exception as e:
+        db.rollback()
+        print(f"Error provisioning users: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error provisioning users: {str(e)}"
         )
 
 
@@ -101,10 +209,132 @@ def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     Returns:
         List of users
     """
-    users = db.query(User).offset(skip).limit(limit).all()
+    users = db.query(User).filter(
+        User.deleted_at.is_(None)
+    ).offset(skip).limit(limit).all()
     return users
 
 
+@router.get("/search", response_model=UserSearchResponse)
+def search_users_by_username(
+    db: Annotated[Session, Depends(get_db)],
+    q: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(USER_SEARCH_DEFAULT_LIMIT, ge=1, le=USER_SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None
+):
+    """
+    Find users whose username starts with a prefix, ignoring case and accents
+
+    Args:
+        db: Database session
+        q: Username prefix
+        limit: Maximum number of users to return
+        cursor: next_cursor of the previous page
+
+    Returns:
+        Users ordered by username and the cursor of the next page, if any
+
+    Raises:
+        HTTPException: If the cursor is invalid
+    """
+    try:
+        users, next_cursor = search_users(db, q, limit, cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"users": users, "next_cursor": next_cursor}
+
+
+@router.get("/by-username/{username}", response_model=UserResponse)
+def read_user_by_username(username: str, db: Annotated[Session, Depends(get_db)]):
+    """
+    Get a specific user by username, ignoring case and accents
+
+    Args:
+        username: Username
+        db: Database session
+
+    Returns:
+        User information
+
+    Raises:
+        HTTPException: If user not found
+    """
+    db_user = find_user_by_username(db, username)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@router.delete("/me", status_code=status.HTTP_204_NO_CONTENT)
+def delete_current_user(
+    current_user: Annotated[Principal, Depends(get_current_principal)],
+    db: Annotated[Session, Depends(get_db)]
+):
+    """
+    Delete the account of the authenticated user together with their recipes
+
+    The account and recipes are tombstoned right away and removed by the
+    background purger, so the request does not depend on how much data the
+    user owns.
+
+    Args:
+        current_user: Currently authenticated user
+        db: Database session
+    """
+    now = get_utc_now()
+    recipe_ids = [recipe_id for recipe_id, in db.query(Recipe.id).filter(
+        Recipe.user_id == current_user.id,
+        Recipe.deleted_at.is_(None)
+    )]
+    counters_before = recipe_counters(db, recipe_ids)
+    if recipe_ids:
+        db.query(Recipe).filter(
+            Recipe.id.in_(recipe_ids)
+        ).update({Recipe.deleted_at: now}, synchronize_session=False)
+    db.query(User).filter(
+        User.id == current_user.id
+    ).update({User.deleted_at: now}, synchronize_session=False)
+    record_counter_change(db, recipe_ids, before=counters_before)
+    db.commit()
+    token_versions.record_revoked(current_user.id)
+
+
+@router.get("/{user_id}/stats", response_model=UserStatsResponse)
+def read_user_stats(user_id: int, db: Annotated[Session, Depends(get_db)]):
+    """
+    Get the profile statistics of a user
+
+    Recipe counts and total times are always current; the most used
+    ingredients are refreshed periodically (see top_ingredients_updated_at).
+
+    Args:
+        user_id: User ID
+        db: Database session
+
+    Returns:
+        Recipe counts, total preparation and cooking time and top ingredients
+
+    Raises:
+        HTTPException: If user not found
+    """
+    row = load_user_stats(db, user_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    stats = row.UserStats
+    if stats is None:
+        return {"user_id": user_id}
+    return {
+        "user_id": user_id,
+        "recipe_count": stats.recipe_count,
+        "public_recipe_count": stats.public_recipe_count,
+        "total_preparation_time": stats.total_preparation_time,
+        "total_cooking_time": stats.total_cooking_time,
+        "top_ingredients": json.loads(stats.top_ingredients or "[]"),
+        "top_ingredients_updated_at": stats.top_ingredients_updated_at,
+    }
+
+
 @router.get("/{user_id}", response_model=UserResponse)
 def read_user(user_id: int, db: Annotated[Session, Depends(get_db)]):
     """
@@ -120,7 +350,8 @@ def read_user(user_id: int, db: Annotated[Session, Depends(get_db)]):
     Raises:
         HTTPException: If user not found
     """
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = db.query(User).filter(
+        User.id == user_id, User.deleted_at.is_(None)).first()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
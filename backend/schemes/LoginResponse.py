@@ -4,5 +4,6 @@ from schemes.UserPublic import UserPublic
 
 class LoginResponse(BaseModel):
     access_token: str
+    refresh_token: str
     token_type: str
     user: UserPublic
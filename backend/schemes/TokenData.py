@@ -4,3 +4,5 @@ from typing import Optional
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[int] = None
+    token_version: int = 0
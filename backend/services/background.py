@@ -0,0 +1,62 @@
+"""
+Periodic background jobs run in daemon threads next to the API.
+
+Jobs are registered in main.py and started/stopped by the application lifespan.
+Every worker process runs its own copy, so jobs must be safe to run concurrently.
+"""
+import traceback
+from dataclasses import dataclass, field
+from threading import Event, Thread
+from typing import Callable, List, Optional
+
+
+@dataclass
+class PeriodicJob:
+    """A function called every interval_seconds until stopped"""
+    name: str
+    interval_seconds: float
+    func: Callable[[], object]
+    thread: Optional[Thread] = field(default=None, repr=False)
+
+    def run(self, stop_event: Event):
+        while not stop_event.wait(self.interval_seconds):
+            try:
+                self.func()
+            except Exception as e:
+                print(f"Background job {self.name} failed: {str(e)}")
+                traceback.print_exc()
+
+
+_jobs: List[PeriodicJob] = []
+_stop_event = Event()
+
+
+def register_job(name: str, interval_seconds: float, func: Callable[[], object]):
+    """
+    Register a periodic job; non-positive intervals disable it
+
+    Args:
+        name: Job name used for the thread and in logs
+        interval_seconds: Delay between runs
+        func: Callable without arguments
+    """
+    if interval_seconds > 0:
+        _jobs.append(PeriodicJob(name, interval_seconds, func))
+
+
+def start_background_jobs():
+    """Start a daemon thread for every registered job"""
+    _stop_event.clear()
+    for job in _jobs:
+        job.thread = Thread(target=job.run, args=(_stop_event,),
+                            name=f"job-{job.name}", daemon=True)
+        job.thread.start()
+
+
+def stop_background_jobs(timeout: float = 5.0):
+    """Signal all jobs to stop and wait for the current runs to finish"""
+    _stop_event.set()
+    for job in _jobs:
+        if job.thread is not None:
+            job.thread.join(timeout)
+            job.thread = None
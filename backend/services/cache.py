@@ -0,0 +1,103 @@
+"""
+Small in-process caches shared by the routers
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Union
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from db.entries.CacheVersion import CacheVersion
+from services.upsert import upsert_statement
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with a fixed number of entries.
+
+    Keeps simple hit/miss counters so callers can report cache efficiency.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for key and mark it as recently used
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Store a value, evicting the least recently used entry when full
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        """
+        Remove a key if present
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every entry
+        """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def read_cache_version(db: Session, name: str) -> int:
+    """
+    Read the shared version counter of a cached data set
+
+    Args:
+        db: Database session
+        name: Name of the cached data set
+
+    Returns:
+        Current version, 0 if the data set was never written
+    """
+    version = db.query(CacheVersion.version).filter(
+        CacheVersion.name == name).scalar()
+    return version or 0
+
+
+def bump_cache_version(db: Union[Session, Connection], name: str):
+    """
+    Increment the version counter of a cached data set
+
+    Call it in the same transaction as the write it announces, so other
+    workers never see the new version before the new data. The counter row
+    is created by the first bump; a single upsert keeps two first writers
+    from both inserting it.
+
+    Args:
+        db: Database session, or connection for Core writes
+        name: Name of the cached data set
+    """
+    dialect = db.get_bind().dialect if isinstance(db, Session) else db.dialect
+    table = CacheVersion.__table__
+    db.execute(upsert_statement(
+        dialect.name, table, ["name"],
+        lambda incoming: {"version": table.c.version + 1}
+    ), [{"name": name, "version": 1}])
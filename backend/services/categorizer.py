@@ -0,0 +1,282 @@
+"""
+Name based ingredient categorization.
+
+All patterns are compiled into one regular expression, factored as a trie so
+the engine rejects a position after a character or two, and wrapped in a
+lookahead so every position of a name is tried. A batch of names is joined
+with newlines and scanned in a single pass; of all patterns found in a name,
+the longest wins ("bell pepper" over "pepper"), then the rightmost.
+"""
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from db.entries.Ingredient import normalize_name
+from services.cache import bump_cache_version
+from services.ingredient_catalog import INGREDIENT_CATALOG
+
+load_dotenv()
+
+CATEGORIZE_BATCH_SIZE = int(os.getenv("CATEGORIZE_BATCH_SIZE", "5000"))
+DEFAULT_CATEGORY = "other"
+
+# name pattern -> category
+INGREDIENT_CATEGORY_PATTERNS = {
+    # Vegetables
+    "onion": "vegetables",
+    "garlic": "vegetables",
+    "tomato": "vegetables",
+    "carrot": "vegetables",
+    "potato": "vegetables",
+    "bell pepper": "vegetables",
+    "mushroom": "vegetables",
+    "spinach": "vegetables",
+    "broccoli": "vegetables",
+    "zucchini": "vegetables",
+    "cucumber": "vegetables",
+    "lettuce": "vegetables",
+
+    # Fruits
+    "apple": "fruits",
+    "lemon": "fruits",
+    "orange": "fruits",
+    "banana": "fruits",
+    "lime": "fruits",
+    "berry": "fruits",
+    "grape": "fruits",
+
+    # Meat & Poultry
+    "chicken": "meat_poultry",
+    "beef": "meat_poultry",
+    "pork": "meat_poultry",
+    "turkey": "meat_poultry",
+    "lamb": "meat_poultry",
+    "duck": "meat_poultry",
+    "meat": "meat_poultry",
+
+    # Seafood
+    "salmon": "seafood",
+    "tuna": "seafood",
+    "shrimp": "seafood",
+    "cod": "seafood",
+    "fish": "seafood",
+    "crab": "seafood",
+    "lobster": "seafood",
+
+    # Dairy & Eggs
+    "milk": "dairy",
+    "butter": "dairy",
+    "cheese": "dairy",
+    "cream": "dairy",
+    "yogurt": "dairy",
+    "egg": "dairy",
+    "mozzarella": "dairy",
+    "parmesan": "dairy",
+    "cheddar": "dairy",
+
+    # Grains & Cereals
+    "pasta": "grains_cereals",
+    "spaghetti": "grains_cereals",
+    "rice": "grains_cereals",
+    "flour": "grains_cereals",
+    "bread": "grains_cereals",
+    "oats": "grains_cereals",
+    "quinoa": "grains_cereals",
+    "barley": "grains_cereals",
+    "wheat": "grains_cereals",
+
+    # Legumes & Nuts
+    "bean": "legumes",
+    "lentil": "legumes",
+    "chickpea": "legumes",
+    "almond": "legumes",
+    "walnut": "legumes",
+    "peanut": "legumes",
+    "cashew": "legumes",
+    "pistachio": "legumes",
+
+    # Herbs & Spices
+    "basil": "herbs_spices",
+    "oregano": "herbs_spices",
+    "thyme": "herbs_spices",
+    "rosemary": "herbs_spices",
+    "parsley": "herbs_spices",
+    "salt": "herbs_spices",
+    "pepper": "herbs_spices",
+    "paprika": "herbs_spices",
+    "cumin": "herbs_spices",
+    "cinnamon": "herbs_spices",
+    "ginger": "herbs_spices",
+    "turmeric": "herbs_spices",
+
+    # Oils & Fats
+    "oil": "oils_fats",
+    "olive oil": "oils_fats",
+    "coconut oil": "oils_fats",
+    "vegetable oil": "oils_fats",
+    "canola oil": "oils_fats",
+    "avocado oil": "oils_fats",
+
+    # Condiments & Sauces
+    "vinegar": "condiments",
+    "soy sauce": "condiments",
+    "honey": "condiments",
+    "mustard": "condiments",
+    "ketchup": "condiments",
+    "mayonnaise": "condiments",
+    "sauce": "condiments",
+
+    # Beverages
+    "water": "beverages",
+    "wine": "beverages",
+    "stock": "beverages",
+    "broth": "beverages",
+    "juice": "beverages",
+    "beer": "beverages",
+
+    # Other/Baking
+    "sugar": "other",
+    "brown sugar": "other",
+    "baking powder": "other",
+    "baking soda": "other",
+    "vanilla": "other",
+    "cocoa": "other",
+    "chocolate": "other",
+    "yeast": "other",
+}
+
+
+def trie_regex(words: Iterable[str]) -> str:
+    """
+    Build a regex matching any of words, factored by common prefixes
+
+    Where one word is a prefix of another the longer one is tried first, so
+    at any position the longest word matches.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class Categorizer:
+    """Assigns categories to ingredient names from substring patterns"""
+
+    def __init__(self, patterns: Dict[str, str], default: str = DEFAULT_CATEGORY):
+        self.default = default
+        self.patterns = {normalize_name(pattern): category
+                         for pattern, category in patterns.items()}
+        self._regex = re.compile(f"(?=({trie_regex(self.patterns)}))")
+
+    def categorize(self, name: str) -> str:
+        """Category of one name"""
+        return self.categorize_many([name])[0]
+
+    def categorize_many(self, names: Iterable[str]) -> List[str]:
+        """
+        Categories of a batch of names, in order
+
+        The names are scanned as one newline separated text; patterns never
+        contain a newline, so a match cannot span two names.
+        """
+        normalized = [normalize_name(name or "") for name in names]
+        best: List[str] = [None] * len(normalized)
+        best_length = [0] * len(normalized)
+
+        ends = []
+        offset = 0
+        for name in normalized:
+            offset += len(name) + 1
+            ends.append(offset)
+
+        # Matches come in position order, so ">=" keeps the rightmost of the
+        # longest patterns
+        row = 0
+        for match in self._regex.finditer("\n".join(normalized)):
+            position = match.start()
+            while ends[row] <= position:
+                row += 1
+            pattern = match.group(1)
+            if len(pattern) >= best_length[row]:
+                best_length[row] = len(pattern)
+                best[row] = pattern
+
+        return [self.patterns[found] if found else self.default for found in best]
+
+
+def write_categories(connection: Connection, categories: Dict[int, str]):
+    """
+    Set the category of many ingredients with one CASE update
+
+    Ids are integers from the database and are inlined; categories are bound.
+    """
+    if not categories:
+        return
+    names = {category: f"category_{index}"
+             for index, category in enumerate(set(categories.values()))}
+    whens = " ".join(f"WHEN {int(ingredient_id)} THEN :{names[category]}"
+                     for ingredient_id, category in categories.items())
+    ids = ", ".join(str(int(ingredient_id)) for ingredient_id in categories)
+    connection.execute(
+        text(f"UPDATE ingredients SET category = CASE id {whens} END WHERE id IN ({ids})"),
+        {name: category for category, name in names.items()}
+    )
+
+
+def recategorize_ingredients(
+    engine: Engine,
+    categorizer: Optional[Categorizer] = None,
+    batch_size: int = CATEGORIZE_BATCH_SIZE
+) -> Tuple[int, int]:
+    """
+    Categorize every ingredient by name, streaming the table in batches
+
+    Rows are read through a server side cursor and each batch's changed
+    categories are written with one CASE update and committed, so memory and
+    lock time stay flat however large the table is. A batch that changes
+    categories bumps the catalog version in its transaction, so the workers
+    reload their ingredient catalog.
+
+    Args:
+        engine: Database engine
+        categorizer: Categorizer to apply (defaults to ingredient_categorizer)
+        batch_size: Rows per read, update and commit
+
+    Returns:
+        (number of ingredients scanned, number whose category changed)
+    """
+    categorizer = categorizer or ingredient_categorizer
+    scanned = changed = 0
+    with engine.connect() as reader, engine.connect() as writer:
+        result = reader.execution_options(stream_results=True).execute(
+            text("SELECT id, name, category FROM ingredients"))
+        for rows in result.partitions(batch_size):
+            categories = categorizer.categorize_many(row.name for row in rows)
+            updates = {row.id: category for row, category in zip(rows, categories)
+                       if row.category != category}
+            write_categories(writer, updates)
+            if updates:
+                bump_cache_version(writer, INGREDIENT_CATALOG)
+            writer.commit()
+            scanned += len(rows)
+            changed += len(updates)
+    return scanned, changed
+
+
+ingredient_categorizer = Categorizer(INGREDIENT_CATEGORY_PATTERNS)
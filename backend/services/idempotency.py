@@ -0,0 +1,259 @@
+"""
+Idempotency-Key support for non-idempotent POST endpoints.
+
+The first request with a given key claims a row in idempotency_keys before doing
+any work. Its response is written to that row in the same transaction as the
+work itself, so either both are committed or neither is. Retries with the same
+key replay the stored response without re-executing; retries that arrive while
+the original is still running wait for it to finish.
+
+A claim is a lease. When its holder crashed or was killed before committing,
+a retry takes the claim over once IDEMPOTENCY_CLAIM_LEASE_SECONDS have passed
+and executes the request itself. Writing the response is conditional on still
+holding the claim, so an original that was merely slow fails instead of
+committing a duplicate.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Union
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from db.base import SessionLocal
+from db.entries.IdempotencyKey import IdempotencyKey
+
+load_dotenv()
+
+IDEMPOTENCY_KEY_TTL = timedelta(hours=int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24")))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+IDEMPOTENCY_CLAIM_LEASE = timedelta(seconds=int(os.getenv("IDEMPOTENCY_CLAIM_LEASE_SECONDS", "60")))
+MAX_KEY_LENGTH = 255
+
+
+def hash_request(scope: str, payload: Any) -> str:
+    """
+    Fingerprint a request so a key cannot be reused for a different request
+
+    Args:
+        scope: Endpoint identifier, e.g. "POST /recipes/complete"
+        payload: JSON-serializable request data
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    canonical = json.dumps([scope, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _is_expired(record: IdempotencyKey) -> bool:
+    created_at = record.created_at.replace(tzinfo=None)
+    return created_at < datetime.utcnow() - IDEMPOTENCY_KEY_TTL
+
+
+def _lease_expired(record: IdempotencyKey) -> bool:
+    claimed_at = record.claimed_at.replace(tzinfo=None)
+    return claimed_at < datetime.utcnow() - IDEMPOTENCY_CLAIM_LEASE
+
+
+class IdempotencyClaim:
+    """A key held by the request that is executing it"""
+
+    def __init__(self, key: str, user_id: int, token: str, status_code: int):
+        self.key = key
+        self.user_id = user_id
+        self.token = token
+        self.status_code = status_code
+
+    def _filter(self, query):
+        return query.filter(
+            IdempotencyKey.user_id == self.user_id,
+            IdempotencyKey.key == self.key,
+            IdempotencyKey.claim_token == self.token
+        )
+
+    def record_response(self, db: Session, body: Any):
+        """
+        Store the response in the transaction of the request's own writes;
+        committed by the caller
+
+        Raises:
+            HTTPException: If a retry took the claim over meanwhile (409)
+        """
+        stored = self._filter(db.query(IdempotencyKey)).filter(
+            IdempotencyKey.status_code.is_(None)
+        ).update({
+            IdempotencyKey.status_code: self.status_code,
+            IdempotencyKey.response_body: json.dumps(body)
+        }, synchronize_session=False)
+        if not stored:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="The claim on this Idempotency-Key expired and was taken over by a retry"
+            )
+
+    def release(self):
+        """Drop the claim of a failed request so a retry can execute it again"""
+        with SessionLocal() as session:
+            self._filter(session.query(IdempotencyKey)).filter(
+                IdempotencyKey.status_code.is_(None)
+            ).delete(synchronize_session=False)
+            session.commit()
+
+
+async def claim_idempotency_key(
+    key: str,
+    user_id: int,
+    request_hash: str,
+    status_code: int = status.HTTP_200_OK
+) -> Union[IdempotencyClaim, JSONResponse]:
+    """
+    Claim a key for a new request, or return the response stored for it
+
+    Args:
+        key: Client-supplied Idempotency-Key header
+        user_id: Owner of the key (keys are scoped per user)
+        request_hash: Fingerprint from hash_request
+        status_code: Status code of a successful response
+
+    Returns:
+        The claim if the caller now owns the key and must execute the request,
+        otherwise the replayed response of the original request
+
+    Raises:
+        HTTPException: If the key is reused for a different request (422)
+            or the original request is still running after the wait (409)
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"
+        )
+
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        token = secrets.token_hex(16)
+        claim = IdempotencyClaim(key, user_id, token, status_code)
+        with SessionLocal() as session:
+            session.add(IdempotencyKey(
+                user_id=user_id, key=key, request_hash=request_hash, claim_token=token))
+            try:
+                session.commit()
+                return claim
+            except IntegrityError:
+                session.rollback()
+
+            record = session.query(IdempotencyKey).filter(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key
+            ).first()
+
+            if record is None:
+                # Released by a failed original request in the meantime
+                continue
+
+            if _is_expired(record):
+                session.delete(record)
+                session.commit()
+                continue
+
+            if record.request_hash != request_hash:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key was already used for a different request"
+                )
+
+            if record.status_code is not None:
+                return JSONResponse(
+                    content=json.loads(record.response_body),
+                    status_code=record.status_code,
+                    headers={"Idempotent-Replayed": "true"}
+                )
+
+            if _lease_expired(record):
+                # The holder died before committing; take over if no other
+                # retry was faster
+                taken = session.query(IdempotencyKey).filter(
+                    IdempotencyKey.id == record.id,
+                    IdempotencyKey.claim_token == record.claim_token,
+                    IdempotencyKey.status_code.is_(None)
+                ).update({
+                    IdempotencyKey.claim_token: token,
+                    IdempotencyKey.claimed_at: datetime.utcnow()
+                }, synchronize_session=False)
+                session.commit()
+                if taken:
+                    return claim
+                continue
+
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still being processed"
+            )
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+
+def purge_expired_idempotency_keys() -> int:
+    """
+    Delete keys older than the TTL
+
+    Returns:
+        Number of deleted keys
+    """
+    with SessionLocal() as session:
+        deleted = session.query(IdempotencyKey).filter(
+            IdempotencyKey.created_at < datetime.utcnow() - IDEMPOTENCY_KEY_TTL
+        ).delete()
+        session.commit()
+        return deleted
+
+
+async def run_idempotent(
+    idempotency_key: Optional[str],
+    user_id: int,
+    scope: str,
+    payload: Any,
+    handler: Callable[[Optional[IdempotencyClaim]], Any],
+    status_code: int = status.HTTP_200_OK
+):
+    """
+    Execute handler at most once per (user, Idempotency-Key)
+
+    The handler receives the claim, None without a key, and must call
+    claim.record_response(db, body) before committing its writes. Errors
+    release the key, so only successful responses are replayed.
+
+    Args:
+        idempotency_key: Value of the Idempotency-Key header, if sent
+        user_id: Authenticated user
+        scope: Endpoint identifier included in the request fingerprint
+        payload: JSON-serializable request data
+        handler: Performs the request and returns a JSON-serializable body
+        status_code: Status code of a successful response
+
+    Returns:
+        The handler's body, or the replayed response of the original request
+    """
+    if not idempotency_key:
+        return handler(None)
+
+    claim = await claim_idempotency_key(
+        idempotency_key, user_id, hash_request(scope, payload), status_code)
+    if isinstance(claim, JSONResponse):
+        return claim
+
+    try:
+        return handler(claim)
+    except BaseException:
+        claim.release()
+        raise
@@ -0,0 +1,382 @@
+"""
+In-memory snapshot of the ingredient catalog.
+
+The catalog is small and read on every recipe create/edit page, so each worker
+keeps an immutable snapshot of it with the list and grouped JSON encoded once.
+Ingredient writes bump the shared "ingredients" cache version in the same
+transaction and reload the local snapshot; other workers notice the new
+version within CATALOG_VERSION_CHECK_SECONDS and reload theirs.
+
+Usage counts change with every recipe write, so they do not go through the
+version, which also keys cached exports and scaled recipes. Each worker reads
+only the ingredient_usage table every USAGE_REFRESH_SECONDS and, when counts
+moved, derives a snapshot of the same version with the new counts. That
+snapshot keeps the count-independent parts of the previous one and re-ranks
+autocomplete at most every AUTOCOMPLETE_RERANK_SECONDS.
+
+The fuzzy-search trigram index is the exception to the rebuild-per-version
+rule: it is built on first use and then patched with only the ingredients that
+changed between two snapshots.
+"""
+import json
+import os
+import time
+from dataclasses import dataclass, replace
+from functools import cached_property
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+
+from db.entries.Ingredient import Ingredient, VALID_CATEGORIES
+from db.entries.IngredientUsage import IngredientUsage
+from services.cache import read_cache_version
+from services.ingredient_index import PrefixIndex, TrigramIndex
+from services.units import UnitConverter
+
+load_dotenv()
+
+INGREDIENT_CATALOG = "ingredients"
+CATALOG_VERSION_CHECK_SECONDS = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "2"))
+USAGE_REFRESH_SECONDS = float(os.getenv("USAGE_REFRESH_SECONDS", "30"))
+AUTOCOMPLETE_RERANK_SECONDS = float(os.getenv("AUTOCOMPLETE_RERANK_SECONDS", "600"))
+
+# ingredient id -> (recipe count, public recipe count)
+UsageCounts = Dict[int, Tuple[int, int]]
+
+# "id" keeps insertion order, "popular" puts the most used ingredients first
+INGREDIENT_SORTS = ("id", "popular")
+
+
+def encode_json(data) -> bytes:
+    """Encode data the same way FastAPI's JSONResponse does"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_bytes_response(body: bytes) -> Response:
+    """Wrap pre-encoded JSON in a response without re-encoding it"""
+    return Response(content=body, media_type="application/json")
+
+
+@dataclass(frozen=True)
+class CatalogIngredient:
+    """Read-only copy of one ingredient row"""
+    id: int
+    name: str
+    unit: str
+    category: str
+    recipe_count: int = 0
+    public_recipe_count: int = 0
+    density: Optional[float] = None
+    piece_weight: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "unit": self.unit,
+            "category": self.category,
+            "recipe_count": self.recipe_count,
+            "public_recipe_count": self.public_recipe_count,
+            "density": self.density,
+            "piece_weight": self.piece_weight
+        }
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the whole catalog at one version.
+
+    Attributes:
+        version: Shared cache version the snapshot was loaded at
+        ingredients: All ingredients ordered by id
+        by_id: Ingredients keyed by id
+        by_category: Ingredients per stored category
+        usage_counts: Number of recipes using each ingredient, for ranking
+        list_json: Encoded list of all ingredients
+        category_json: Encoded list of the ingredients of each category
+        grouped_json: Encoded mapping of every valid category to its ingredients
+
+    Encoded lists and indexes are built on first use.
+    """
+
+    def __init__(self, version: int, ingredients: Iterable[CatalogIngredient]):
+        self.version = version
+        self.ingredients: Tuple[CatalogIngredient, ...] = tuple(ingredients)
+        self.by_id: Dict[int, CatalogIngredient] = {i.id: i for i in self.ingredients}
+        self.usage_counts: Dict[int, int] = {
+            i.id: i.recipe_count for i in self.ingredients if i.recipe_count}
+
+        by_category = {}
+        for ingredient in self.ingredients:
+            by_category.setdefault(ingredient.category, []).append(ingredient)
+        self.by_category: Dict[str, Tuple[CatalogIngredient, ...]] = {
+            category: tuple(items) for category, items in by_category.items()
+        }
+
+    def with_usage(self, usage: UsageCounts) -> "CatalogSnapshot":
+        """
+        Snapshot of the same version with other usage counts, or this one if
+        no count changed
+        """
+        if all(usage.get(i.id, (0, 0)) == (i.recipe_count, i.public_recipe_count)
+               for i in self.ingredients):
+            return self
+
+        snapshot = CatalogSnapshot(self.version, (
+            replace(i, recipe_count=usage.get(i.id, (0, 0))[0],
+                    public_recipe_count=usage.get(i.id, (0, 0))[1])
+            for i in self.ingredients))
+        for name in ("converters", "ids_by_category"):
+            if name in self.__dict__:
+                snapshot.__dict__[name] = self.__dict__[name]
+        autocomplete = self.__dict__.get("autocomplete")
+        if autocomplete is not None and \
+                time.monotonic() - autocomplete.built_at < AUTOCOMPLETE_RERANK_SECONDS:
+            snapshot.__dict__["autocomplete"] = autocomplete.rebind(snapshot.by_id)
+        return snapshot
+
+    @cached_property
+    def list_json(self) -> bytes:
+        return encode_json([i.to_dict() for i in self.ingredients])
+
+    @cached_property
+    def category_json(self) -> Dict[str, bytes]:
+        return {
+            category: encode_json([i.to_dict() for i in items])
+            for category, items in self.by_category.items()
+        }
+
+    @cached_property
+    def grouped_json(self) -> bytes:
+        return self._encode_grouped(self.ingredients)
+
+    @staticmethod
+    def _encode_grouped(ingredients: Iterable[CatalogIngredient]) -> bytes:
+        grouped = {category: [] for category in sorted(VALID_CATEGORIES)}
+        for ingredient in ingredients:
+            category = ingredient.category or "other"
+            grouped[category if category in grouped else "other"].append(
+                ingredient.to_dict())
+        return encode_json(grouped)
+
+    @cached_property
+    def popular(self) -> Tuple[CatalogIngredient, ...]:
+        """All ingredients, most used first"""
+        return tuple(sorted(
+            self.ingredients, key=lambda i: (-i.recipe_count, i.name.casefold(), i.id)))
+
+    @cached_property
+    def popular_by_category(self) -> Dict[str, Tuple[CatalogIngredient, ...]]:
+        """Ingredients per stored category, most used first"""
+        by_category = {}
+        for ingredient in self.popular:
+            by_category.setdefault(ingredient.category, []).append(ingredient)
+        return {category: tuple(items) for category, items in by_category.items()}
+
+    @cached_property
+    def popular_list_json(self) -> bytes:
+        return encode_json([i.to_dict() for i in self.popular])
+
+    @cached_property
+    def popular_category_json(self) -> Dict[str, bytes]:
+        return {
+            category: encode_json([i.to_dict() for i in items])
+            for category, items in self.popular_by_category.items()
+        }
+
+    @cached_property
+    def popular_grouped_json(self) -> bytes:
+        return self._encode_grouped(self.popular)
+
+    def grouped(self, sort: str = "id") -> bytes:
+        """Encoded mapping of every valid category to its ingredients"""
+        return self.popular_grouped_json if sort == "popular" else self.grouped_json
+
+    def page_json(
+        self,
+        skip: int = 0,
+        limit: int = 1000,
+        category: Optional[str] = None,
+        sort: str = "id"
+    ) -> bytes:
+        """
+        Encoded page of the (optionally category filtered) ingredient list
+
+        Full lists are served from the pre-encoded bytes; only real pages are
+        encoded on demand.
+        """
+        popular = sort == "popular"
+        if category:
+            by_category = self.popular_by_category if popular else self.by_category
+            items = by_category.get(category, ())
+            encoded = self.popular_category_json if popular else self.category_json
+            full = encoded.get(category, b"[]")
+        else:
+            items = self.popular if popular else self.ingredients
+            full = self.popular_list_json if popular else self.list_json
+
+        if skip <= 0 and limit >= len(items):
+            return full
+        return encode_json([i.to_dict() for i in items[max(skip, 0):max(skip, 0) + max(limit, 0)]])
+
+    @cached_property
+    def autocomplete(self) -> PrefixIndex:
+        """Prefix index over the snapshot, built on first use"""
+        return PrefixIndex(self.ingredients, self.usage_counts)
+
+    @cached_property
+    def converters(self) -> Dict[int, UnitConverter]:
+        """Unit converter per ingredient id"""
+        return {
+            i.id: UnitConverter(i.unit, i.density, i.piece_weight)
+            for i in self.ingredients
+        }
+
+    @cached_property
+    def ids_by_category(self) -> Dict[str, FrozenSet[int]]:
+        """Ingredient ids per stored category"""
+        return {
+            category: frozenset(i.id for i in items)
+            for category, items in self.by_category.items()
+        }
+
+
+class IngredientCatalog:
+    """
+    Holds the current snapshot, reloads it when the shared version moves and
+    refreshes its usage counts on their own interval
+    """
+
+    def __init__(self, check_interval: float = CATALOG_VERSION_CHECK_SECONDS,
+                 usage_interval: float = USAGE_REFRESH_SECONDS):
+        self.check_interval = check_interval
+        self.usage_interval = usage_interval
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._checked_at = 0.0
+        self._usage_checked_at = 0.0
+        self._lock = Lock()
+        self._trigrams: Optional[TrigramIndex] = None
+        self._trigrams_source: Dict[int, CatalogIngredient] = {}
+
+    def snapshot(self, db: Session) -> CatalogSnapshot:
+        """
+        Return the current snapshot, reloading it if another worker changed the catalog
+
+        Args:
+            db: Database session used for the version check and a reload
+
+        Returns:
+            CatalogSnapshot
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+
+        version = read_cache_version(db, INGREDIENT_CATALOG)
+        self._checked_at = now
+        if snapshot is None or snapshot.version != version:
+            return self.reload(db)
+        if now - self._usage_checked_at >= self.usage_interval:
+            return self.refresh_usage(db)
+        return snapshot
+
+    def refresh_usage(self, db: Session) -> CatalogSnapshot:
+        """Apply the current usage counts to the snapshot without reloading it"""
+        usage = {
+            row.ingredient_id: (row.recipe_count, row.public_recipe_count)
+            for row in db.query(
+                IngredientUsage.ingredient_id,
+                IngredientUsage.recipe_count,
+                IngredientUsage.public_recipe_count
+            )
+        }
+        with self._lock:
+            self._snapshot = self._snapshot.with_usage(usage)
+            self._usage_checked_at = time.monotonic()
+            return self._snapshot
+
+    def reload(self, db: Session) -> CatalogSnapshot:
+        """
+        Load a fresh snapshot from the database
+
+        The version is read before the rows, so a write racing with the load
+        leaves the snapshot marked stale rather than hiding the change.
+        """
+        with self._lock:
+            version = read_cache_version(db, INGREDIENT_CATALOG)
+            if self._snapshot is not None and self._snapshot.version == version \
+                    and time.monotonic() - self._checked_at < self.check_interval:
+                return self._snapshot
+
+            rows = db.query(
+                Ingredient.id,
+                Ingredient.name,
+                Ingredient.unit,
+                Ingredient.category,
+                Ingredient.density,
+                Ingredient.piece_weight,
+                IngredientUsage.recipe_count,
+                IngredientUsage.public_recipe_count
+            ).outerjoin(
+                IngredientUsage, IngredientUsage.ingredient_id == Ingredient.id
+            ).order_by(Ingredient.id).all()
+
+            self._snapshot = CatalogSnapshot(
+                version,
+                (CatalogIngredient(row.id, row.name, row.unit, row.category or "other",
+                                   row.recipe_count or 0, row.public_recipe_count or 0,
+                                   row.density, row.piece_weight)
+                 for row in rows)
+            )
+            self._checked_at = self._usage_checked_at = time.monotonic()
+
+            if self._trigrams is not None:
+                self._trigrams.sync(self._trigrams_source, self._snapshot.by_id)
+                self._trigrams_source = self._snapshot.by_id
+            return self._snapshot
+
+    def fuzzy_search(
+        self,
+        db: Session,
+        query: str,
+        category: Optional[str] = None,
+        limit: int = 10
+    ) -> List[CatalogIngredient]:
+        """
+        Typo-tolerant name search ("chiken" finds "Chicken Breast")
+
+        Args:
+            db: Database session
+            query: Possibly misspelled name
+            category: Filter by category (optional)
+            limit: Maximum number of results
+
+        Returns:
+            Matching ingredients, closest first
+        """
+        snapshot = self.snapshot(db)
+        with self._lock:
+            if self._trigrams is None:
+                trigram_index = TrigramIndex()
+                trigram_index.sync({}, snapshot.by_id)
+                self._trigrams = trigram_index
+                self._trigrams_source = snapshot.by_id
+            trigram_index = self._trigrams
+
+        allowed = snapshot.ids_by_category.get(category, frozenset()) if category else None
+        return [
+            snapshot.by_id[ingredient_id]
+            for ingredient_id, _, _ in trigram_index.search(query, limit, allowed)
+            if ingredient_id in snapshot.by_id
+        ]
+
+    def invalidate(self):
+        """Force the next snapshot() call to check the shared version"""
+        self._checked_at = 0.0
+
+
+ingredient_catalog = IngredientCatalog()
@@ -0,0 +1,239 @@
+"""
+Bulk ingredient import.
+
+Rows are validated in one pass over the payload, collapsed by normalized name
+(the last row for a name wins) and written in chunks. Each chunk costs one
+SELECT for the existing rows, one INSERT ... ON DUPLICATE KEY UPDATE for the
+new and changed ones, one SELECT for the ids of the new ones, and one commit,
+so a large supplier catalog loads in a few hundred round trips instead of
+several per row.
+
+The upsert is a single-row statement executed with a parameter list: it is
+compiled once and cached, and pymysql's executemany rewrites it into
+multi-row INSERTs on the wire. Compiling a fresh 1000-row VALUES clause per
+chunk would cost more than the writes themselves.
+"""
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from db.entries.Ingredient import Ingredient, VALID_CATEGORIES, normalize_name
+from db.entries.TimestampMixin import get_utc_now
+from services.cache import bump_cache_version
+from services.categorizer import ingredient_categorizer
+from services.ingredient_catalog import INGREDIENT_CATALOG
+from services.upsert import upsert_statement
+
+load_dotenv()
+
+BULK_CHUNK_SIZE = int(os.getenv("INGREDIENT_BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_ROWS = int(os.getenv("INGREDIENT_BULK_MAX_ROWS", "100000"))
+NAME_MAX_LENGTH = 255
+UNIT_MAX_LENGTH = 255
+
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+
+
+@dataclass
+class ImportRow:
+    """One row of a bulk import and its outcome"""
+    row: int
+    name: Optional[str] = None
+    normalized_name: Optional[str] = None
+    unit: Optional[str] = None
+    category: Optional[str] = None
+    id: Optional[int] = None
+    status: Optional[str] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        result = {"row": self.row, "id": self.id, "status": self.status}
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+def parse_json_rows(body: bytes) -> List[object]:
+    """
+    Parse a JSON array payload
+
+    Raises:
+        ValueError: If the body is not a JSON array
+    """
+    data = json.loads(body)
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array of ingredients")
+    return data
+
+
+def parse_ndjson_rows(lines: Iterable[bytes]) -> List[object]:
+    """
+    Parse newline delimited JSON; a malformed line becomes a None row that is
+    reported as invalid instead of failing the whole import
+    """
+    rows = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            rows.append(None)
+    return rows
+
+
+def _text_field(item: dict, field: str, max_length: int) -> str:
+    value = item.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{field} is required")
+    value = value.strip()
+    if len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def validate_rows(items: List[object]) -> List[ImportRow]:
+    """
+    Validate raw rows in a single pass
+
+    Categories are checked once per distinct value rather than once per row;
+    rows without one are categorized by name in one batch.
+
+    Returns:
+        ImportRow per input row; invalid rows already carry their status
+    """
+    rows = []
+    for index, item in enumerate(items):
+        row = ImportRow(row=index)
+        rows.append(row)
+        if not isinstance(item, dict):
+            row.status, row.error = INVALID, "Row must be a JSON object"
+            continue
+        try:
+            row.name = _text_field(item, "name", NAME_MAX_LENGTH)
+            row.unit = _text_field(item, "unit", UNIT_MAX_LENGTH)
+        except ValueError as e:
+            row.status, row.error = INVALID, str(e)
+            continue
+        category = item.get("category")
+        if category is not None and not isinstance(category, str):
+            row.status, row.error = INVALID, "category must be a string"
+            continue
+        row.normalized_name = normalize_name(row.name)
+        row.category = category
+
+    uncategorized = [row for row in rows if row.status is None and not row.category]
+    for row, category in zip(uncategorized, ingredient_categorizer.categorize_many(
+            row.name for row in uncategorized)):
+        row.category = category
+
+    invalid_categories = {
+        row.category for row in rows if row.status is None
+    } - VALID_CATEGORIES
+    if invalid_categories:
+        for row in rows:
+            if row.status is None and row.category in invalid_categories:
+                row.status = INVALID
+                row.error = f"Invalid category '{row.category}'"
+    return rows
+
+
+def _upsert_chunk(db: Session, chunk: Dict[str, ImportRow]):
+    """Write one chunk of rows keyed by normalized name and record their ids"""
+    existing = {
+        row.normalized_name: row
+        for row in db.query(
+            Ingredient.id,
+            Ingredient.normalized_name,
+            Ingredient.name,
+            Ingredient.unit,
+            Ingredient.category
+        ).filter(Ingredient.normalized_name.in_(list(chunk)))
+    }
+
+    now = get_utc_now()
+    values = []
+    for normalized, row in chunk.items():
+        current = existing.get(normalized)
+        if current is None:
+            row.status = CREATED
+        elif (current.name, current.unit, current.category) == (row.name, row.unit, row.category):
+            row.status, row.id = UNCHANGED, current.id
+            continue
+        else:
+            row.status, row.id = UPDATED, current.id
+        values.append({
+            "name": row.name,
+            "normalized_name": normalized,
+            "unit": row.unit,
+            "category": row.category,
+            "created_at": now,
+            "updated_at": now,
+        })
+
+    if not values:
+        return
+
+    db.execute(upsert_statement(
+        db.get_bind().dialect.name,
+        Ingredient.__table__,
+        ["normalized_name"],
+        lambda incoming: {
+            "name": incoming.name,
+            "unit": incoming.unit,
+            "category": incoming.category,
+            "updated_at": incoming.updated_at,
+        }
+    ), values)
+    created = [normalized for normalized, row in chunk.items() if row.status == CREATED]
+    if created:
+        for ingredient_id, normalized in db.query(
+            Ingredient.id, Ingredient.normalized_name
+        ).filter(Ingredient.normalized_name.in_(created)):
+            chunk[normalized].id = ingredient_id
+    bump_cache_version(db, INGREDIENT_CATALOG)
+    db.commit()
+
+
+def upsert_ingredients(db: Session, items: List[object], chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """
+    Create or update many ingredients, matched on their normalized name
+
+    Args:
+        db: Database session
+        items: Raw rows with name, unit and optional category
+        chunk_size: Distinct names written per INSERT and transaction
+
+    Returns:
+        Totals per status and the id/status of every input row, in input order
+    """
+    rows = validate_rows(items)
+
+    # The last valid row of a name is written; earlier ones are reported as
+    # duplicates of it
+    latest: Dict[str, ImportRow] = {}
+    for row in rows:
+        if row.status is None:
+            latest[row.normalized_name] = row
+
+    names = list(latest)
+    for start in range(0, len(names), chunk_size):
+        _upsert_chunk(db, {name: latest[name] for name in names[start:start + chunk_size]})
+
+    totals = {status: 0 for status in (CREATED, UPDATED, UNCHANGED, DUPLICATE, INVALID)}
+    for row in rows:
+        if row.status is None:
+            winner = latest[row.normalized_name]
+            row.status, row.id = DUPLICATE, winner.id
+        totals[row.status] += 1
+
+    return {**totals, "results": [row.to_dict() for row in rows]}
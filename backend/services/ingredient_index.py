@@ -0,0 +1,271 @@
+"""
+In-memory search indexes over ingredient names.
+
+PrefixIndex serves autocomplete: every name is indexed under each of its word
+starts ("olive oil" is found by "ol" and by "oi"), as a sorted array searched
+with bisect. Ingredients are ranked once at build time (most used first), so a
+lookup only walks the matching range; prefixes of one or two characters, whose
+ranges are largest, have their ranked matches precomputed. When only usage
+counts change, the index is rebound to the new ingredient objects and keeps
+its ranking.
+
+TrigramIndex serves typo-tolerant search: an inverted index from character
+trigrams to ingredient ids, updated in place as ingredients change.
+"""
+import copy
+import heapq
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from threading import RLock
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from db.entries.Ingredient import normalize_name
+
+SHORT_PREFIX_LENGTH = 2
+WORD = re.compile(r"[^\W_]+")
+
+
+def word_suffixes(normalized: str) -> List[str]:
+    """Suffixes of a normalized name starting at each of its words"""
+    return [normalized[match.start():] for match in WORD.finditer(normalized)]
+
+
+class PrefixIndex:
+    """Immutable autocomplete index built from one catalog snapshot"""
+
+    def __init__(self, ingredients: Iterable, usage_counts: Dict[int, int]):
+        self.built_at = time.monotonic()
+        ingredients = list(ingredients)
+        normalized = {i.id: normalize_name(i.name) for i in ingredients}
+
+        # rank 0 is the best match: most used, then shortest, then alphabetical
+        self._ranked = sorted(ingredients, key=lambda i: (
+            -usage_counts.get(i.id, 0), len(normalized[i.id]), normalized[i.id], i.id))
+        rank_of = {ingredient.id: rank for rank, ingredient in enumerate(self._ranked)}
+
+        entries = sorted(
+            (suffix, rank_of[i.id])
+            for i in ingredients
+            for suffix in word_suffixes(normalized[i.id])
+        )
+        self._keys = [key for key, _ in entries]
+        self._ranks = [rank for _, rank in entries]
+
+        short = {}
+        for key, rank in entries:
+            for length in range(1, SHORT_PREFIX_LENGTH + 1):
+                if len(key) >= length:
+                    short.setdefault(key[:length], set()).add(rank)
+        self._short = {prefix: sorted(ranks) for prefix, ranks in short.items()}
+
+    def rebind(self, by_id: Dict[int, object]) -> "PrefixIndex":
+        """
+        Copy of the index returning the ingredient objects of by_id, for a
+        snapshot that only differs in usage counts; the ranking is kept
+        """
+        rebound = copy.copy(self)
+        rebound._ranked = [by_id.get(i.id, i) for i in self._ranked]
+        return rebound
+
+    def _matching_ranks(self, prefix: str, limit: Optional[int]) -> List[int]:
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            return self._short.get(prefix, [])
+
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + "\U0010ffff", lo)
+        ranks = set(self._ranks[lo:hi])
+        if limit is not None:
+            return heapq.nsmallest(limit, ranks)
+        return sorted(ranks)
+
+    def search(self, query: str, category: Optional[str] = None, limit: int = 10) -> list:
+        """
+        Find ingredients with a word starting with query, best ranked first
+
+        Args:
+            query: Text typed by the user
+            category: Only return ingredients of this category (optional)
+            limit: Maximum number of results
+
+        Returns:
+            List of catalog ingredients
+        """
+        prefix = normalize_name(query)
+        if not prefix or limit <= 0:
+            return []
+
+        results = []
+        for rank in self._matching_ranks(prefix, None if category else limit):
+            ingredient = self._ranked[rank]
+            if category and ingredient.category != category:
+                continue
+            results.append(ingredient)
+            if len(results) >= limit:
+                break
+        return results
+
+
+FUZZY_MIN_SIMILARITY = 0.3
+FUZZY_MAX_CANDIDATES = 200
+# Trigrams shared by more than this share of the catalog barely discriminate
+# and are skipped while collecting candidates
+FUZZY_COMMON_TRIGRAM_SHARE = 0.05
+
+
+def trigrams(normalized: str) -> FrozenSet[str]:
+    """
+    Character trigrams of a normalized name, each word padded like pg_trgm
+    ("oil" -> "  o", " oi", "oil", "il ")
+    """
+    grams = set()
+    for word in WORD.findall(normalized):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between two strings"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        left = i
+        for j, char_b in enumerate(b, 1):
+            diagonal = previous[j - 1] if char_a == char_b else previous[j - 1] + 1
+            up = previous[j] + 1
+            left = left + 1
+            if up < left:
+                left = up
+            if diagonal < left:
+                left = diagonal
+            current.append(left)
+        previous = current
+    return previous[-1]
+
+
+class TrigramIndex:
+    """
+    Mutable trigram inverted index for fuzzy name lookups.
+
+    Candidates are the ids sharing the most trigrams with the query (capped at
+    FUZZY_MAX_CANDIDATES); they are scored by trigram similarity and the
+    survivors re-ranked by edit distance to the name or its closest word.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[int]] = {}
+        self._grams: Dict[int, FrozenSet[str]] = {}
+        self._word_grams: Dict[int, Tuple[FrozenSet[str], ...]] = {}
+        self._names: Dict[int, str] = {}
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._grams)
+
+    def add(self, ingredient_id: int, name: str):
+        """Index a name, replacing the previous one of the same id"""
+        with self._lock:
+            self.remove(ingredient_id)
+            normalized = normalize_name(name)
+            grams = trigrams(normalized)
+            self._grams[ingredient_id] = grams
+            self._word_grams[ingredient_id] = tuple(
+                trigrams(word) for word in WORD.findall(normalized))
+            self._names[ingredient_id] = normalized
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(ingredient_id)
+
+    def remove(self, ingredient_id: int):
+        """Drop an id from the index if present"""
+        with self._lock:
+            grams = self._grams.pop(ingredient_id, None)
+            self._word_grams.pop(ingredient_id, None)
+            self._names.pop(ingredient_id, None)
+            for gram in grams or ():
+                posting = self._postings.get(gram)
+                if posting is not None:
+                    posting.discard(ingredient_id)
+                    if not posting:
+                        del self._postings[gram]
+
+    def sync(self, previous: Dict[int, object], current: Dict[int, object]):
+        """
+        Apply the difference between two catalog versions
+
+        Args:
+            previous: Ingredients by id the index currently reflects
+            current: Ingredients by id of the new catalog version
+        """
+        with self._lock:
+            for ingredient_id in previous.keys() - current.keys():
+                self.remove(ingredient_id)
+            for ingredient_id, ingredient in current.items():
+                old = previous.get(ingredient_id)
+                if old is None or old.name != ingredient.name:
+                    self.add(ingredient_id, ingredient.name)
+
+    def search(self, query: str, limit: int = 10,
+               allowed: Optional[Set[int]] = None) -> List[Tuple[int, float, int]]:
+        """
+        Find ids whose names resemble query
+
+        Args:
+            query: Possibly misspelled name
+            limit: Maximum number of results
+            allowed: Restrict results to these ids (optional)
+
+        Returns:
+            (id, similarity, edit distance) tuples, best match first
+        """
+        normalized = normalize_name(query)
+        query_grams = trigrams(normalized)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            common = max(1000, int(len(self._grams) * FUZZY_COMMON_TRIGRAM_SHARE))
+            postings = sorted(
+                (self._postings[gram] for gram in query_grams if gram in self._postings),
+                key=len
+            )
+            selective = [p for p in postings if len(p) <= common] or postings[:1]
+
+            shared = Counter()
+            for posting in selective:
+                shared.update(posting if allowed is None else posting & allowed)
+
+            similar = []
+            for ingredient_id, _ in shared.most_common(FUZZY_MAX_CANDIDATES):
+                grams = self._grams[ingredient_id]
+                common_grams = len(query_grams & grams)
+                similarity = common_grams / (len(query_grams) + len(grams) - common_grams)
+                if similarity < FUZZY_MIN_SIMILARITY:
+                    # Also accept names where one word is a close match
+                    best_word = max(
+                        (len(query_grams & word_grams) / len(query_grams | word_grams)
+                         for word_grams in self._word_grams[ingredient_id]),
+                        default=0.0
+                    )
+                    if best_word < FUZZY_MIN_SIMILARITY:
+                        continue
+                    similarity = max(similarity, best_word)
+                similar.append((similarity, ingredient_id))
+
+            # Edit distance is the expensive part; only rerank the closest few.
+            # A one-word query is compared with each word of the name, a longer
+            # query with the whole name.
+            scored = []
+            for similarity, ingredient_id in heapq.nlargest(max(limit * 2, 20), similar):
+                name = self._names[ingredient_id]
+                targets = [name] if " " in normalized else WORD.findall(name)
+                distance = min(edit_distance(normalized, target) for target in targets)
+                scored.append((ingredient_id, similarity, distance))
+
+        scored.sort(key=lambda item: (item[2], -item[1], item[0]))
+        return scored[:limit]
@@ -0,0 +1,166 @@
+"""
+Per-ingredient usage counters.
+
+Every live recipe adds one to the recipe_count of each distinct ingredient it
+uses, and one to public_recipe_count as well while it is public. Recipe write
+paths read the contribution of the recipes they touch before the change and
+apply the difference after it, in the same transaction, so one code path
+covers create, copy, edit, visibility changes and deletes.
+
+Counters can still drift (a write outside these paths, two racing edits), so
+a periodic job recomputes them from recipe_ingredients and fixes the rows that
+differ. The in-memory catalog snapshots pick the counters up on their own
+interval (USAGE_REFRESH_SECONDS); the job only bumps the catalog version when
+it corrected something, so every worker sees the corrections at once.
+"""
+import os
+from typing import Dict, Iterable, List, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import case, distinct, func
+from sqlalchemy.orm import Session
+
+from db.base import SessionLocal
+from db.entries.IngredientUsage import IngredientUsage
+from db.entries.Recipe import Recipe
+from db.entries.RecipeIngredient import RecipeIngredient
+from services.cache import bump_cache_version
+from services.ingredient_catalog import INGREDIENT_CATALOG
+from services.upsert import upsert_statement
+
+load_dotenv()
+
+USAGE_RECONCILE_INTERVAL_SECONDS = float(os.getenv("USAGE_RECONCILE_INTERVAL_SECONDS", "600"))
+
+# ingredient id -> (recipe count, public recipe count)
+Usage = Dict[int, Tuple[int, int]]
+
+
+def _usage(db: Session, *criteria) -> Usage:
+    """Count the live recipes matching criteria per ingredient"""
+    return {
+        ingredient_id: (total, public)
+        for ingredient_id, total, public in db.query(
+            RecipeIngredient.ingredient_id,
+            func.count(distinct(RecipeIngredient.recipe_id)),
+            func.count(distinct(case(
+                (Recipe.is_public == True, RecipeIngredient.recipe_id))))
+        ).join(
+            Recipe, RecipeIngredient.recipe_id == Recipe.id
+        ).filter(
+            Recipe.deleted_at.is_(None),
+            *criteria
+        ).group_by(RecipeIngredient.ingredient_id)
+    }
+
+
+def recipe_usage(db: Session, recipe_ids: Iterable[int]) -> Usage:
+    """
+    Contribution of some recipes to the usage counters
+
+    Args:
+        db: Database session; pending changes are flushed first
+        recipe_ids: Recipes to look at; deleted ones contribute nothing
+
+    Returns:
+        Recipe and public recipe count per ingredient
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return {}
+    db.flush()
+    return _usage(db, Recipe.id.in_(recipe_ids))
+
+
+def _write_counts(db: Session, rows: List[dict], increment: bool):
+    """Upsert usage rows, adding to or replacing the stored counts"""
+    if not rows:
+        return
+    table = IngredientUsage.__table__
+
+    def update(incoming):
+        if increment:
+            return {
+                "recipe_count": table.c.recipe_count + incoming.recipe_count,
+                "public_recipe_count": table.c.public_recipe_count + incoming.public_recipe_count,
+            }
+        return {
+            "recipe_count": incoming.recipe_count,
+            "public_recipe_count": incoming.public_recipe_count,
+        }
+
+    # Rows are locked in id order so concurrent writers cannot deadlock
+    rows.sort(key=lambda row: row["ingredient_id"])
+    db.execute(upsert_statement(
+        db.get_bind().dialect.name, table, ["ingredient_id"], update), rows)
+
+
+def apply_usage_change(db: Session, before: Usage, after: Usage):
+    """
+    Add the difference between two contributions to the counters
+
+    Args:
+        db: Database session of the recipe write, committed by the caller
+        before: Contribution of the touched recipes before the write
+        after: Contribution of the same recipes after it
+    """
+    deltas = []
+    for ingredient_id in before.keys() | after.keys():
+        old_total, old_public = before.get(ingredient_id, (0, 0))
+        new_total, new_public = after.get(ingredient_id, (0, 0))
+        if (new_total, new_public) != (old_total, old_public):
+            deltas.append({
+                "ingredient_id": ingredient_id,
+                "recipe_count": new_total - old_total,
+                "public_recipe_count": new_public - old_public,
+            })
+    _write_counts(db, deltas, increment=True)
+
+
+def record_usage_change(db: Session, recipe_ids: Iterable[int], before: Usage):
+    """
+    Update the counters after a write to some recipes
+
+    Args:
+        db: Database session of the recipe write, committed by the caller
+        recipe_ids: Recipes the write touched
+        before: recipe_usage() of those recipes taken before the write
+    """
+    apply_usage_change(db, before, recipe_usage(db, recipe_ids))
+
+
+def reconcile_ingredient_usage() -> int:
+    """
+    Recompute every counter and correct the ones that drifted
+
+    Returns:
+        Number of corrected ingredients
+    """
+    db = SessionLocal()
+    try:
+        actual = _usage(db)
+        stored = {
+            row.ingredient_id: (row.recipe_count, row.public_recipe_count)
+            for row in db.query(IngredientUsage)
+        }
+
+        corrections = []
+        for ingredient_id in actual.keys() | stored.keys():
+            counts = actual.get(ingredient_id, (0, 0))
+            if stored.get(ingredient_id, (0, 0)) != counts:
+                corrections.append({
+                    "ingredient_id": ingredient_id,
+                    "recipe_count": counts[0],
+                    "public_recipe_count": counts[1],
+                })
+        if corrections:
+            _write_counts(db, corrections, increment=False)
+            bump_cache_version(db, INGREDIENT_CATALOG)
+            db.commit()
+            print(f"Corrected usage counts of {len(corrections)} ingredients")
+        return len(corrections)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,190 @@
+"""
+Metrics of the API: HTTP traffic, database use, caches and password hashing.
+
+Requests are measured by an ASGI middleware and labeled with the route
+template ("/recipes/{recipe_id}"), never the raw path, so the number of
+series stays bounded however many ids are requested. The SQL statements a
+request runs are counted through an engine event, attributed to the request
+through a context variable that sync endpoints and dependencies inherit in
+their worker thread.
+
+Pools, caches, the hashing pool and the login throttle keep their own
+numbers; collectors copy them into the registry before every snapshot.
+"""
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from services.cache import LRUCache
+from services.login_throttle import LoginThrottle
+from services.metrics import registry
+from services.password_hashing import PasswordHasher
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "Requests handled", ("method", "route", "status"))
+HTTP_REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte",
+    ("method", "route"), LATENCY_BUCKETS)
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "Requests being handled")
+HTTP_RESPONSE_SIZE = registry.histogram(
+    "http_response_size_bytes", "Size of response bodies",
+    ("method", "route"), SIZE_BUCKETS)
+HTTP_REQUEST_QUERIES = registry.histogram(
+    "http_request_db_queries", "SQL statements run per request",
+    ("method", "route"), QUERY_BUCKETS)
+
+DB_POOL_SIZE = registry.gauge("db_pool_size", "Configured connections of the pool")
+DB_POOL_CHECKED_OUT = registry.gauge("db_pool_checked_out", "Connections in use")
+DB_POOL_CHECKED_IN = registry.gauge("db_pool_checked_in", "Idle connections in the pool")
+DB_POOL_OVERFLOW = registry.gauge("db_pool_overflow", "Connections open beyond the pool size")
+
+CACHE_HITS = registry.counter("cache_hits_total", "Cache lookups that hit", ("cache",))
+CACHE_MISSES = registry.counter("cache_misses_total", "Cache lookups that missed", ("cache",))
+CACHE_ENTRIES = registry.gauge("cache_entries", "Entries held by a cache", ("cache",))
+
+PASSWORD_HASH_QUEUED = registry.gauge(
+    "password_hash_queued", "Password hashes waiting for a hashing thread")
+PASSWORD_HASH_RUNNING = registry.gauge(
+    "password_hash_running", "Password hashes being computed")
+PASSWORD_HASH_COMPLETED = registry.counter(
+    "password_hash_completed_total", "Password hashes and verifications computed")
+PASSWORD_HASH_SECONDS = registry.counter(
+    "password_hash_seconds_total", "Thread time spent computing password hashes")
+PASSWORD_VERIFY_REFUSED = registry.counter(
+    "password_verify_refused_total", "Verifications refused because the pool was saturated")
+
+LOGIN_ATTEMPTS_ALLOWED = registry.counter(
+    "login_attempts_allowed_total", "Login attempts admitted by the throttle")
+LOGIN_ATTEMPTS_REJECTED = registry.counter(
+    "login_attempts_rejected_total", "Login attempts rejected by the throttle", ("reason",))
+
+
+@dataclass
+class RequestContext:
+    """The request being handled and the SQL statements it ran so far"""
+    scope: dict
+    queries: int = 0
+
+
+_current_request: ContextVar[Optional[RequestContext]] = ContextVar("current_request", default=None)
+
+
+def route_template(scope: dict) -> str:
+    """Path template of the route that handled a request"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+def current_route() -> Optional[str]:
+    """Method and route template of the request being handled, if any"""
+    request = _current_request.get()
+    if request is None:
+        return None
+    return f"{request.scope['method']} {route_template(request.scope)}"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording count, latency, size and queries of requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        size = 0
+
+        async def send_measured(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        request = RequestContext(scope)
+        token = _current_request.set(request)
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_measured)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            _current_request.reset(token)
+
+            method, route = scope["method"], route_template(scope)
+            HTTP_REQUESTS.inc(method=method, route=route, status=status_code)
+            HTTP_REQUEST_DURATION.observe(elapsed, method=method, route=route)
+            HTTP_RESPONSE_SIZE.observe(size, method=method, route=route)
+            HTTP_REQUEST_QUERIES.observe(request.queries, method=method, route=route)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    request = _current_request.get()
+    if request is not None:
+        request.queries += 1
+
+
+def instrument_engine(engine: Engine):
+    """Count the statements of every request and report the connection pool"""
+    event.listen(engine, "before_cursor_execute", _count_query)
+
+    def collect():
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            DB_POOL_SIZE.set(pool.size())
+            DB_POOL_CHECKED_OUT.set(pool.checkedout())
+            DB_POOL_CHECKED_IN.set(pool.checkedin())
+            DB_POOL_OVERFLOW.set(max(pool.overflow(), 0))
+
+    registry.add_collector(collect)
+
+
+def instrument_cache(name: str, cache: LRUCache):
+    """Report the hits, misses and size of a cache; hit ratio = hits / (hits + misses)"""
+    def collect():
+        CACHE_HITS.set_total(cache.hits, cache=name)
+        CACHE_MISSES.set_total(cache.misses, cache=name)
+        CACHE_ENTRIES.set(len(cache), cache=name)
+
+    registry.add_collector(collect)
+
+
+def instrument_password_hasher(hasher: PasswordHasher):
+    """Report the load of the password hashing pool"""
+    def collect():
+        stats = hasher.stats()
+        PASSWORD_HASH_QUEUED.set(stats["queued"])
+        PASSWORD_HASH_RUNNING.set(stats["running"])
+        PASSWORD_HASH_COMPLETED.set_total(stats["completed"])
+        PASSWORD_HASH_SECONDS.set_total(stats["hash_seconds_total"])
+        PASSWORD_VERIFY_REFUSED.set_total(stats["refused_verifications"])
+
+    registry.add_collector(collect)
+
+
+def instrument_login_throttle(throttle: LoginThrottle):
+    """Report admitted and rejected login attempts"""
+    def collect():
+        stats = throttle.stats()
+        LOGIN_ATTEMPTS_ALLOWED.set_total(stats["allowed"])
+        for reason, rejected in stats["rejected"].items():
+            LOGIN_ATTEMPTS_REJECTED.set_total(rejected, reason=reason)
+
+    registry.add_collector(collect)
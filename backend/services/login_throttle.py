@@ -0,0 +1,229 @@
+"""
+Login throttling and admission control.
+
+Every login attempt for an existing account costs a full password
+verification, so unlimited attempts let credential stuffing saturate the CPUs.
+Attempts are therefore metered by two token buckets, one per client IP and one
+per account, checked before the password is looked at. A bucket holds up to
+`capacity` attempts and refills continuously at `per_minute`; an attempt that
+finds it empty is answered with 429 and a Retry-After telling when the next
+token arrives.
+
+Buckets live in memory by default, which limits each worker separately. With
+LOGIN_THROTTLE_BACKEND=database they are rows of login_throttle_buckets,
+shared by all workers and updated under a row lock.
+
+Independently of the buckets the hashing pool refuses verifications beyond
+its pending limit (see services.password_hashing); those attempts are also
+answered with 429, and every rejection is counted by reason.
+"""
+import hashlib
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from db.base import SessionLocal
+from db.entries.LoginThrottleBucket import LoginThrottleBucket
+from services.upsert import upsert_statement
+
+load_dotenv()
+
+LOGIN_THROTTLE_BACKEND = os.getenv("LOGIN_THROTTLE_BACKEND", "memory")
+LOGIN_IP_CAPACITY = float(os.getenv("LOGIN_IP_CAPACITY", "20"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "10"))
+LOGIN_ACCOUNT_CAPACITY = float(os.getenv("LOGIN_ACCOUNT_CAPACITY", "5"))
+LOGIN_ACCOUNT_PER_MINUTE = float(os.getenv("LOGIN_ACCOUNT_PER_MINUTE", "2"))
+# Buckets kept by the in-memory backend; the least recently used are dropped
+LOGIN_THROTTLE_MEMORY_KEYS = int(os.getenv("LOGIN_THROTTLE_MEMORY_KEYS", "100000"))
+LOGIN_OVERLOAD_RETRY_AFTER_SECONDS = 1
+LOGIN_THROTTLE_PURGE_INTERVAL_SECONDS = 600
+
+REJECTED_IP = "ip"
+REJECTED_ACCOUNT = "account"
+REJECTED_OVERLOADED = "overloaded"
+
+
+@dataclass(frozen=True)
+class BucketPolicy:
+    """Size and refill rate of a token bucket"""
+    capacity: float
+    per_minute: float
+
+    @property
+    def per_second(self) -> float:
+        return self.per_minute / 60
+
+    @property
+    def full_after_seconds(self) -> float:
+        """Idle time after which any bucket is full again"""
+        return self.capacity / self.per_second
+
+    def take(self, tokens: Optional[float], elapsed: float) -> Tuple[float, float]:
+        """
+        Refill a bucket for elapsed seconds and try to take one token
+
+        Args:
+            tokens: Tokens left at the last take, None for a new bucket
+            elapsed: Seconds since the last take
+
+        Returns:
+            (tokens left, seconds to wait; 0 if the token was taken)
+        """
+        if tokens is None:
+            tokens = self.capacity
+        else:
+            tokens = min(self.capacity, tokens + max(elapsed, 0.0) * self.per_second)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.per_second
+
+
+class MemoryBucketStore:
+    """Token buckets of this worker"""
+
+    def __init__(self, max_keys: int = LOGIN_THROTTLE_MEMORY_KEYS):
+        self.max_keys = max_keys
+        # key -> (tokens, monotonic time of the last take)
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key: str, policy: BucketPolicy) -> float:
+        """Take a token from a bucket; returns the seconds to wait, 0 if taken"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (None, now))
+            tokens, wait = policy.take(tokens, now - last)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def purge(self, older_than_seconds: float) -> int:
+        """Nothing to do; the key limit already bounds memory"""
+        return 0
+
+
+class DatabaseBucketStore:
+    """Token buckets in the login_throttle_buckets table, shared by all workers"""
+
+    def take(self, key: str, policy: BucketPolicy) -> float:
+        """Take a token from a bucket; returns the seconds to wait, 0 if taken"""
+        with SessionLocal() as session:
+            now = time.time()
+            bucket = session.query(LoginThrottleBucket).filter(
+                LoginThrottleBucket.key == key).with_for_update().first()
+            if bucket is None:
+                tokens, wait = policy.take(None, 0.0)
+            else:
+                tokens, wait = policy.take(bucket.tokens, now - bucket.refilled_at)
+
+            # Upsert so two first attempts racing on a new key both succeed
+            session.execute(upsert_statement(
+                session.get_bind().dialect.name,
+                LoginThrottleBucket.__table__,
+                ["key"],
+                lambda incoming: {
+                    "tokens": incoming.tokens,
+                    "refilled_at": incoming.refilled_at,
+                }
+            ), [{"key": key, "tokens": tokens, "refilled_at": now}])
+            session.commit()
+        return wait
+
+    def purge(self, older_than_seconds: float) -> int:
+        """Delete buckets idle long enough to be full again"""
+        with SessionLocal() as session:
+            deleted = session.query(LoginThrottleBucket).filter(
+                LoginThrottleBucket.refilled_at < time.time() - older_than_seconds
+            ).delete()
+            session.commit()
+            return deleted
+
+
+BUCKET_STORES = {
+    "memory": MemoryBucketStore,
+    "database": DatabaseBucketStore,
+}
+
+
+def account_key(email: str) -> str:
+    """Bucket key of an account; emails are hashed so none are stored"""
+    digest = hashlib.sha256(email.strip().casefold().encode()).hexdigest()
+    return f"account:{digest}"
+
+
+class LoginThrottle:
+    """
+    Per-IP and per-account admission of login attempts
+
+    Args:
+        store: Bucket backend
+        ip_policy: Bucket of each client IP
+        account_policy: Bucket of each account (login email)
+    """
+
+    def __init__(self, store, ip_policy: BucketPolicy, account_policy: BucketPolicy):
+        self.store = store
+        self.ip_policy = ip_policy
+        self.account_policy = account_policy
+        self._lock = Lock()
+        self.allowed = 0
+        self.rejected = {REJECTED_IP: 0, REJECTED_ACCOUNT: 0, REJECTED_OVERLOADED: 0}
+
+    def reject(self, reason: str, retry_after: float) -> HTTPException:
+        """Count a rejected attempt and build its 429 response"""
+        with self._lock:
+            self.rejected[reason] += 1
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, please try again later",
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+        )
+
+    def check(self, ip: Optional[str], email: str):
+        """
+        Admit a login attempt or refuse it
+
+        The IP bucket is checked first, so attempts refused for their IP do
+        not drain the account's bucket.
+
+        Raises:
+            HTTPException: 429 with Retry-After if a bucket is empty
+        """
+        wait = self.store.take(f"ip:{ip or 'unknown'}", self.ip_policy)
+        if wait:
+            raise self.reject(REJECTED_IP, wait)
+        wait = self.store.take(account_key(email), self.account_policy)
+        if wait:
+            raise self.reject(REJECTED_ACCOUNT, wait)
+        with self._lock:
+            self.allowed += 1
+
+    def overloaded(self) -> HTTPException:
+        """Count an attempt shed because the hashing pool is saturated"""
+        return self.reject(REJECTED_OVERLOADED, LOGIN_OVERLOAD_RETRY_AFTER_SECONDS)
+
+    def purge_idle_buckets(self) -> int:
+        """Drop buckets that have refilled completely; they equal new ones"""
+        return self.store.purge(max(self.ip_policy.full_after_seconds,
+                                    self.account_policy.full_after_seconds))
+
+    def stats(self) -> dict:
+        """Admitted and rejected attempts since start"""
+        with self._lock:
+            return {"allowed": self.allowed, "rejected": dict(self.rejected)}
+
+
+login_throttle = LoginThrottle(
+    BUCKET_STORES[LOGIN_THROTTLE_BACKEND](),
+    BucketPolicy(LOGIN_IP_CAPACITY, LOGIN_IP_PER_MINUTE),
+    BucketPolicy(LOGIN_ACCOUNT_CAPACITY, LOGIN_ACCOUNT_PER_MINUTE),
+)
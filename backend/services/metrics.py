@@ -0,0 +1,410 @@
+"""
+Prometheus metrics without a client library.
+
+Counters, gauges and histograms are kept in process and rendered in the
+Prometheus text exposition format (version 0.0.4). Values kept elsewhere,
+such as pool sizes or cache hit counts, are copied in by collectors right
+before every snapshot.
+
+Every worker process has its own numbers, while a scrape reaches one
+arbitrary worker. With METRICS_DIR set, every worker writes a snapshot of its
+metrics to METRICS_DIR/worker-<pid>-<start time>.json every
+METRICS_FLUSH_SECONDS, and a scrape merges the snapshots of all workers. The
+process start time tells a worker apart from a later process that got the same
+pid. Gauges are summed over the running workers only. Counters and histograms
+are summed over every worker, including those that exited, so they never go
+backwards when a worker is replaced: a scrape folds the snapshots of exited
+workers into METRICS_DIR/dead-workers.json and deletes them, so the directory
+does not grow with every restart. Without METRICS_DIR a scrape reports the
+worker it reached.
+"""
+import fcntl
+import json
+import math
+import os
+import traceback
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+# Non-positive disables the flush job, as without METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5")) if METRICS_DIR else 0
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEAD_WORKERS_FILE = "dead-workers.json"
+LOCK_FILE = "metrics.lock"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 2.5, 5.0, 7.5, 10.0)
+
+# (label name, label value) pairs of one sample
+Labels = Tuple[Tuple[str, str], ...]
+# (sample name, labels, value)
+Sample = Tuple[str, Labels, float]
+
+
+class Metric:
+    """A metric family with a fixed set of label names"""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Labels:
+        return tuple(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing total"""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, total: float, **labels):
+        """Copy a total that is counted elsewhere"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = total
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value)
+                    for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """Value that goes up and down"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value)
+                    for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """Distribution of observations over cumulative buckets"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (observations per bucket without the +Inf one, sum, count)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, observed in zip(self.buckets, counts):
+                    cumulative += observed
+                    samples.append((f"{self.name}_bucket",
+                                    labels + (("le", _format_value(bound)),), cumulative))
+                samples.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _process_start_time(pid: int) -> Optional[int]:
+    """
+    Start time of a process in clock ticks since boot, None without /proc
+
+    Raises:
+        ProcessLookupError: If there is no such process
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            stat = stat_file.read()
+    except FileNotFoundError:
+        if not os.path.isdir("/proc/self"):
+            return None
+        raise ProcessLookupError(pid)
+    # The command name in parentheses may contain spaces; starttime is the
+    # 22nd field, the 20th after it
+    return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+def _process_running(pid: int, started: Optional[int]) -> bool:
+    """Whether the process that wrote a snapshot is still running"""
+    try:
+        if started is not None:
+            current = _process_start_time(pid)
+            if current is not None:
+                return current == started
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _write_json(path: str, data: dict):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as json_file:
+        json.dump(data, json_file)
+    # Readers only ever see complete files
+    os.replace(temporary, path)
+
+
+def _add_samples(totals: Dict[Tuple[str, str, Labels], float], metrics: dict,
+                 gauges: bool = True):
+    for metric_name, metric in metrics.items():
+        if metric["type"] == "gauge" and not gauges:
+            continue
+        for name, labels, value in metric["samples"]:
+            key = (metric_name, name, tuple(tuple(pair) for pair in labels))
+            totals[key] = totals.get(key, 0) + value
+
+
+def _merge(families: dict, totals: Dict[Tuple[str, str, Labels], float]) -> dict:
+    """Metric families with their samples replaced by the summed totals"""
+    merged = {name: {**metric, "samples": []} for name, metric in families.items()}
+    for (metric_name, name, labels), value in totals.items():
+        merged[metric_name]["samples"].append([name, [list(pair) for pair in labels], value])
+    return merged
+
+
+class MetricsRegistry:
+    """The metrics of this process and the collectors that feed them"""
+
+    def __init__(self, directory: Optional[str] = METRICS_DIR):
+        self.directory = directory
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = Lock()
+        # (pid, start time) of the process the identity was read in; workers
+        # forked after import read their own
+        self._identity: Optional[Tuple[int, Optional[int]]] = None
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a callable that updates metrics before every snapshot"""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        """
+        Current metrics of this process
+
+        Returns:
+            metric name -> {"type", "help", "samples": [[name, labels, value]]}
+        """
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {str(e)}")
+                traceback.print_exc()
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                "type": metric.type,
+                "help": metric.documentation,
+                "samples": [[name, [list(pair) for pair in labels], value]
+                            for name, labels, value in metric.samples()],
+            }
+            for metric in metrics
+        }
+
+    def _worker_identity(self) -> Tuple[int, Optional[int]]:
+        pid = os.getpid()
+        if self._identity is None or self._identity[0] != pid:
+            self._identity = (pid, _process_start_time(pid))
+        return self._identity
+
+    def flush(self):
+        """Write the snapshot of this process for the other workers to merge"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        pid, started = self._worker_identity()
+        path = os.path.join(self.directory, f"worker-{pid}-{started or 0}.json")
+        _write_json(path, {"pid": pid, "started": started, "metrics": self.snapshot()})
+
+    @contextmanager
+    def _directory_lock(self):
+        """Exclusive lock of the directory across the workers"""
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_json(self, name: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.directory, name)) as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return None
+
+    def _worker_snapshots(self) -> Iterable[Tuple[str, dict]]:
+        """(file name, snapshot) of every worker snapshot in the directory"""
+        for entry in os.scandir(self.directory):
+            if not (entry.name.startswith("worker-") and entry.name.endswith(".json")):
+                continue
+            snapshot = self._read_json(entry.name)
+            if snapshot is not None:
+                yield entry.name, snapshot
+
+    def _fold_dead_workers(self, aggregate: dict, dead: List[Tuple[str, dict]]) -> dict:
+        """
+        Add the counters and histograms of exited workers to the dead-workers
+        aggregate and delete their snapshots; called under the directory lock
+
+        The aggregate lists the snapshots it last absorbed, so a snapshot left
+        behind by a scrape that stopped before deleting it is not added twice.
+
+        Returns:
+            The new aggregate
+        """
+        totals: Dict[Tuple[str, str, Labels], float] = {}
+        _add_samples(totals, aggregate["metrics"])
+        families = dict(aggregate["metrics"])
+        folded = []
+        for name, snapshot in dead:
+            if name in aggregate["folded"]:
+                continue
+            _add_samples(totals, snapshot["metrics"], gauges=False)
+            families.update({metric_name: metric
+                             for metric_name, metric in snapshot["metrics"].items()
+                             if metric["type"] != "gauge"})
+            folded.append(name)
+        if folded:
+            aggregate = {"folded": folded, "metrics": _merge(families, totals)}
+            _write_json(os.path.join(self.directory, DEAD_WORKERS_FILE), aggregate)
+        for name, _ in dead:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+        return aggregate
+
+    def collect(self) -> dict:
+        """Metrics of all workers, or of this process without a directory"""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+
+        # Folding moves totals between files; the lock keeps other scrapes
+        # from seeing them in neither or in both
+        with self._directory_lock():
+            aggregate = self._read_json(DEAD_WORKERS_FILE) or {"folded": [], "metrics": {}}
+            running, dead = [], []
+            for name, snapshot in self._worker_snapshots():
+                if _process_running(snapshot["pid"], snapshot.get("started")):
+                    running.append(snapshot["metrics"])
+                else:
+                    dead.append((name, snapshot))
+            if dead:
+                aggregate = self._fold_dead_workers(aggregate, dead)
+
+        families: dict = {}
+        totals: Dict[Tuple[str, str, Labels], float] = {}
+        for metrics in [aggregate["metrics"]] + running:
+            families.update({name: metric for name, metric in metrics.items()
+                             if name not in families})
+            _add_samples(totals, metrics)
+        return _merge(families, totals)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric_name, metric in sorted(self.collect().items()):
+            lines.append(f"# HELP {metric_name} {_escape(metric['help'])}")
+            lines.append(f"# TYPE {metric_name} {metric['type']}")
+            for name, labels, value in metric["samples"]:
+                if labels:
+                    label_text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels)
+                    lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
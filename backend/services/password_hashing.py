@@ -0,0 +1,186 @@
+"""
+Password hashing off the event loop.
+
+A bcrypt hash or verify costs 100-300 ms of CPU. Run inline in an async
+endpoint it stalls every other request of the worker, and run in FastAPI's
+shared thread pool a login burst can occupy all of its threads. Hashing
+therefore goes through a dedicated, small thread pool (bcrypt releases the GIL
+while it works): at most PASSWORD_HASH_WORKERS hashes run at once, the rest
+wait in the pool's queue, and the time they wait is recorded. Verifications
+beyond PASSWORD_VERIFY_MAX_PENDING waiting or running are refused outright, so
+a login flood is shed instead of queueing unbounded CPU work.
+
+The hashing policy (schemes and cost) is configurable. When it changes, stored
+hashes that no longer match it are replaced at the next successful login,
+while the plain password is at hand.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+from services.metrics import registry
+
+load_dotenv()
+
+# The first scheme hashes new passwords; the others are only verified and
+# trigger a rehash on login
+PASSWORD_SCHEMES = [scheme.strip() for scheme in
+                    os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",") if scheme.strip()]
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv(
+    "PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+PASSWORD_VERIFY_MAX_PENDING = int(os.getenv(
+    "PASSWORD_VERIFY_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+
+PASSWORD_HASH_QUEUE_SECONDS = registry.histogram(
+    "password_hash_queue_seconds",
+    "Time password hashes and verifications waited for a hashing thread",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+pwd_context = CryptContext(
+    schemes=PASSWORD_SCHEMES,
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password verifications are already waiting or running"""
+
+
+class PasswordHasher:
+    """
+    Bounded pool running password hashes and verifications
+
+    Args:
+        context: Passlib context defining the hashing policy
+        workers: Maximum number of hashes computed at the same time
+        max_pending_verifications: Verifications allowed to wait or run at
+            once before new ones are refused
+    """
+
+    def __init__(self, context: CryptContext, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending_verifications: int = PASSWORD_VERIFY_MAX_PENDING):
+        self.context = context
+        self.workers = workers
+        self.max_pending_verifications = max_pending_verifications
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.pending_verifications = 0
+        self.refused_verifications = 0
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+
+    def _submit(self, func: Callable, *args) -> Future:
+        """Queue func on the pool, recording queue and run time"""
+        enqueued = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+
+        def run():
+            started = time.perf_counter()
+            waited = started - enqueued
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.queue_seconds_total += waited
+                self.queue_seconds_max = max(self.queue_seconds_max, waited)
+            PASSWORD_HASH_QUEUE_SECONDS.observe(waited)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.hash_seconds_total += time.perf_counter() - started
+
+        return self._executor.submit(run)
+
+    def _submit_verify(self, password: str, hashed: str) -> Future:
+        """Queue a verification unless too many are pending"""
+        with self._lock:
+            if self.pending_verifications >= self.max_pending_verifications:
+                self.refused_verifications += 1
+                raise PasswordHasherBusy()
+            self.pending_verifications += 1
+        future = self._submit(self.context.verify_and_update, password, hashed)
+        future.add_done_callback(self._verification_done)
+        return future
+
+    def _verification_done(self, future: Future):
+        with self._lock:
+            self.pending_verifications -= 1
+
+    def hash(self, password: str) -> str:
+        """Hash a password, blocking the calling thread until done"""
+        return self._submit(self.context.hash, password).result()
+
+    async def hash_async(self, password: str) -> str:
+        """Hash a password without blocking the event loop"""
+        return await asyncio.wrap_future(self._submit(self.context.hash, password))
+
+    async def hash_many_async(self, passwords: Sequence[str],
+                              concurrency: Optional[int] = None) -> List[str]:
+        """
+        Hash several passwords in parallel without blocking the event loop
+
+        At most `concurrency` of them (half the workers by default) are
+        queued at a time, so a large batch never puts more than that many
+        hashes ahead of a login.
+
+        Returns:
+            Hashes in the order of passwords
+        """
+        limit = asyncio.Semaphore(concurrency or max(1, self.workers // 2))
+
+        async def hash_one(password: str) -> str:
+            async with limit:
+                return await self.hash_async(password)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password, blocking the calling thread until done
+
+        Returns:
+            (whether it matches, replacement hash if the stored one is outdated)
+
+        Raises:
+            PasswordHasherBusy: If too many verifications are pending
+        """
+        return self._submit_verify(password, hashed).result()
+
+    async def verify_async(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Check a password without blocking the event loop, see verify"""
+        return await asyncio.wrap_future(self._submit_verify(password, hashed))
+
+    def stats(self) -> dict:
+        """Current load and cumulative timings of the pool"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "pending_verifications": self.pending_verifications,
+                "refused_verifications": self.refused_verifications,
+                "queue_seconds_total": self.queue_seconds_total,
+                "queue_seconds_max": self.queue_seconds_max,
+                "hash_seconds_total": self.hash_seconds_total,
+            }
+
+
+password_hasher = PasswordHasher(pwd_context)
@@ -0,0 +1,112 @@
+"""
+Caller identity taken from verified token claims.
+
+Access tokens carry the user's id (uid) and token version (ver) next to the
+username. A route that only needs to know who is calling, e.g. to compare
+against a recipe's owner, can trust those claims once the signature checks
+out, without loading the user.
+
+What the signature cannot tell is whether the token was revoked after it was
+issued. Revoking all tokens of a user bumps users.token_version, and deleting
+an account revokes them as well. Only a bump or deletion younger than the
+access token lifetime can still concern a live token, so every worker keeps
+just those in memory (found through users.token_version_changed_at and
+users.deleted_at, both indexed) and reloads them periodically. Changes made by
+this worker apply immediately, those of other workers within
+TOKEN_VERSION_REFRESH_SECONDS. The purger keeps a deleted account's tombstone
+until the last access token issued to it has expired, so a worker that starts
+or reloads late still finds it.
+"""
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import or_
+
+from db.base import SessionLocal
+from db.entries.User import User
+
+load_dotenv()
+
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_VERSION_REFRESH_SECONDS = float(os.getenv("TOKEN_VERSION_REFRESH_SECONDS", "30"))
+# Accounts seen deleted stay revoked here even after the purge, for longer
+# than any access token lives
+REVOCATION_RETENTION_SECONDS = 3600
+# Bumps and deletions loaded by the workers; the margin covers clock skew
+# between the servers
+TOKEN_REVOCATION_WINDOW = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES + 5)
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated caller as stated by a verified access token"""
+    id: int
+    username: str
+    token_version: int = 0
+
+
+class TokenVersionTable:
+    """In-memory token versions and revoked accounts"""
+
+    def __init__(self, retention_seconds: float = REVOCATION_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self.loaded_at: Optional[float] = None
+        # user id -> current token version, only for recently bumped versions
+        self._versions: Dict[int, int] = {}
+        # user id -> monotonic time the account was first seen deleted
+        self._revoked: Dict[int, float] = {}
+        self._lock = Lock()
+
+    def reload(self) -> int:
+        """
+        Replace the table with the users whose token version changed or who
+        were deleted within TOKEN_REVOCATION_WINDOW
+
+        Returns:
+            Number of users with a version or revocation entry
+        """
+        cutoff = datetime.utcnow() - TOKEN_REVOCATION_WINDOW
+        with SessionLocal() as session:
+            rows = session.query(User.id, User.token_version, User.deleted_at).filter(
+                or_(User.token_version_changed_at >= cutoff, User.deleted_at >= cutoff)
+            ).all()
+
+        now = time.monotonic()
+        versions = {row.id: row.token_version for row in rows if row.token_version}
+        with self._lock:
+            revoked = {
+                user_id: seen for user_id, seen in self._revoked.items()
+                if now - seen < self.retention_seconds
+            }
+            for row in rows:
+                if row.deleted_at is not None:
+                    revoked.setdefault(row.id, now)
+            self._versions, self._revoked = versions, revoked
+            self.loaded_at = now
+        return len(versions.keys() | revoked.keys())
+
+    def is_current(self, user_id: int, token_version: int) -> bool:
+        """Whether a token of this user and version is still valid"""
+        if self.loaded_at is None:
+            self.reload()
+        if user_id in self._revoked:
+            return False
+        return token_version >= self._versions.get(user_id, 0)
+
+    def record_version(self, user_id: int, token_version: int):
+        """Apply a version bump made by this worker right away"""
+        with self._lock:
+            self._versions[user_id] = max(token_version, self._versions.get(user_id, 0))
+
+    def record_revoked(self, user_id: int):
+        """Apply an account deletion made by this worker right away"""
+        with self._lock:
+            self._revoked.setdefault(user_id, time.monotonic())
+
+
+token_versions = TokenVersionTable()
@@ -0,0 +1,232 @@
+"""
+On-demand request profiling.
+
+A request is profiled when it carries X-Profile: 1 together with a valid
+X-Admin-Token, or at random with probability PROFILE_SAMPLE_RATE. The
+response then carries the profile id in X-Profile-Id, and the profile is
+written to PROFILE_DIR as <id>.speedscope.json (open it at speedscope.app).
+Only the newest PROFILE_MAX_FILES profiles are kept.
+
+Most endpoints are plain functions that FastAPI runs in its thread pool, and
+password hashing runs on its own pool, so a deterministic profiler enabled in
+the middleware would only see the event loop thread. Instead a sampler thread
+records the stacks of every thread of the worker each PROFILE_INTERVAL_MS,
+keeping the threads that are running application code. The samples are
+wall-clock time, so waiting on the database shows up as time in the driver.
+Requests running at the same time on the worker are sampled too, which is
+why only one request per worker is profiled at a time.
+"""
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+load_dotenv()
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/recipe-app-profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+PROFILE_REQUEST_HEADER = b"x-profile"
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+PROFILE_ID_HEADER = b"x-profile-id"
+PROFILE_SUFFIX = ".speedscope.json"
+PROFILE_ID = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$")
+
+# Frames under this directory are application code
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (function, file, first line)
+Frame = Tuple[str, str, int]
+
+
+def new_profile_id() -> str:
+    return f"{datetime.utcnow():%Y%m%dT%H%M%S}-{secrets.token_hex(4)}"
+
+
+def profile_path(profile_id: str) -> Optional[str]:
+    """File of a profile id, None if the id is malformed"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    return os.path.join(PROFILE_DIR, profile_id + PROFILE_SUFFIX)
+
+
+class StackSampler:
+    """
+    Thread recording the stacks of the other threads at a fixed interval
+
+    Args:
+        interval_seconds: Time between two samples
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.frames: List[Frame] = []
+        self._frame_ids: Dict[Frame, int] = {}
+        # thread id -> (thread name, [(seconds since start, frame ids outermost first)])
+        self.samples: Dict[int, Tuple[str, List[Tuple[float, List[int]]]]] = {}
+        self.started = 0.0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[Thread] = None
+
+    def _frame_id(self, frame: Frame) -> int:
+        frame_id = self._frame_ids.get(frame)
+        if frame_id is None:
+            frame_id = self._frame_ids[frame] = len(self.frames)
+            self.frames.append(frame)
+        return frame_id
+
+    def _sample(self):
+        now = time.perf_counter() - self.started
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self._thread.ident:
+                continue
+            stack = []
+            in_app = False
+            while frame is not None:
+                code = frame.f_code
+                in_app = in_app or code.co_filename.startswith(APP_ROOT)
+                stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            # Idle threads, such as the thread pool waiting for work
+            if not in_app:
+                continue
+            name = names.get(thread_id, str(thread_id))
+            self.samples.setdefault(thread_id, (name, []))[1].append(
+                (now, [self._frame_id(entry) for entry in reversed(stack)]))
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self._sample()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def to_speedscope(self, name: str) -> dict:
+        """The samples in the speedscope file format, one profile per thread"""
+        profiles = []
+        for thread_name, samples in self.samples.values():
+            # Each sample weighs the time since the previous one
+            weights, previous = [], 0.0
+            for at, _ in samples:
+                weights.append(at - previous)
+                previous = at
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.elapsed,
+                "samples": [stack for _, stack in samples],
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "recipe-app",
+            "activeProfileIndex": 0,
+            "shared": {"frames": [
+                {"name": function, "file": os.path.relpath(file, APP_ROOT)
+                 if file.startswith(APP_ROOT) else file, "line": line}
+                for function, file, line in self.frames
+            ]},
+            "profiles": profiles,
+        }
+
+
+def write_profile(profile_id: str, profile: dict, max_files: int = PROFILE_MAX_FILES):
+    """Store a profile and delete the oldest ones beyond max_files"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(profile_path(profile_id), "w") as profile_file:
+        json.dump(profile, profile_file)
+
+    stored = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(PROFILE_SUFFIX)),
+        key=lambda entry: entry.name)
+    for entry in stored[:max(len(stored) - max_files, 0)]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requested or sampled requests
+
+    Args:
+        app: Wrapped application
+        is_admin_token: Tells whether an X-Admin-Token value is valid
+        sample_rate: Share of all requests that are profiled
+        interval_ms: Time between two stack samples
+    """
+
+    def __init__(self, app, is_admin_token: Callable[[Optional[str]], bool],
+                 sample_rate: float = PROFILE_SAMPLE_RATE,
+                 interval_ms: float = PROFILE_INTERVAL_MS):
+        self.app = app
+        self.is_admin_token = is_admin_token
+        self.sample_rate = sample_rate
+        self.interval_seconds = interval_ms / 1000
+        self._busy = Lock()
+
+    def _wants_profile(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_REQUEST_HEADER) == b"1":
+            token = headers.get(ADMIN_TOKEN_HEADER)
+            return token is not None and self.is_admin_token(token.decode("latin-1"))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        # Another request is being profiled on this worker
+        if not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = new_profile_id()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER, profile_id.encode())]
+            await send(message)
+
+        sampler = StackSampler(self.interval_seconds)
+        try:
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                sampler.stop()
+                name = f"{scope['method']} {scope['path']}"
+                try:
+                    await run_in_threadpool(write_profile, profile_id, sampler.to_speedscope(name))
+                except Exception as e:
+                    print(f"Could not store profile {profile_id}: {str(e)}")
+                    traceback.print_exc()
+        finally:
+            self._busy.release()
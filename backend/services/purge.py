@@ -0,0 +1,120 @@
+"""
+Background purge of tombstoned recipes and users.
+
+Deleting a recipe or an account only sets deleted_at. The purger then removes
+the rows in small batches, children first, one short transaction per batch and
+with a pause in between, so large deletions never hold locks for long or flood
+replication.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from db.base import SessionLocal
+from db.entries.Recipe import Recipe
+from db.entries.RecipeIngredient import RecipeIngredient
+from db.entries.Step import Step
+from db.entries.User import User
+from services.principals import ACCESS_TOKEN_EXPIRE_MINUTES
+
+load_dotenv()
+
+PURGE_INTERVAL_SECONDS = float(os.getenv("PURGE_INTERVAL_SECONDS", "60"))
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "50"))
+PURGE_BATCH_PAUSE_SECONDS = float(os.getenv("PURGE_BATCH_PAUSE_SECONDS", "0.2"))
+PURGE_MAX_BATCHES_PER_RUN = int(os.getenv("PURGE_MAX_BATCHES_PER_RUN", "100"))
+# Tombstones younger than this are kept, e.g. to allow undo
+PURGE_GRACE_PERIOD = timedelta(seconds=int(os.getenv("PURGE_GRACE_SECONDS", "0")))
+# A user tombstone is what revokes the account's access tokens (see
+# services.principals), so it outlives the last token issued before deletion
+USER_PURGE_GRACE_PERIOD = max(PURGE_GRACE_PERIOD, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+
+def purge_recipe_batch(batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """
+    Physically delete one batch of tombstoned recipes with their children
+
+    Args:
+        batch_size: Maximum number of recipes to remove
+
+    Returns:
+        Number of recipes removed
+    """
+    cutoff = datetime.utcnow() - PURGE_GRACE_PERIOD
+    with SessionLocal() as session:
+        recipe_ids = [rid for (rid,) in session.query(Recipe.id).filter(
+            Recipe.deleted_at.isnot(None),
+            Recipe.deleted_at <= cutoff
+        ).order_by(Recipe.id).limit(batch_size).all()]
+
+        if not recipe_ids:
+            return 0
+
+        session.query(RecipeIngredient).filter(
+            RecipeIngredient.recipe_id.in_(recipe_ids)
+        ).delete(synchronize_session=False)
+        session.query(Step).filter(
+            Step.recipe_id.in_(recipe_ids)
+        ).delete(synchronize_session=False)
+        session.query(Recipe).filter(
+            Recipe.id.in_(recipe_ids)
+        ).delete(synchronize_session=False)
+        session.commit()
+        return len(recipe_ids)
+
+
+def purge_user_batch(batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """
+    Physically delete tombstoned users whose recipes are already purged
+
+    Args:
+        batch_size: Maximum number of users to remove
+
+    Returns:
+        Number of users removed
+    """
+    cutoff = datetime.utcnow() - USER_PURGE_GRACE_PERIOD
+    with SessionLocal() as session:
+        user_ids = [uid for (uid,) in session.query(User.id).filter(
+            User.deleted_at.isnot(None),
+            User.deleted_at <= cutoff,
+            ~session.query(Recipe.id).filter(Recipe.user_id == User.id).exists()
+        ).order_by(User.id).limit(batch_size).all()]
+
+        if not user_ids:
+            return 0
+
+        session.query(User).filter(
+            User.id.in_(user_ids)
+        ).delete(synchronize_session=False)
+        session.commit()
+        return len(user_ids)
+
+
+def purge_deleted_records(
+    batch_size: int = PURGE_BATCH_SIZE,
+    pause_seconds: float = PURGE_BATCH_PAUSE_SECONDS,
+    max_batches: int = PURGE_MAX_BATCHES_PER_RUN
+) -> dict:
+    """
+    Purge tombstoned recipes, then tombstoned users, batch by batch
+
+    Args:
+        batch_size: Rows per batch
+        pause_seconds: Pause between batches to rate-limit the purge
+        max_batches: Upper bound on batches in one run; the rest waits for the next run
+
+    Returns:
+        Number of purged recipes and users
+    """
+    purged = {"recipes": 0, "users": 0}
+    for kind, purge_batch in (("recipes", purge_recipe_batch), ("users", purge_user_batch)):
+        for _ in range(max_batches):
+            removed = purge_batch(batch_size)
+            purged[kind] += removed
+            if removed < batch_size:
+                break
+            time.sleep(pause_seconds)
+    return purged
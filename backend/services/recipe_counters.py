@@ -0,0 +1,45 @@
+"""
+Denormalized counters derived from recipes, updated together.
+
+Recipe write paths take a snapshot of the recipes they are about to change and
+record the change afterwards, in the same transaction; every counter set
+(ingredient usage, per-user statistics) then applies its own difference.
+"""
+from typing import Iterable, Tuple
+
+from sqlalchemy.orm import Session
+
+from services.ingredient_usage import Usage, apply_usage_change, recipe_usage
+from services.user_stats import Stats, apply_stats_change, recipe_stats
+
+# Contribution of some recipes to every counter set
+Counters = Tuple[Usage, Stats]
+
+NO_COUNTERS: Counters = ({}, {})
+
+
+def recipe_counters(db: Session, recipe_ids: Iterable[int]) -> Counters:
+    """
+    Snapshot the contribution of some recipes, before writing to them
+
+    Args:
+        db: Database session; pending changes are flushed first
+        recipe_ids: Recipes about to be written
+    """
+    recipe_ids = list(recipe_ids)
+    return recipe_usage(db, recipe_ids), recipe_stats(db, recipe_ids)
+
+
+def record_counter_change(db: Session, recipe_ids: Iterable[int], before: Counters):
+    """
+    Update all counters after a write to some recipes
+
+    Args:
+        db: Database session of the recipe write, committed by the caller
+        recipe_ids: Recipes the write touched
+        before: recipe_counters() of those recipes taken before the write,
+            NO_COUNTERS for new recipes
+    """
+    after = recipe_counters(db, recipe_ids)
+    apply_usage_change(db, before[0], after[0])
+    apply_stats_change(db, before[1], after[1])
@@ -0,0 +1,258 @@
+"""
+Recipe export rendering shared by the download endpoints.
+
+Exports are rendered once per (recipe, version, catalog version, format,
+exporter) and the encoded bytes are kept in an LRU cache, so repeated downloads
+skip the step and ingredient queries and the JSON encoding entirely.
+"""
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+
+from db.entries.Recipe import Recipe
+from db.entries.Step import Step
+from db.entries.RecipeIngredient import RecipeIngredient
+from db.entries.Ingredient import Ingredient
+from services.cache import LRUCache
+
+load_dotenv()
+
+EXPORT_FORMAT_VERSION = "1.0"
+EXPORT_SOURCE = "DreamFoodX Recipe App"
+EXPORT_CACHE_SIZE = int(os.getenv("RECIPE_EXPORT_CACHE_SIZE", "256"))
+
+# format name -> (media type, file extension)
+EXPORT_FORMATS = {
+    "json": ("application/json", "json"),
+    "compact": ("application/json", "json"),
+    "markdown": ("text/markdown; charset=utf-8", "md"),
+}
+
+export_cache = LRUCache(maxsize=EXPORT_CACHE_SIZE)
+
+
+@dataclass(frozen=True)
+class RenderedExport:
+    """Encoded recipe export ready to be sent as a download"""
+    body: bytes
+    media_type: str
+    filename: str
+    etag: str
+
+    def to_response(self) -> Response:
+        """
+        Build a download response around the cached body.
+
+        The bytes object is handed to the response as-is, so a cache hit does
+        no copying or re-encoding; Content-Length is derived from its size.
+        """
+        return Response(
+            content=self.body,
+            media_type=self.media_type,
+            headers={
+                "Content-Disposition": f"attachment; filename={self.filename}",
+                "Cache-Control": "no-cache",
+                "ETag": self.etag,
+            }
+        )
+
+
+def validate_export_format(export_format: str) -> str:
+    """Validate the requested export format"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid format. Must be one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    return export_format
+
+
+def export_etag(
+    recipe: Recipe,
+    export_format: str,
+    exported_by: Optional[str] = None,
+    catalog_version: int = 0
+) -> str:
+    """
+    Compute the ETag of a recipe export without rendering it
+
+    The tag is weak because the body carries an export timestamp; two renders of
+    the same recipe revision are equivalent but not byte-identical.
+    """
+    # The version is bumped by every update of the recipe row, while
+    # updated_at may keep its value across two updates within one second
+    key = (f"{EXPORT_FORMAT_VERSION}:{recipe.id}:{recipe.version}:{catalog_version}:"
+           f"{export_format}:{exported_by or ''}")
+    return f'W/"{hashlib.sha1(key.encode("utf-8")).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag using weak comparison
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in if_none_match.split(",")
+    )
+
+
+def export_filename(recipe: Recipe, extension: str) -> str:
+    """Build a filesystem-safe download filename for a recipe"""
+    safe_title = "".join(
+        c for c in recipe.title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    safe_title = safe_title.replace(' ', '_')
+    return f"dreamfoodx_recipe_{safe_title}_{recipe.id}.{extension}"
+
+
+def build_export_data(recipe: Recipe, db: Session, exported_by: Optional[str] = None) -> dict:
+    """
+    Load steps and ingredients of a recipe and assemble the export document
+    """
+    steps = db.query(Step).filter(
+        Step.recipe_id == recipe.id
+    ).order_by(Step.order_number).all()
+
+    recipe_ingredients = db.query(
+        RecipeIngredient.quantity,
+        RecipeIngredient.step_id,
+        Ingredient.id,
+        Ingredient.name,
+        Ingredient.unit
+    ).join(
+        Ingredient, RecipeIngredient.ingredient_id == Ingredient.id
+    ).filter(
+        RecipeIngredient.recipe_id == recipe.id
+    ).all()
+
+    export_info = {"exported_at": datetime.utcnow().isoformat()}
+    if exported_by is not None:
+        export_info["exported_by"] = exported_by
+    export_info["format_version"] = EXPORT_FORMAT_VERSION
+    export_info["source"] = EXPORT_SOURCE
+
+    return {
+        "recipe": {
+            "id": recipe.id,
+            "title": recipe.title,
+            "description": recipe.description,
+            "is_public": recipe.is_public,
+            "preparation_time": recipe.preparation_time,
+            "cooking_time": recipe.cooking_time,
+            "servings": recipe.servings,
+            "created_at": recipe.created_at.isoformat() if recipe.created_at else None,
+            "updated_at": recipe.updated_at.isoformat() if recipe.updated_at else None
+        },
+        "steps": [
+            {
+                "order_number": step.order_number,
+                "action_type": step.action_type,
+                "temperature": step.temperature,
+                "speed": step.speed,
+                "duration": step.duration,
+                "description": step.description
+            }
+            for step in steps
+        ],
+        "ingredients": [
+            {
+                "name": ingredient.name,
+                "quantity": ingredient.quantity,
+                "unit": ingredient.unit,
+                "step_id": ingredient.step_id
+            }
+            for ingredient in recipe_ingredients
+        ],
+        "export_info": export_info
+    }
+
+
+def render_markdown(data: dict) -> str:
+    """Render an export document as Markdown"""
+    recipe = data["recipe"]
+    lines = [f"# {recipe['title']}", ""]
+    if recipe["description"]:
+        lines += [recipe["description"], ""]
+    lines += [
+        f"- Preparation time: {recipe['preparation_time']} min",
+        f"- Cooking time: {recipe['cooking_time']} min",
+        f"- Servings: {recipe['servings']}",
+        "",
+        "## Ingredients",
+        "",
+    ]
+    lines += [
+        f"- {ingredient['quantity']:g} {ingredient['unit']} {ingredient['name']}"
+        for ingredient in data["ingredients"]
+    ]
+    lines += ["", "## Steps", ""]
+    for step in data["steps"]:
+        details = [step["action_type"], f"{step['duration']} min"]
+        if step["temperature"]:
+            details.append(f"{step['temperature']}°C")
+        if step["speed"]:
+            details.append(f"speed {step['speed']}")
+        lines.append(
+            f"{step['order_number']}. {step['description'] or ''} ({', '.join(details)})")
+
+    info = data["export_info"]
+    lines += ["", f"_Exported from {info['source']} at {info['exported_at']}_", ""]
+    return "\n".join(lines)
+
+
+def encode_export(data: dict, export_format: str) -> bytes:
+    """Encode an export document in the requested format"""
+    if export_format == "markdown":
+        return render_markdown(data).encode("utf-8")
+    if export_format == "compact":
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def render_recipe_export(
+    recipe: Recipe,
+    db: Session,
+    export_format: str = "json",
+    exported_by: Optional[str] = None,
+    catalog_version: int = 0
+) -> RenderedExport:
+    """
+    Return the encoded export of a recipe, rendering it on a cache miss
+
+    Args:
+        recipe: Recipe to export (access must already be checked)
+        db: Database session
+        export_format: One of EXPORT_FORMATS
+        exported_by: Username recorded in export_info, if any
+        catalog_version: Ingredient catalog version the export reflects
+
+    Returns:
+        RenderedExport with body, media type, filename and ETag
+    """
+    etag = export_etag(recipe, export_format, exported_by, catalog_version)
+    cached = export_cache.get(etag)
+    if cached is not None:
+        return cached
+
+    media_type, extension = EXPORT_FORMATS[export_format]
+    data = build_export_data(recipe, db, exported_by)
+    rendered = RenderedExport(
+        body=encode_export(data, export_format),
+        media_type=media_type,
+        filename=export_filename(recipe, extension),
+        etag=etag
+    )
+    export_cache.set(etag, rendered)
+    return rendered
@@ -0,0 +1,151 @@
+"""
+Recipe scaling to a different number of servings.
+
+A scaled recipe is computed once per (recipe, version, catalog version,
+servings, step scaling) and kept in an LRU cache; any edit of the recipe
+bumps its version and any ingredient change bumps the catalog version, so
+stale entries are simply never asked for again and age out.
+
+Several servings values of one recipe share a single load of its steps and
+ingredients: the queries run only if at least one of them misses the cache.
+"""
+import os
+from typing import Dict, List, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from db.entries.Ingredient import Ingredient
+from db.entries.Recipe import Recipe
+from db.entries.RecipeIngredient import RecipeIngredient
+from db.entries.Step import Step
+from services.cache import LRUCache
+from services.units import round_quantity
+
+load_dotenv()
+
+SCALE_CACHE_SIZE = int(os.getenv("RECIPE_SCALE_CACHE_SIZE", "512"))
+SCALE_MAX_SERVINGS = 1000
+SCALE_BATCH_MAX = 20
+
+# Cooking times grow slower than the amount of food: twice the quantity takes
+# about 2 ** (2 / 3) = 1.6 times as long to chop, mix or heat through
+STEP_DURATION_EXPONENT = float(os.getenv("STEP_DURATION_EXPONENT", str(2 / 3)))
+
+scale_cache = LRUCache(maxsize=SCALE_CACHE_SIZE)
+
+
+def scale_cache_key(recipe: Recipe, catalog_version: int, servings: int,
+                    scale_steps: bool) -> Tuple:
+    """Identity of one scaled version of a recipe"""
+    # updated_at may keep its value across two edits within one second
+    return (recipe.id, recipe.version, catalog_version, servings, scale_steps)
+
+
+def scale_duration(duration: int, scale: float) -> int:
+    """Duration of a step for scale times the quantities, in whole units, at least 1"""
+    if duration <= 0:
+        return duration
+    return max(round(duration * scale ** STEP_DURATION_EXPONENT), 1)
+
+
+def load_scaling_data(recipe: Recipe, db: Session) -> Tuple[List, List[Step]]:
+    """Ingredient rows and ordered steps of a recipe"""
+    ingredients = db.query(
+        RecipeIngredient.quantity,
+        RecipeIngredient.step_id,
+        Ingredient.id,
+        Ingredient.name,
+        Ingredient.unit
+    ).join(
+        Ingredient, RecipeIngredient.ingredient_id == Ingredient.id
+    ).filter(
+        RecipeIngredient.recipe_id == recipe.id
+    ).order_by(RecipeIngredient.id).all()
+
+    steps = db.query(Step).filter(
+        Step.recipe_id == recipe.id
+    ).order_by(Step.order_number).all()
+    return ingredients, steps
+
+
+def build_scaled_recipe(recipe: Recipe, ingredients: List, steps: List[Step],
+                        servings: int, scale_steps: bool) -> dict:
+    """Scale loaded ingredients (and optionally step durations) to servings"""
+    scale = servings / (recipe.servings or 1)
+    return {
+        "recipe_id": recipe.id,
+        "title": recipe.title,
+        "original_servings": recipe.servings,
+        "servings": servings,
+        "scale": round(scale, 4),
+        "ingredients": [
+            {
+                "ingredient_id": row.id,
+                "name": row.name,
+                "quantity": round_quantity(row.quantity * scale, row.unit),
+                "unit": row.unit,
+                "original_quantity": row.quantity,
+                "step_id": row.step_id,
+            }
+            for row in ingredients
+        ],
+        "steps": [
+            {
+                "id": step.id,
+                "order_number": step.order_number,
+                "action_type": step.action_type,
+                "temperature": step.temperature,
+                "speed": step.speed,
+                "duration": scale_duration(step.duration, scale) if scale_steps else step.duration,
+                "original_duration": step.duration,
+                "description": step.description,
+            }
+            for step in steps
+        ],
+    }
+
+
+def scale_recipe_many(
+    recipe: Recipe,
+    db: Session,
+    servings: Sequence[int],
+    scale_steps: bool = False,
+    catalog_version: int = 0
+) -> List[dict]:
+    """
+    Scale a recipe to several servings values
+
+    Args:
+        recipe: Recipe to scale (access must already be checked)
+        db: Database session
+        servings: Servings values, duplicates allowed
+        scale_steps: Also scale step durations
+        catalog_version: Ingredient catalog version the names and units reflect
+
+    Returns:
+        One scaled recipe per servings value, in the given order
+    """
+    results: Dict[int, dict] = {}
+    misses = []
+    for value in dict.fromkeys(servings):
+        cached = scale_cache.get(scale_cache_key(recipe, catalog_version, value, scale_steps))
+        if cached is None:
+            misses.append(value)
+        else:
+            results[value] = cached
+
+    if misses:
+        ingredients, steps = load_scaling_data(recipe, db)
+        for value in misses:
+            scaled = build_scaled_recipe(recipe, ingredients, steps, value, scale_steps)
+            scale_cache.set(scale_cache_key(recipe, catalog_version, value, scale_steps), scaled)
+            results[value] = scaled
+
+    return [results[value] for value in servings]
+
+
+def scale_recipe(recipe: Recipe, db: Session, servings: int, scale_steps: bool = False,
+                 catalog_version: int = 0) -> dict:
+    """Scale a recipe to one servings value, see scale_recipe_many"""
+    return scale_recipe_many(recipe, db, [servings], scale_steps, catalog_version)[0]
@@ -0,0 +1,154 @@
+"""
+Rotating refresh tokens.
+
+A login returns a short-lived access token and a long-lived refresh token.
+The refresh token is 256 random bits, so a plain SHA-256 of it is as safe to
+store as a password hash would be, and looking it up is one indexed equality
+query: refreshing an access token costs no bcrypt work at all.
+
+Tokens are single use. A refresh revokes the presented token and issues its
+successor in the same family. A revoked token presented again means two
+parties hold the same family (a stolen token), so the whole family is revoked
+and that login has to be repeated.
+"""
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from db.base import SessionLocal
+from db.entries.RefreshToken import RefreshToken
+from db.entries.User import User
+
+load_dotenv()
+
+REFRESH_TOKEN_TTL = timedelta(days=int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30")))
+REFRESH_TOKEN_PURGE_INTERVAL_SECONDS = 3600
+
+
+class InvalidRefreshToken(Exception):
+    """Unknown, expired, revoked or reused refresh token"""
+
+
+def hash_refresh_token(token: str) -> str:
+    """Stored form of a refresh token"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_id: int, family_id: Optional[str] = None) -> str:
+    """
+    Create a refresh token for a user; committed by the caller
+
+    Args:
+        db: Database session
+        user_id: Owner of the token
+        family_id: Family of the token being rotated, None for a new login
+
+    Returns:
+        The token value, only ever known to the client
+    """
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        expires_at=datetime.utcnow() + REFRESH_TOKEN_TTL,
+    ))
+    return token
+
+
+def revoke_refresh_token_family(db: Session, family_id: str) -> int:
+    """Revoke every live token of a family; committed by the caller"""
+    return db.query(RefreshToken).filter(
+        RefreshToken.family_id == family_id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False)
+
+
+def revoke_user_refresh_tokens(db: Session, user_id: int) -> int:
+    """Revoke every live token of a user; committed by the caller"""
+    return db.query(RefreshToken).filter(
+        RefreshToken.user_id == user_id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False)
+
+
+def rotate_refresh_token(db: Session, token: str) -> Tuple[User, str]:
+    """
+    Exchange a refresh token for its successor
+
+    Args:
+        db: Database session; committed by the caller on success
+        token: Refresh token presented by the client
+
+    Returns:
+        (owner of the token, new refresh token)
+
+    Raises:
+        InvalidRefreshToken: If the token cannot be used
+    """
+    stored = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == hash_refresh_token(token)).first()
+    if stored is None:
+        raise InvalidRefreshToken()
+
+    now = datetime.utcnow()
+    if stored.revoked_at is not None:
+        revoke_refresh_token_family(db, stored.family_id)
+        db.commit()
+        raise InvalidRefreshToken()
+    if stored.expires_at <= now:
+        raise InvalidRefreshToken()
+
+    user = db.query(User).filter(
+        User.id == stored.user_id, User.deleted_at.is_(None)).first()
+    if user is None:
+        raise InvalidRefreshToken()
+
+    # Conditional on revoked_at so two concurrent refreshes with the same
+    # token cannot both succeed
+    revoked = db.query(RefreshToken).filter(
+        RefreshToken.id == stored.id,
+        RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: now}, synchronize_session=False)
+    if not revoked:
+        db.rollback()
+        raise InvalidRefreshToken()
+
+    return user, issue_refresh_token(db, user.id, stored.family_id)
+
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    """
+    Revoke the family of a refresh token (logout)
+
+    Returns:
+        Whether the token was known
+    """
+    stored = db.query(RefreshToken.family_id).filter(
+        RefreshToken.token_hash == hash_refresh_token(token)).first()
+    if stored is None:
+        return False
+    revoke_refresh_token_family(db, stored.family_id)
+    db.commit()
+    return True
+
+
+def purge_expired_refresh_tokens() -> int:
+    """
+    Delete expired tokens; revoked ones are kept until they expire so reuse
+    can still be detected
+
+    Returns:
+        Number of deleted tokens
+    """
+    with SessionLocal() as session:
+        deleted = session.query(RefreshToken).filter(
+            RefreshToken.expires_at < datetime.utcnow()
+        ).delete()
+        session.commit()
+        return deleted
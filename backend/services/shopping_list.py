@@ -0,0 +1,87 @@
+"""
+Shopping list aggregation over several recipes.
+
+All ingredients of all requested recipes come from one query. Each recipe gets
+a scale factor (wanted servings / recipe servings, summed when a recipe is
+listed twice), every row is converted to the base unit of its dimension
+(g, ml or the counted unit) and the rows are summed per ingredient and unit in
+a single pass.
+"""
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from db.entries.Ingredient import Ingredient, VALID_CATEGORIES
+from db.entries.RecipeIngredient import RecipeIngredient
+from services.units import humanize, to_base
+
+QUANTITY_DECIMALS = 2
+
+
+def recipe_scales(recipes: Iterable, wanted: Iterable[Tuple[int, int]]) -> Dict[int, float]:
+    """
+    Scale factor per recipe
+
+    Args:
+        recipes: Recipes with id and servings
+        wanted: (recipe id, servings) pairs; servings None keeps the recipe's own
+
+    Returns:
+        Factor to multiply each recipe's quantities with
+    """
+    servings = {recipe.id: recipe.servings or 1 for recipe in recipes}
+    scales = {}
+    for recipe_id, wanted_servings in wanted:
+        scale = (wanted_servings or servings[recipe_id]) / servings[recipe_id]
+        scales[recipe_id] = scales.get(recipe_id, 0.0) + scale
+    return scales
+
+
+def build_shopping_list(db: Session, scales: Dict[int, float]) -> Dict[str, List[dict]]:
+    """
+    Combine the ingredients of several recipes
+
+    Args:
+        db: Database session
+        scales: Scale factor per recipe id (access must already be checked)
+
+    Returns:
+        Categories that have items mapped to them, sorted by name; an item has
+        ingredient_id, name, quantity, unit and the recipe_ids that need it
+    """
+    rows = db.query(
+        RecipeIngredient.recipe_id,
+        RecipeIngredient.quantity,
+        Ingredient.id,
+        Ingredient.name,
+        Ingredient.unit,
+        Ingredient.category
+    ).join(
+        Ingredient, RecipeIngredient.ingredient_id == Ingredient.id
+    ).filter(
+        RecipeIngredient.recipe_id.in_(list(scales))
+    ).all()
+
+    # (ingredient id, base unit) -> [quantity, name, category, recipe ids]
+    totals = {}
+    for recipe_id, quantity, ingredient_id, name, unit, category in rows:
+        base_quantity, base_unit = to_base(quantity * scales[recipe_id], unit)
+        entry = totals.get((ingredient_id, base_unit))
+        if entry is None:
+            entry = totals[(ingredient_id, base_unit)] = [0.0, name, category, set()]
+        entry[0] += base_quantity
+        entry[3].add(recipe_id)
+
+    grouped = {category: [] for category in sorted(VALID_CATEGORIES)}
+    for (ingredient_id, base_unit), (quantity, name, category, recipe_ids) in totals.items():
+        quantity, unit = humanize(quantity, base_unit)
+        grouped[category if category in grouped else "other"].append({
+            "ingredient_id": ingredient_id,
+            "name": name,
+            "quantity": round(quantity, QUANTITY_DECIMALS),
+            "unit": unit,
+            "recipe_ids": sorted(recipe_ids),
+        })
+    for items in grouped.values():
+        items.sort(key=lambda item: (item["name"].casefold(), item["unit"] or ""))
+    return {category: items for category, items in grouped.items() if items}
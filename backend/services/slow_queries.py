@@ -0,0 +1,257 @@
+"""
+Slow-query log.
+
+Engine events time every statement. One that takes SLOW_QUERY_THRESHOLD_MS or
+longer is logged with its fingerprint: the SQL with literals, placeholders
+and IN lists collapsed, so the same query with other values is the same
+entry. Only the names and types of the parameters are logged, never their
+values. The log also shows the route that ran the statement, or the background
+job.
+
+Fingerprints are aggregated (count, total and maximum time, routes) in a
+bounded table, and the top entries by total time are printed every
+SLOW_QUERY_REPORT_INTERVAL_SECONDS and served to admins.
+
+A sample of the slow SELECTs (SLOW_QUERY_EXPLAIN_SAMPLE_RATE) is explained on a
+separate thread and connection, with the original parameters, and the plan is
+kept with the fingerprint. The request that ran the query never waits for the
+EXPLAIN. When the queue of that thread is full, further samples are dropped.
+"""
+import hashlib
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from threading import Lock, Thread
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from services.instrumentation import current_route
+
+load_dotenv()
+
+# Non-positive disables the log
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.1"))
+SLOW_QUERY_REPORT_INTERVAL_SECONDS = float(os.getenv("SLOW_QUERY_REPORT_INTERVAL_SECONDS", "600"))
+SLOW_QUERY_TOP_N = int(os.getenv("SLOW_QUERY_TOP_N", "20"))
+SLOW_QUERY_MAX_FINGERPRINTS = 500
+SLOW_QUERY_EXPLAIN_QUEUE_SIZE = 100
+# Parameters named in a log line; the rest are counted
+SLOW_QUERY_SHAPE_PARAMS = 10
+
+EXPLAIN_PREFIXES = {"sqlite": "EXPLAIN QUERY PLAN "}
+EXPLAIN_THREAD_NAME = "slow-query-explain"
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|(?<!:):\w+")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_REPEATED_ROWS = re.compile(r"(\(\?\.\.\.\))(?:\s*,\s*\(\?\.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint_sql(statement: str) -> str:
+    """
+    SQL with every value replaced by ?, value lists by (?...) and whitespace
+    collapsed: "WHERE id IN (%(id_1)s, %(id_2)s)" -> "WHERE id IN (?...)"
+    """
+    sql = _STRING_LITERAL.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _VALUE_LIST.sub("(?...)", sql)
+    sql = _REPEATED_ROWS.sub(r"\1, ...", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def fingerprint_id(fingerprint: str) -> str:
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+
+
+def parameter_shape(parameters, executemany: bool = False) -> str:
+    """Names and types of statement parameters, without their values"""
+    if executemany:
+        rows = list(parameters or ())
+        return f"{len(rows)} x ({parameter_shape(rows[0]) if rows else ''})"
+    if isinstance(parameters, dict):
+        shapes = [f"{name}:{type(value).__name__}" for name, value in parameters.items()]
+    elif isinstance(parameters, (list, tuple)):
+        shapes = [type(value).__name__ for value in parameters]
+    else:
+        return ""
+    if len(shapes) > SLOW_QUERY_SHAPE_PARAMS:
+        hidden = len(shapes) - SLOW_QUERY_SHAPE_PARAMS
+        shapes = shapes[:SLOW_QUERY_SHAPE_PARAMS] + [f"+{hidden} more"]
+    return ", ".join(shapes)
+
+
+def origin() -> str:
+    """Route or background job running the current statement"""
+    route = current_route()
+    if route:
+        return route
+    thread = threading.current_thread().name
+    return thread if thread.startswith("job-") else "-"
+
+
+@dataclass
+class FingerprintStats:
+    """Aggregated slow executions of one fingerprint"""
+    fingerprint: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    last_seen: Optional[datetime] = None
+    plan: Optional[List[str]] = None
+    routes: Dict[str, int] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": fingerprint_id(self.fingerprint),
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 1),
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 1),
+            "routes": dict(self.routes),
+            "last_seen": self.last_seen.isoformat() if self.last_seen else None,
+            "plan": self.plan,
+        }
+
+
+class SlowQueryLog:
+    """
+    Times statements of an engine, logs and aggregates the slow ones
+
+    Args:
+        threshold_ms: Duration from which a statement is slow
+        explain_sample_rate: Share of slow SELECTs that get explained
+        max_fingerprints: Fingerprints kept, least recently seen dropped first
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_THRESHOLD_MS,
+                 explain_sample_rate: float = SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+                 max_fingerprints: int = SLOW_QUERY_MAX_FINGERPRINTS):
+        self.threshold_ms = threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.max_fingerprints = max_fingerprints
+        self.engine: Optional[Engine] = None
+        self.dropped_explains = 0
+        self._fingerprints: "OrderedDict[str, FingerprintStats]" = OrderedDict()
+        self._lock = Lock()
+        self._explains: "queue.Queue" = queue.Queue(maxsize=SLOW_QUERY_EXPLAIN_QUEUE_SIZE)
+        self._explain_thread: Optional[Thread] = None
+
+    def install(self, engine: Engine):
+        """Start timing the statements of an engine"""
+        if self.threshold_ms <= 0:
+            return
+        self.engine = engine
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        event.listen(engine, "handle_error", self._on_error)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        # The EXPLAINs themselves are not recorded
+        if threading.current_thread().name == EXPLAIN_THREAD_NAME:
+            return
+        self.record(statement, parameters, executemany, duration_ms)
+
+    def _on_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+    def record(self, statement: str, parameters, executemany: bool, duration_ms: float):
+        """Log and aggregate one slow statement"""
+        fingerprint = fingerprint_sql(statement)
+        route = origin()
+        print(f"Slow query {duration_ms:.0f} ms [{fingerprint_id(fingerprint)}] {route} "
+              f"params({parameter_shape(parameters, executemany)}): {fingerprint}")
+
+        with self._lock:
+            stats = self._fingerprints.get(fingerprint)
+            if stats is None:
+                stats = self._fingerprints[fingerprint] = FingerprintStats(fingerprint)
+                while len(self._fingerprints) > self.max_fingerprints:
+                    self._fingerprints.popitem(last=False)
+            self._fingerprints.move_to_end(fingerprint)
+            stats.count += 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.last_seen = datetime.utcnow()
+            stats.routes[route] = stats.routes.get(route, 0) + 1
+
+        if (not executemany and fingerprint.upper().startswith("SELECT")
+                and random.random() < self.explain_sample_rate):
+            self._queue_explain(fingerprint, statement, parameters)
+
+    def _queue_explain(self, fingerprint: str, statement: str, parameters):
+        with self._lock:
+            if self._explain_thread is None or not self._explain_thread.is_alive():
+                self._explain_thread = Thread(target=self._run_explains,
+                                              name=EXPLAIN_THREAD_NAME, daemon=True)
+                self._explain_thread.start()
+        try:
+            self._explains.put_nowait((fingerprint, statement, parameters))
+        except queue.Full:
+            self.dropped_explains += 1
+
+    def _run_explains(self):
+        while True:
+            fingerprint, statement, parameters = self._explains.get()
+            try:
+                plan = self.explain(statement, parameters)
+            except Exception as e:
+                plan = [f"EXPLAIN failed: {str(e)}"]
+            with self._lock:
+                stats = self._fingerprints.get(fingerprint)
+                if stats is not None:
+                    stats.plan = plan
+            print(f"Plan of slow query [{fingerprint_id(fingerprint)}]: " + " | ".join(plan))
+
+    def explain(self, statement: str, parameters) -> List[str]:
+        """Plan of a statement, one line per row of the EXPLAIN output"""
+        prefix = EXPLAIN_PREFIXES.get(self.engine.dialect.name, "EXPLAIN ")
+        with self.engine.connect() as connection:
+            rows = connection.exec_driver_sql(prefix + statement, parameters).mappings().all()
+        return [", ".join(f"{key}={value}" for key, value in row.items()
+                          if value is not None) for row in rows]
+
+    def top(self, limit: int = SLOW_QUERY_TOP_N) -> List[dict]:
+        """Fingerprints with the most total slow time first"""
+        with self._lock:
+            ranked = sorted(self._fingerprints.values(),
+                            key=lambda stats: stats.total_ms, reverse=True)[:limit]
+            return [stats.to_dict() for stats in ranked]
+
+    def print_report(self):
+        """Log the top fingerprints"""
+        top = self.top()
+        if not top:
+            return
+        print(f"Top {len(top)} slow query fingerprints:")
+        for rank, entry in enumerate(top, 1):
+            print(f"  {rank}. [{entry['id']}] {entry['count']} x, total {entry['total_ms']} ms, "
+                  f"max {entry['max_ms']} ms, routes {entry['routes']}: {entry['fingerprint']}")
+            if entry["plan"]:
+                print("     plan: " + " | ".join(entry["plan"]))
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,311 @@
+"""
+Unit registry and quantity conversion.
+
+Every unit belongs to a dimension with a base unit: grams for mass, millilitres
+for volume. Count units (piece, clove, slice, ...) have no common base; each
+only converts to itself, or to mass through the ingredient's piece weight.
+
+The registry precomputes the factor between every pair of convertible units
+and memoizes the resolution of free-text unit strings ("Tbsp.", "grams"), so
+converting a quantity is two dictionary lookups and a multiplication.
+Ingredient specific conversions (volume <-> mass through the density, pieces
+<-> mass through the piece weight) are precomputed per ingredient by
+UnitConverter as grams per unit.
+"""
+import math
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+MASS = "mass"
+VOLUME = "volume"
+COUNT = "count"
+MAX_MEMOIZED_SPELLINGS = 10000
+
+
+class UnitError(ValueError):
+    """Unknown unit or impossible conversion"""
+
+
+@dataclass(frozen=True)
+class Unit:
+    """A unit and its size in the base unit of its dimension"""
+    name: str
+    dimension: str
+    factor: float
+    aliases: Tuple[str, ...] = ()
+
+
+UNITS = (
+    # Mass, base gram
+    Unit("g", MASS, 1.0, ("gram", "grams", "gr")),
+    Unit("kg", MASS, 1000.0, ("kilogram", "kilograms", "kgs")),
+    Unit("mg", MASS, 0.001, ("milligram", "milligrams")),
+    Unit("oz", MASS, 28.349523125, ("ounce", "ounces")),
+    Unit("lb", MASS, 453.59237, ("lbs", "pound", "pounds")),
+
+    # Volume, base millilitre
+    Unit("ml", VOLUME, 1.0, ("milliliter", "milliliters", "millilitre", "millilitres")),
+    Unit("cl", VOLUME, 10.0, ("centiliter", "centiliters", "centilitre", "centilitres")),
+    Unit("dl", VOLUME, 100.0, ("deciliter", "deciliters", "decilitre", "decilitres")),
+    Unit("l", VOLUME, 1000.0, ("liter", "liters", "litre", "litres")),
+    Unit("tsp", VOLUME, 4.92892159375, ("teaspoon", "teaspoons", "tsps")),
+    Unit("tbsp", VOLUME, 14.78676478125, ("tablespoon", "tablespoons", "tbsps", "tbs")),
+    Unit("cup", VOLUME, 236.5882365, ("cups",)),
+    Unit("fl oz", VOLUME, 29.5735295625, ("floz", "fluid ounce", "fluid ounces")),
+    Unit("pinch", VOLUME, 0.3080576, ("pinches",)),
+
+    # Counted items; only convertible to mass through a piece weight
+    Unit("piece", COUNT, 1.0, ("pieces", "pc", "pcs", "whole", "unit", "units", "item", "items")),
+    Unit("clove", COUNT, 1.0, ("cloves",)),
+    Unit("slice", COUNT, 1.0, ("slices",)),
+    Unit("bunch", COUNT, 1.0, ("bunches",)),
+    Unit("sprig", COUNT, 1.0, ("sprigs",)),
+    Unit("leaf", COUNT, 1.0, ("leaves",)),
+    Unit("can", COUNT, 1.0, ("cans", "tin", "tins")),
+)
+
+
+def _unit_key(text: str) -> str:
+    return " ".join(text.casefold().replace(".", " ").split())
+
+
+class UnitRegistry:
+    """Lookup of units by any spelling plus the conversion factor table"""
+
+    def __init__(self, units: Iterable[Unit]):
+        self.units: Dict[str, Unit] = {unit.name: unit for unit in units}
+        self._spellings: Dict[str, Unit] = {}
+        for unit in self.units.values():
+            for spelling in (unit.name, *unit.aliases):
+                self._spellings[_unit_key(spelling)] = unit
+        self._resolved: Dict[str, Optional[Unit]] = {}
+        self._lock = Lock()
+
+        # factor[(a, b)] converts a quantity in a to b
+        self.factors: Dict[Tuple[str, str], float] = {
+            (a.name, b.name): a.factor / b.factor
+            for a in self.units.values()
+            for b in self.units.values()
+            if a.dimension == b.dimension and (a.dimension != COUNT or a is b)
+        }
+
+    def find(self, text: Optional[str]) -> Optional[Unit]:
+        """Unit for a free-text spelling, None if unknown"""
+        if text is None:
+            return None
+        try:
+            return self._resolved[text]
+        except KeyError:
+            unit = self._spellings.get(_unit_key(text))
+            # Spellings come from user input; stop memoizing past a bound
+            if len(self._resolved) < MAX_MEMOIZED_SPELLINGS:
+                with self._lock:
+                    self._resolved[text] = unit
+            return unit
+
+    def get(self, text: str) -> Unit:
+        """
+        Unit for a free-text spelling
+
+        Raises:
+            UnitError: If the unit is unknown
+        """
+        unit = self.find(text)
+        if unit is None:
+            raise UnitError(f"Unknown unit '{text}'")
+        return unit
+
+    def factor(self, from_unit: str, to_unit: str) -> Optional[float]:
+        """Factor between two units without ingredient data, None if incompatible"""
+        source, target = self.find(from_unit), self.find(to_unit)
+        if source is None or target is None:
+            return None
+        return self.factors.get((source.name, target.name))
+
+
+unit_registry = UnitRegistry(UNITS)
+
+
+class UnitConverter:
+    """
+    Conversions for one ingredient
+
+    Args:
+        unit: The ingredient's own unit
+        density: Grams per millilitre, enables volume <-> mass
+        piece_weight: Grams per one of the ingredient's own count unit,
+            enables that unit <-> mass
+    """
+
+    def __init__(
+        self,
+        unit: Optional[str] = None,
+        density: Optional[float] = None,
+        piece_weight: Optional[float] = None,
+        registry: UnitRegistry = unit_registry
+    ):
+        self.registry = registry
+        self.unit = registry.find(unit)
+        self.density = density
+        self.piece_weight = piece_weight
+
+        # Grams per unit for every unit that can be expressed as mass
+        self.grams: Dict[str, float] = {}
+        for candidate in registry.units.values():
+            if candidate.dimension == MASS:
+                self.grams[candidate.name] = candidate.factor
+            elif candidate.dimension == VOLUME and density:
+                self.grams[candidate.name] = candidate.factor * density
+            elif candidate.dimension == COUNT and piece_weight and candidate is self.unit:
+                self.grams[candidate.name] = piece_weight
+        self._factors: Dict[Tuple[str, str], float] = {}
+
+    def resolve(self, text: Optional[str]) -> Unit:
+        """
+        Unit for a spelling, the ingredient's own unit for None
+
+        Raises:
+            UnitError: If the unit is unknown
+        """
+        if text is None:
+            if self.unit is None:
+                raise UnitError("Ingredient has no known unit")
+            return self.unit
+        return self.registry.get(text)
+
+    def factor(self, from_unit: Optional[str] = None, to_unit: Optional[str] = None) -> float:
+        """
+        Factor converting a quantity from one unit to another
+
+        Args:
+            from_unit: Source unit, the ingredient's unit if omitted
+            to_unit: Target unit, the ingredient's unit if omitted
+
+        Raises:
+            UnitError: If a unit is unknown or the conversion needs a density
+                or piece weight the ingredient does not have
+        """
+        source, target = self.resolve(from_unit), self.resolve(to_unit)
+        key = (source.name, target.name)
+        try:
+            return self._factors[key]
+        except KeyError:
+            pass
+
+        factor = self.registry.factors.get(key)
+        if factor is None:
+            if source.name not in self.grams or target.name not in self.grams:
+                raise UnitError(self._missing_data_message(source, target))
+            factor = self.grams[source.name] / self.grams[target.name]
+        self._factors[key] = factor
+        return factor
+
+    def _missing_data_message(self, source: Unit, target: Unit) -> str:
+        counted = [unit for unit in (source, target) if unit.dimension == COUNT]
+        if len(counted) == 2 or any(unit is not self.unit for unit in counted):
+            return f"Cannot convert {source.name} to {target.name}"
+        if counted and counted[0].name not in self.grams:
+            return (f"Converting {source.name} to {target.name} needs the weight "
+                    f"of one {counted[0].name} of this ingredient")
+        return f"Converting {source.name} to {target.name} needs the density of this ingredient"
+
+    def convert(self, quantity: float, from_unit: Optional[str] = None,
+                to_unit: Optional[str] = None) -> float:
+        """Convert one quantity"""
+        return quantity * self.factor(from_unit, to_unit)
+
+    def convert_many(self, quantities: Sequence[float], from_units: Sequence[Optional[str]],
+                     to_unit: Optional[str] = None) -> List[float]:
+        """
+        Convert many quantities to one unit
+
+        Each distinct source unit is resolved once; the rest is a lookup and a
+        multiplication per quantity.
+        """
+        factors = {unit: self.factor(unit, to_unit) for unit in set(from_units)}
+        return [quantity * factors[unit] for quantity, unit in zip(quantities, from_units)]
+
+
+def to_base(quantity: float, unit: Optional[str],
+            converter: Optional[UnitConverter] = None,
+            registry: UnitRegistry = unit_registry) -> Tuple[float, Optional[str]]:
+    """
+    Express a quantity in the base unit of its dimension, preferring grams
+    whenever the ingredient's density or piece weight allows it
+
+    Args:
+        quantity: Quantity in unit
+        unit: Free-text unit
+        converter: Converter of the ingredient, for volume and piece weights
+
+    Returns:
+        (quantity, unit) in g, ml or the counted unit; unknown units are
+        returned unchanged
+    """
+    found = registry.find(unit)
+    if found is None:
+        return quantity, unit
+    if converter is not None and found.name in converter.grams:
+        return quantity * converter.grams[found.name], "g"
+    if found.dimension == COUNT:
+        return quantity, found.name
+    return quantity * found.factor, "g" if found.dimension == MASS else "ml"
+
+
+# base unit -> (larger unit, its size in the base unit)
+DISPLAY_UNITS = {"g": ("kg", 1000.0), "ml": ("l", 1000.0)}
+
+
+def humanize(quantity: float, unit: Optional[str]) -> Tuple[float, Optional[str]]:
+    """Switch a base quantity to the larger unit once it reaches one of those (1500 g -> 1.5 kg)"""
+    larger = DISPLAY_UNITS.get(unit)
+    if larger and quantity >= larger[1]:
+        return quantity / larger[1], larger[0]
+    return quantity, unit
+
+
+# Rounding increments. Small metric units are rounded by magnitude, kitchen
+# measures to the fractions found on measuring spoons and cups, counted items
+# to halves. Other masses and volumes (kg, l, oz, lb...) keep two significant
+# digits, so a small amount is not inflated by a fixed step (0.004 kg stays
+# 0.004 kg instead of becoming 0.01 kg); unknown units keep two decimals.
+FINE_UNIT_STEPS = ((100.0, 5.0), (10.0, 1.0), (0.0, 0.1))
+FINE_UNITS = {"g", "mg", "ml"}
+MEASURE_STEPS = {"tsp": 0.25, "tbsp": 0.25, "cup": 0.25, "fl oz": 0.5, "pinch": 1.0}
+COUNT_STEP = 0.5
+SIGNIFICANT_DIGITS = 2
+DEFAULT_STEP = 0.01
+
+
+def rounding_step(quantity: float, unit: Optional[str],
+                  registry: UnitRegistry = unit_registry) -> float:
+    """Increment a quantity in unit is rounded to"""
+    found = registry.find(unit)
+    if found is None:
+        return DEFAULT_STEP
+    if found.name in FINE_UNITS:
+        return next(step for threshold, step in FINE_UNIT_STEPS if quantity >= threshold)
+    if found.name in MEASURE_STEPS:
+        return MEASURE_STEPS[found.name]
+    if found.dimension == COUNT:
+        return COUNT_STEP
+    if found.dimension in (MASS, VOLUME):
+        return 10.0 ** (math.floor(math.log10(quantity)) - SIGNIFICANT_DIGITS + 1)
+    return DEFAULT_STEP
+
+
+def round_quantity(quantity: float, unit: Optional[str],
+                   registry: UnitRegistry = unit_registry) -> float:
+    """
+    Round a quantity to what a cook would measure (13.7 g -> 14 g,
+    0.6 tsp -> 0.5 tsp, 2.7 cloves -> 2.5 cloves)
+
+    A positive quantity never rounds down to zero; it becomes one increment.
+    """
+    if quantity <= 0:
+        return 0.0
+    step = rounding_step(quantity, unit, registry)
+    rounded = max(round(quantity / step), 1) * step
+    # Strip float noise such as 0.30000000000000004
+    return float(f"{rounded:.12g}")
@@ -0,0 +1,41 @@
+"""
+Dialect-aware INSERT ... ON DUPLICATE KEY UPDATE
+"""
+from typing import Callable, List
+
+from sqlalchemy import Table
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+
+def upsert_statement(
+    dialect: str,
+    table: Table,
+    conflict_columns: List[str],
+    update: Callable[[object], dict]
+):
+    """
+    Build an insert that updates the existing row when a unique key clashes
+
+    Execute it with a list of parameter dicts: the statement is compiled once
+    and the driver batches the rows.
+
+    Args:
+        dialect: Name of the database dialect ("mysql" in production)
+        table: Target table
+        conflict_columns: Unique key columns (ON CONFLICT target on non-MySQL)
+        update: Called with the incoming row's columns, returns the SET clause
+
+    Returns:
+        Insert statement
+    """
+    if dialect == "mysql":
+        statement = mysql.insert(table)
+        return statement.on_duplicate_key_update(update(statement.inserted))
+
+    # Development databases
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c[column] for column in conflict_columns],
+        set_=update(statement.excluded)
+    )
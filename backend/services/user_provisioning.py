@@ -0,0 +1,145 @@
+"""
+User creation driven by the unique indexes.
+
+Signup does not look for an existing username or email first: that costs two
+round trips and is racy anyway. The INSERT is attempted and a unique index
+violation is mapped back to the column it concerns.
+
+Batch provisioning hashes all passwords on the hashing pool up front, then
+inserts the accounts in chunks with one multi-row INSERT each. A chunk that
+hits a unique index is retried row by row inside savepoints, so only the
+conflicting accounts are rejected.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from db.entries.User import User, normalize_username
+
+load_dotenv()
+
+USER_BATCH_MAX_ROWS = int(os.getenv("USER_BATCH_MAX_ROWS", "1000"))
+USER_BATCH_CHUNK_SIZE = int(os.getenv("USER_BATCH_CHUNK_SIZE", "200"))
+UNIQUE_USER_FIELDS = ("username", "email")
+
+CREATED = "created"
+CONFLICT = "conflict"
+DUPLICATE = "duplicate"
+
+# Column named in a unique violation: MySQL, SQLite, PostgreSQL
+UNIQUE_VIOLATION_PATTERNS = (
+    re.compile(r"for key '(?:\w+\.)?(\w+)'"),
+    re.compile(r"UNIQUE constraint failed: \w+\.(\w+)"),
+    re.compile(r"Key \((\w+)\)="),
+)
+
+
+def conflicting_user_field(error: IntegrityError) -> Optional[str]:
+    """
+    Unique user column an IntegrityError was raised for
+
+    Returns:
+        "username", "email" or None if the error is about something else
+    """
+    message = str(error.orig)
+    for pattern in UNIQUE_VIOLATION_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            # MySQL names the index of a unique column after the column
+            field = match.group(1)
+            return field if field in UNIQUE_USER_FIELDS else None
+    return None
+
+
+@dataclass
+class ProvisionRow:
+    """One account of a batch and its outcome"""
+    row: int
+    username: str
+    email: str
+    hashed_password: str
+    id: Optional[int] = None
+    status: Optional[str] = None
+    field: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        result = {"row": self.row, "id": self.id, "status": self.status}
+        if self.field:
+            result["field"] = self.field
+        return result
+
+
+def _values(row: ProvisionRow) -> dict:
+    return {
+        "username": row.username,
+        "normalized_username": normalize_username(row.username),
+        "email": row.email,
+        "hashed_password": row.hashed_password,
+    }
+
+
+def _insert_chunk(db: Session, chunk: List[ProvisionRow]):
+    """Insert one chunk, isolating conflicting rows if the bulk insert fails"""
+    table = User.__table__
+    try:
+        with db.begin_nested():
+            db.execute(insert(table), [_values(row) for row in chunk])
+        for row in chunk:
+            row.status = CREATED
+    except IntegrityError:
+        for row in chunk:
+            try:
+                with db.begin_nested():
+                    db.execute(insert(table), [_values(row)])
+                row.status = CREATED
+            except IntegrityError as e:
+                row.status, row.field = CONFLICT, conflicting_user_field(e)
+
+    created = {row.username: row for row in chunk if row.status == CREATED}
+    if created:
+        for user_id, username in db.query(User.id, User.username).filter(
+                User.username.in_(list(created))):
+            created[username].id = user_id
+    db.commit()
+
+
+def provision_users(db: Session, rows: List[ProvisionRow],
+                    chunk_size: int = USER_BATCH_CHUNK_SIZE) -> dict:
+    """
+    Create many accounts whose passwords are already hashed
+
+    Args:
+        db: Database session
+        rows: Accounts in request order
+        chunk_size: Accounts per INSERT and transaction
+
+    Returns:
+        Totals per status and the id/status of every row, in request order;
+        conflicts name the field that is already taken
+    """
+    # A username or email repeated within the batch: the first row wins
+    seen: Dict[str, Dict[str, int]] = {field: {} for field in UNIQUE_USER_FIELDS}
+    pending = []
+    for row in rows:
+        for field in UNIQUE_USER_FIELDS:
+            if getattr(row, field) in seen[field]:
+                row.status, row.field = DUPLICATE, field
+                break
+        else:
+            for field in UNIQUE_USER_FIELDS:
+                seen[field][getattr(row, field)] = row.row
+            pending.append(row)
+
+    for start in range(0, len(pending), chunk_size):
+        _insert_chunk(db, pending[start:start + chunk_size])
+
+    totals = {status: 0 for status in (CREATED, CONFLICT, DUPLICATE)}
+    for row in rows:
+        totals[row.status] += 1
+    return {**totals, "results": [row.to_dict() for row in rows]}
@@ -0,0 +1,123 @@
+"""
+Username lookup and prefix search.
+
+Both go through users.normalized_username, indexed together with the id. A
+lookup is one equality probe of that index. A prefix search is a range scan
+of it (LIKE 'prefix%' on the indexed column) that stops after one page, and
+the next page continues after the last (normalized_username, id) returned, so
+deep pages cost the same as the first one.
+
+Only the public columns are read: loading User entities would also load every
+user's recipes (User.recipes is a selectin relationship).
+"""
+import base64
+import binascii
+import json
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from db.entries.User import User, normalize_username
+
+USER_SEARCH_DEFAULT_LIMIT = 20
+USER_SEARCH_MAX_LIMIT = 100
+
+LIKE_ESCAPE = "/"
+
+USER_COLUMNS = (User.id, User.username, User.email, User.normalized_username)
+
+
+class InvalidCursor(Exception):
+    """Search cursor that was not issued by search_users"""
+
+
+def encode_cursor(normalized_username: str, user_id: int) -> str:
+    """Opaque cursor pointing after one search result"""
+    raw = json.dumps([normalized_username, user_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Position encoded by encode_cursor
+
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    try:
+        normalized_username, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor()
+    if not isinstance(normalized_username, str) or not isinstance(user_id, int):
+        raise InvalidCursor()
+    return normalized_username, user_id
+
+
+def prefix_pattern(prefix: str) -> str:
+    """
+    LIKE pattern matching a literal prefix; a constant pattern without
+    leading wildcard lets the database scan the index range
+    """
+    for special in (LIKE_ESCAPE, "%", "_"):
+        prefix = prefix.replace(special, LIKE_ESCAPE + special)
+    return prefix + "%"
+
+
+def find_user_by_username(db: Session, username: str) -> Optional[Row]:
+    """
+    Live user with a username, ignoring case and accents
+
+    An exact match wins over other users whose names normalize the same way.
+    """
+    candidates = db.query(*USER_COLUMNS).filter(
+        User.normalized_username == normalize_username(username),
+        User.deleted_at.is_(None)
+    ).order_by(User.id).all()
+    for user in candidates:
+        if user.username == username:
+            return user
+    return candidates[0] if candidates else None
+
+
+def search_users(
+    db: Session,
+    query: str,
+    limit: int = USER_SEARCH_DEFAULT_LIMIT,
+    cursor: Optional[str] = None
+) -> Tuple[List[Row], Optional[str]]:
+    """
+    Live users whose username starts with a prefix, ignoring case and accents
+
+    Args:
+        db: Database session
+        query: Username prefix
+        limit: Page size
+        cursor: next_cursor of the previous page, None for the first page
+
+    Returns:
+        (users ordered by normalized username and id, cursor of the next page
+        or None on the last page)
+
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    search = db.query(*USER_COLUMNS).filter(
+        User.normalized_username.like(
+            prefix_pattern(normalize_username(query)), escape=LIKE_ESCAPE),
+        User.deleted_at.is_(None)
+    )
+    if cursor is not None:
+        after_name, after_id = decode_cursor(cursor)
+        search = search.filter(or_(
+            User.normalized_username > after_name,
+            and_(User.normalized_username == after_name, User.id > after_id)
+        ))
+
+    # One extra row tells whether there is a next page
+    users = search.order_by(User.normalized_username, User.id).limit(limit + 1).all()
+    if len(users) <= limit:
+        return users, None
+    users = users[:limit]
+    return users, encode_cursor(users[-1].normalized_username, users[-1].id)
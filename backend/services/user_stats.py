@@ -0,0 +1,212 @@
+"""
+Per-user profile statistics.
+
+Every live recipe adds to its owner's recipe_count, public_recipe_count (while
+public) and total preparation and cooking time. Like the ingredient usage
+counters, recipe write paths read the contribution of the recipes they touch
+before the change and add the difference after it, in the same transaction
+(see services.recipe_counters).
+
+The most used ingredients per user would need a grouped scan of all their
+recipe ingredients, so they are a rollup: a periodic job walks the users in
+batches, recomputes the rollup, and rewrites the counters of users whose
+counters drifted. A profile view is then one read of one row.
+"""
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import case, distinct, func
+from sqlalchemy.orm import Session
+
+from db.base import SessionLocal
+from db.entries.Ingredient import Ingredient
+from db.entries.Recipe import Recipe
+from db.entries.RecipeIngredient import RecipeIngredient
+from db.entries.User import User
+from db.entries.UserStats import UserStats
+from services.upsert import upsert_statement
+
+load_dotenv()
+
+USER_STATS_REFRESH_INTERVAL_SECONDS = float(os.getenv("USER_STATS_REFRESH_INTERVAL_SECONDS", "900"))
+USER_STATS_BATCH_SIZE = int(os.getenv("USER_STATS_BATCH_SIZE", "500"))
+USER_TOP_INGREDIENTS = 5
+
+COUNTER_COLUMNS = ("recipe_count", "public_recipe_count",
+                   "total_preparation_time", "total_cooking_time")
+
+# user id -> (recipe count, public recipe count, preparation time, cooking time)
+Stats = Dict[int, Tuple[int, int, int, int]]
+
+
+def _stats(db: Session, *criteria) -> Stats:
+    """Sum the live recipes matching criteria per owner"""
+    return {
+        user_id: (total, int(public or 0), int(preparation or 0), int(cooking or 0))
+        for user_id, total, public, preparation, cooking in db.query(
+            Recipe.user_id,
+            func.count(Recipe.id),
+            func.sum(case((Recipe.is_public == True, 1), else_=0)),
+            func.sum(Recipe.preparation_time),
+            func.sum(Recipe.cooking_time)
+        ).filter(
+            Recipe.deleted_at.is_(None),
+            *criteria
+        ).group_by(Recipe.user_id)
+    }
+
+
+def recipe_stats(db: Session, recipe_ids: Iterable[int]) -> Stats:
+    """
+    Contribution of some recipes to their owners' statistics
+
+    Args:
+        db: Database session; pending changes are flushed first
+        recipe_ids: Recipes to look at; deleted ones contribute nothing
+
+    Returns:
+        Counters per owner
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return {}
+    db.flush()
+    return _stats(db, Recipe.id.in_(recipe_ids))
+
+
+def _write_stats(db: Session, rows: List[dict], increment: bool):
+    """Upsert statistics rows, adding to or replacing the stored counters"""
+    if not rows:
+        return
+    table = UserStats.__table__
+
+    def update(incoming):
+        if increment:
+            return {column: table.c[column] + incoming[column] for column in COUNTER_COLUMNS}
+        return {column: incoming[column] for column in COUNTER_COLUMNS}
+
+    # Rows are locked in id order so concurrent writers cannot deadlock
+    rows.sort(key=lambda row: row["user_id"])
+    db.execute(upsert_statement(
+        db.get_bind().dialect.name, table, ["user_id"], update), rows)
+
+
+def apply_stats_change(db: Session, before: Stats, after: Stats):
+    """
+    Add the difference between two contributions to the statistics
+
+    Args:
+        db: Database session of the recipe write, committed by the caller
+        before: Contribution of the touched recipes before the write
+        after: Contribution of the same recipes after it
+    """
+    deltas = []
+    for user_id in before.keys() | after.keys():
+        old = before.get(user_id, (0, 0, 0, 0))
+        new = after.get(user_id, (0, 0, 0, 0))
+        if new != old:
+            deltas.append({
+                "user_id": user_id,
+                **{column: n - o for column, n, o in zip(COUNTER_COLUMNS, new, old)},
+            })
+    _write_stats(db, deltas, increment=True)
+
+
+def _top_ingredients(db: Session, user_ids: List[int]) -> Dict[int, str]:
+    """Most used ingredients of some users, encoded as stored"""
+    ranked: Dict[int, list] = {user_id: [] for user_id in user_ids}
+    for user_id, ingredient_id, name, count in db.query(
+        Recipe.user_id,
+        Ingredient.id,
+        Ingredient.name,
+        func.count(distinct(RecipeIngredient.recipe_id))
+    ).join(
+        Recipe, RecipeIngredient.recipe_id == Recipe.id
+    ).join(
+        Ingredient, RecipeIngredient.ingredient_id == Ingredient.id
+    ).filter(
+        Recipe.deleted_at.is_(None),
+        Recipe.user_id.in_(user_ids)
+    ).group_by(Recipe.user_id, Ingredient.id, Ingredient.name):
+        ranked[user_id].append((-count, ingredient_id, name))
+
+    return {
+        user_id: json.dumps([
+            {"ingredient_id": ingredient_id, "name": name, "recipe_count": -negative}
+            for negative, ingredient_id, name in sorted(entries)[:USER_TOP_INGREDIENTS]
+        ])
+        for user_id, entries in ranked.items()
+    }
+
+
+def _refresh_batch(db: Session, user_ids: List[int]) -> int:
+    """Recompute rollup and counters of some users; returns corrected counters"""
+    actual = _stats(db, Recipe.user_id.in_(user_ids))
+    stored = {
+        row.user_id: tuple(getattr(row, column) for column in COUNTER_COLUMNS)
+        for row in db.query(UserStats).filter(UserStats.user_id.in_(user_ids))
+    }
+    corrections = []
+    for user_id in user_ids:
+        counters = actual.get(user_id, (0, 0, 0, 0))
+        if stored.get(user_id) != counters:
+            corrections.append({"user_id": user_id, **dict(zip(COUNTER_COLUMNS, counters))})
+    _write_stats(db, corrections, increment=False)
+
+    now = datetime.utcnow()
+    db.bulk_update_mappings(UserStats, [
+        {"user_id": user_id, "top_ingredients": encoded, "top_ingredients_updated_at": now}
+        for user_id, encoded in _top_ingredients(db, user_ids).items()
+    ])
+    return len(corrections)
+
+
+def refresh_user_stats(batch_size: int = USER_STATS_BATCH_SIZE) -> int:
+    """
+    Recompute the top ingredients of every live user and correct drifted
+    counters, one short transaction per batch of users
+
+    Returns:
+        Number of users processed
+    """
+    processed = corrected = 0
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            user_ids = [user_id for (user_id,) in db.query(User.id).filter(
+                User.id > last_id,
+                User.deleted_at.is_(None)
+            ).order_by(User.id).limit(batch_size)]
+            if not user_ids:
+                break
+            try:
+                corrected += _refresh_batch(db, user_ids)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            processed += len(user_ids)
+            last_id = user_ids[-1]
+
+    if corrected:
+        print(f"Corrected statistics of {corrected} users")
+    return processed
+
+
+def load_user_stats(db: Session, user_id: int):
+    """
+    Statistics of a live user in one query
+
+    Returns:
+        (user id, UserStats or None when the user never had a recipe), or
+        None if the user does not exist
+    """
+    return db.query(User.id, UserStats).outerjoin(
+        UserStats, UserStats.user_id == User.id
+    ).filter(
+        User.id == user_id,
+        User.deleted_at.is_(None)
+    ).first()